@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+'''Measure exporting a large library, loading the models against streaming the raw rows.
+
+The naive export selects the videos as models with their uploaders and playlists and
+dumps them one by one, holding the whole result of the query. The streaming export
+fetches chunks of plain tuples with the joins done by SQLite. An incremental export
+since the watermark of a recent sync follows:
+
+    python benchmarks/bench_export.py --videos 200000 --changed 1000
+'''
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import video_id
+from youtube_downloader_cli.export import export, EXPORT_FORMATS, PARQUET_FORMAT
+from youtube_downloader_cli.models import Uploader, Playlist, Video, PlaylistEntry, setup_database
+
+
+def generate(videos, changed):
+    'Insert the videos, the changed ones updated an hour after the rest, returning the watermark between.'
+    database = Video._meta.database
+    synced_at = datetime.now() - timedelta(days=1)
+    watermark = synced_at + timedelta(minutes=30)
+
+    with database.atomic():
+        for i in range(100):
+            Uploader.create(id='UC%04d' % i, name='Uploader %d' % i, url='https://www.youtube.com/user/u%d' % i)
+            Playlist.create(id='PL%04d' % i, title='Playlist %d' % i, uploader='UC%04d' % i)
+
+        cursor = database.cursor()
+        cursor.executemany(
+            'INSERT INTO video (id, title, webpage_url, duration, view_count, average_rating, upload_date, '
+            'uploaded_at, description, categories, tags, total_bytes, uploader_id, playlist_id, synced_at, '
+            'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ((video_id(i), 'Video number %d' % i, 'https://www.youtube.com/watch?v=%s' % video_id(i), i % 3600,
+              i * 7, 4.5, '20200101', '2020-01-01', 'The description of video %d. ' % i * 5, '["Music"]',
+              json.dumps(['tag%d' % (i % 50), 'tag%d' % (i % 7)]), i * 1024, 'UC%04d' % (i % 100),
+              'PL%04d' % (i % 100), str(synced_at),
+              str(synced_at + timedelta(hours=1) if i >= videos - changed else synced_at))
+             for i in range(videos)))
+        cursor.executemany('INSERT INTO playlistentry (playlist_id, video_id) VALUES (?, ?)',
+                           (('PL%04d' % (i % 100), video_id(i)) for i in range(videos)))
+
+    return watermark
+
+
+def naive(path):
+    'The models with their joined uploaders and playlists, all of them loaded by the query.'
+    with open(path, 'w', encoding='utf-8') as f:
+        query = (Video
+                 .select(Video, Uploader, Playlist)
+                 .join(Uploader, on=(Video.uploader == Uploader.id))
+                 .switch(Video)
+                 .join(Playlist, on=(Video.playlist == Playlist.id)))
+        rows = 0
+
+        for video in list(query):
+            row = {name: getattr(video, name) for name in Video._meta.columns}
+            row.update(uploader_id=video.uploader.id, uploader_name=video.uploader.name,
+                       playlist_id=video.playlist.id, playlist_title=video.playlist.title)
+            f.write(json.dumps(row, default=str) + '\n')
+            rows += 1
+
+    return rows
+
+
+def measure(name, func, path):
+    begin = time.perf_counter()
+    rows = func(path)
+    elapsed = time.perf_counter() - begin
+
+    # Traced apart, tracemalloc slows the allocations down too much to time them.
+    tracemalloc.start()
+    func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    click.echo('%-20s %8d rows in %6.2fs, %8.0f rows/s, %6.1f MiB peak, %6.1f MiB written'
+               % (name, rows, elapsed, rows / elapsed, peak / 1024 ** 2, os.path.getsize(path) / 1024 ** 2))
+
+
+@click.command()
+@click.option('--videos', default=200000, type=click.IntRange(min=1), show_default=True)
+@click.option('--changed', default=1000, type=click.IntRange(min=0), show_default=True,
+              help='The videos changed after the watermark of the previous export.')
+@click.option('--chunk-size', default=10000, type=click.IntRange(min=1), show_default=True)
+def main(videos, changed, chunk_size):
+    root = os.environ['HOME']
+    setup_database(os.path.join(root, 'bench.sqlite3'))
+    watermark = generate(videos, changed)
+
+    measure('naive jsonl', naive, os.path.join(root, 'naive.jsonl'))
+
+    for format in EXPORT_FORMATS:
+        if format == PARQUET_FORMAT:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                click.echo('parquet skipped, pyarrow is not installed')
+                continue
+
+        measure('streaming ' + format, lambda path: export('videos', format, path, chunk_size=chunk_size)[0],
+                os.path.join(root, 'export.' + format))
+
+    measure('incremental jsonl', lambda path: export('videos', 'jsonl', path, since=watermark,
+                                                     chunk_size=chunk_size)[0],
+            os.path.join(root, 'incremental.jsonl'))
+
+
+if __name__ == '__main__':
+    main()
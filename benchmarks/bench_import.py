@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+'''Measure the startup cost of the short commands with python -X importtime.
+
+Fails if any of the heavy modules is imported, if the config directory or the log file
+is created, or if the cumulative import time exceeds the budget, so it can guard the
+startup in CI:
+
+    python benchmarks/bench_import.py --max-ms 100
+'''
+
+import os
+import re
+import sys
+import subprocess
+import tempfile
+import click
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+# The modules only the commands doing the real work may load.
+HEAVY_MODULES = ('youtube_dl', 'peewee', 'playhouse', 'requests', 'translate', 'coloredlogs')
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_times(args, startup=()):
+    '''Run python with args under -X importtime, returning the total microseconds of the top
+    level imports, the {module: cumulative microseconds} and the files created.
+
+    The startup modules, imported by the interpreter whatever the script does, are left out.
+    '''
+    home = tempfile.mkdtemp(prefix='ytdl-bench-')
+    cwd = tempfile.mkdtemp(prefix='ytdl-bench-')
+    env = dict(os.environ, HOME=home)
+
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+
+    times = {}
+    total = 0
+
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+
+        if not match:
+            continue
+
+        cumulative, indent, module = int(match.group(2)), len(match.group(3)), match.group(4)
+
+        if module in startup:
+            continue
+
+        times[module] = cumulative
+
+        # The top level imports only, the nested ones are included in their cumulative time.
+        if indent == 1:
+            total += cumulative
+
+    created = [path for path in (os.path.join(home, '.config'), os.path.join(cwd, 'main.log')) if os.path.exists(path)]
+    return total, times, created
+
+
+@click.command()
+@click.option('--max-ms', default=100, type=click.IntRange(min=1), show_default=True,
+              help='The import time budget of every command line.')
+@click.option('--top', default=5, type=click.IntRange(min=0), show_default=True,
+              help='Show the slowest top level imports.')
+def main(max_ms, top):
+    failed = False
+    _, startup, _ = import_times(['-c', 'pass'])
+
+    for args in (['--help'], ['parse', '--help'], ['status', '--help']):
+        total, times, created = import_times([MAIN] + args, startup)
+        heavy = sorted(set(module.split('.')[0] for module in times) & set(HEAVY_MODULES))
+
+        click.echo('main.py %s: %.1fms' % (' '.join(args), total / 1000))
+
+        for module, cumulative in sorted(times.items(), key=lambda item: -item[1])[:top]:
+            click.echo('    %8.1fms %s' % (cumulative / 1000, module))
+
+        if heavy:
+            failed = True
+            click.echo('    heavy modules imported: %s' % ', '.join(heavy))
+
+        if created:
+            failed = True
+            click.echo('    files created: %s' % ', '.join(created))
+
+        if total > max_ms * 1000:
+            failed = True
+            click.echo('    over the budget of %dms' % max_ms)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+'''Measure the wall-clock speedup of concurrent playlist entry extraction.
+
+    python benchmarks/bench_jobs.py --entries 100 --latency 0.05 --jobs 8
+'''
+
+import os
+import sys
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeYoutubeDL, PLAYLIST_URL_PREFIX
+from youtube_downloader_cli.downloader import YTDownloader
+from youtube_downloader_cli.models import setup_database
+
+
+def run(url, jobs):
+    setup_database(os.path.join(os.environ['HOME'], 'bench-%d.sqlite3' % jobs))
+
+    with YTDownloader(download=False, jobs=jobs) as downloader:
+        downloader.ydl_class = FakeYoutubeDL
+        begin = time.perf_counter()
+        videos = downloader.parse(url)
+        elapsed = time.perf_counter() - begin
+
+    return videos, elapsed
+
+
+@click.command()
+@click.option('--entries', default=100, type=click.IntRange(min=1), show_default=True)
+@click.option('--latency', default=0.05, type=click.FLOAT, show_default=True)
+@click.option('--jobs', default=8, type=click.IntRange(min=1), show_default=True)
+def main(entries, latency, jobs):
+    FakeYoutubeDL.latency = latency
+    url = PLAYLIST_URL_PREFIX + 'PL%d' % entries
+
+    serial, serial_elapsed = run(url, 1)
+    concurrent, concurrent_elapsed = run(url, jobs)
+
+    assert [v.id for v in serial] == [v.id for v in concurrent], 'Results are out of playlist order!'
+
+    click.echo('jobs=1: %.2fs' % serial_elapsed)
+    click.echo('jobs=%d: %.2fs' % (jobs, concurrent_elapsed))
+    click.echo('speedup: %.2fx' % (serial_elapsed / concurrent_elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''Count the extractions of overlapping urls with and without the memo shared across the run.
+
+The inputs mimic a channel listed in full, a few of its playlists and some direct links,
+so most videos show up several times. A memo per url, like the downloaders of the
+previous runs, extracts every occurrence, the shared one each video once:
+
+    python benchmarks/bench_memo.py --videos 200 --playlists 3 --links 50
+'''
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeYoutubeDL, PLAYLIST_URL_PREFIX, VIDEO_URL_PREFIX, video_id
+from youtube_downloader_cli.downloader import YTDownloader, VideoMemo
+from youtube_downloader_cli.models import PlaylistEntry, setup_database
+
+
+class CountingYoutubeDL(FakeYoutubeDL):
+    extractions = 0
+    lock = threading.Lock()
+
+    def extract_info(self, url, download=True):
+        with self.lock:
+            CountingYoutubeDL.extractions += 1
+
+        return super(CountingYoutubeDL, self).extract_info(url, download)
+
+
+def run(urls, jobs, shared):
+    setup_database(os.path.join(tempfile.mkdtemp(dir=os.environ['HOME']), 'bench.sqlite3'))
+    CountingYoutubeDL.extractions = 0
+    memo = VideoMemo() if shared else None
+    videos = 0
+    begin = time.perf_counter()
+
+    for url in urls:
+        with YTDownloader(False, jobs=jobs, cache_ttl=None, memo=memo) as downloader:
+            videos += sum(1 for _ in downloader.iter_parse(url))
+
+    return time.perf_counter() - begin, CountingYoutubeDL.extractions, videos, PlaylistEntry.select().count(), memo
+
+
+@click.command()
+@click.option('--videos', default=200, type=click.IntRange(min=1), show_default=True,
+              help='The videos of the channel.')
+@click.option('--playlists', default=3, type=click.IntRange(min=0), show_default=True,
+              help='The playlists listing a part of the channel.')
+@click.option('--links', default=50, type=click.IntRange(min=0), show_default=True,
+              help='The direct links to the videos of the channel.')
+@click.option('--jobs', default=4, type=click.IntRange(min=1), show_default=True)
+@click.option('--latency', default=0.01, type=click.FLOAT, show_default=True)
+def main(videos, playlists, links, jobs, latency):
+    CountingYoutubeDL.latency = latency
+    YTDownloader.ydl_class = CountingYoutubeDL
+
+    urls = [PLAYLIST_URL_PREFIX + 'PL%d' % videos]
+    urls += [PLAYLIST_URL_PREFIX + 'PL%d' % (videos * (i + 1) // (playlists + 1)) for i in range(playlists)]
+    urls += [VIDEO_URL_PREFIX + video_id(i * videos // max(links, 1)) for i in range(links)]
+
+    for name, shared in (('memo per url', False), ('shared memo', True)):
+        elapsed, extractions, yielded, entries, memo = run(urls, jobs, shared)
+        click.echo('%s: %d extraction(s) of %d url(s) in %.2fs, %d video(s) handed out, %d playlist entries'
+                   % (name, extractions, len(urls), elapsed, yielded, entries))
+
+        if memo:
+            click.echo(memo.summary())
+
+
+if __name__ == '__main__':
+    main()
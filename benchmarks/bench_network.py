@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+'''Measure the network scheduler sharing a capped bandwidth between media downloads and covers.
+
+The media files are downloaded in segments from one host while covers are fetched from
+another. The total throughput must stay within --bandwidth and the media host must never
+see more than --host-connections requests at once. The covers should stay fast, since
+they go ahead of the media, unlike a run treating them as media:
+
+    python benchmarks/bench_network.py --bandwidth 16 --host-connections 4
+'''
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeMediaServer
+from youtube_downloader_cli import covers, network
+from youtube_downloader_cli.covers import CoverFetcher
+from youtube_downloader_cli.network import NetworkScheduler, COVER, MEDIA
+from youtube_downloader_cli.segmented import SegmentedDownloader
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def run(media, cover, files, size, covers_count, bandwidth, host_connections, cover_priority):
+    network._scheduler = NetworkScheduler(bandwidth * 1024 ** 2, host_connections)
+    covers.COVER = cover_priority
+    media.peak_active = 0
+    storage = tempfile.mkdtemp(dir=os.environ['HOME'])
+
+    downloader = SegmentedDownloader(8, pool_size=files * 8)
+    # The media host is named apart from the cover one, the caps are per host name.
+    media_url = media.url.replace('127.0.0.1', 'localhost')
+    threads = [threading.Thread(target=downloader.download,
+                                args=('%s/media/%d.mp4' % (media_url, i), os.path.join(storage, '%d.mp4' % i)))
+               for i in range(files)]
+    begin = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    # Let the media downloads saturate the bandwidth first.
+    time.sleep(0.5)
+    fetcher = CoverFetcher(jobs=4)
+    latencies = []
+
+    def fetch(i):
+        started = time.perf_counter()
+        fetcher.fetch(cover.url + '/covers/%d.jpg' % i, '%d.jpg' % i)
+        latencies.append(time.perf_counter() - started)
+
+    futures = [fetcher._executor.submit(fetch, i) for i in range(covers_count)]
+
+    for future in futures:
+        future.result()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - begin
+    fetcher.close()
+    downloader.close()
+    return files * size / elapsed, media.peak_active, latencies
+
+
+@click.command()
+@click.option('--files', default=2, type=click.IntRange(min=1), show_default=True)
+@click.option('--size', default=16, type=click.IntRange(min=1), show_default=True, help='The media size in MiB.')
+@click.option('--covers', 'covers_count', default=40, type=click.IntRange(min=1), show_default=True)
+@click.option('--bandwidth', default=16, type=click.FLOAT, show_default=True, help='In MiB/s.')
+@click.option('--host-connections', default=4, type=click.IntRange(min=1), show_default=True)
+def main(files, size, covers_count, bandwidth, host_connections):
+    media = FakeMediaServer(size=size * 1024 ** 2)
+    cover = FakeMediaServer(size=64 * 1024)
+    SegmentedDownloader.segment_size = 1024 ** 2
+
+    for name, priority in (('prioritized covers', COVER), ('covers as media', MEDIA)):
+        throughput, peak, latencies = run(media, cover, files, size, covers_count, bandwidth, host_connections,
+                                          priority)
+        click.echo('%s: media %.1f MiB/s (cap %.1f), peak %d connection(s) to the media host (cap %d), '
+                   'cover p50 %.0fms p95 %.0fms' % (name, throughput, bandwidth, peak, host_connections,
+                                                    percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000))
+
+        assert peak <= host_connections, 'The media host got more connections than its cap!'
+
+
+if __name__ == '__main__':
+    main()
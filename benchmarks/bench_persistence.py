@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''Compare the per-row get_or_create persistence with the batched upserts.
+
+    python benchmarks/bench_persistence.py --videos 10000
+'''
+
+import os
+import sys
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import video_id, video_info
+from youtube_downloader_cli.models import setup_database, Video, VideoBatch
+
+
+def run_initialize(infos):
+    for info in infos:
+        video = Video.initialize(info)
+        # The downloader used to save again after attaching the playlist.
+        video.save()
+
+
+def run_batch(infos, size):
+    batch = VideoBatch(size=size)
+
+    for info in infos:
+        video = Video.from_info(info)
+        batch.add(video, video.uploader)
+
+    batch.flush()
+
+
+def measure(name, func, *args):
+    setup_database(os.path.join(os.environ['HOME'], '%s.sqlite3' % name))
+    begin = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - begin
+    assert Video.select().count() == len(args[0])
+    return elapsed
+
+
+@click.command()
+@click.option('--videos', default=10000, type=click.IntRange(min=1), show_default=True)
+@click.option('--batch-size', default=500, type=click.IntRange(min=1), show_default=True)
+def main(videos, batch_size):
+    infos = [video_info(video_id(i), i) for i in range(videos)]
+
+    for name, func, args in [
+        ('initialize', run_initialize, (infos,)),
+        ('batch', run_batch, (infos, batch_size)),
+    ]:
+        elapsed = measure(name, func, *args)
+        click.echo('%s: %.2fs, %.0f rows/sec' % (name, elapsed, videos / elapsed))
+
+
+if __name__ == '__main__':
+    main()
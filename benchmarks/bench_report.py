@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+'''Compare the SQL reports over the indexed upload dates against the Python-side aggregation.
+
+The synthetic rows are generated in SQL with their upload dates as YYYYMMDD strings only,
+like a library stored before the uploaded_at column, so the backfill is measured too:
+
+    python benchmarks/bench_report.py --videos 1000000
+'''
+
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_downloader_cli.models import Playlist, Uploader, Video, setup_database
+
+CHANNELS = 1000
+PLAYLISTS = 200
+
+GENERATE_SQL = '''
+WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?)
+INSERT INTO video (id, title, duration, channel_id, upload_date, filename, total_bytes, uploader_id, playlist_id)
+SELECT printf('v%010d', i),
+       printf('Synthetic video %d', i),
+       30 + (i * 7919) % 3600,
+       printf('UC%04d', i % {channels}),
+       strftime('%Y%m%d', date('2010-01-01', printf('+%d days', (i * 104729) % 5800))),
+       CASE WHEN i % 3 = 0 THEN printf('v%010d.mp4', i) END,
+       CASE WHEN i % 3 = 0 THEN 1000000 + (i * 15485863) % 1000000000 END,
+       printf('UC%04d', i % {channels}),
+       printf('PL%03d', i % {playlists})
+FROM seq
+'''.format(channels=CHANNELS, playlists=PLAYLISTS)
+
+
+def timed(func):
+    begin = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - begin
+
+
+def generate(videos):
+    database = Video._meta.database
+
+    # Start from the schema before the uploaded_at column, the migration builds its indexes.
+    cursor = database.execute_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '%uploaded_at%'")
+
+    for name, in cursor.fetchall():
+        database.execute_sql('DROP INDEX %s' % name)
+
+    with database.atomic():
+        Uploader.insert_many([{'id': 'UC%04d' % i, 'name': 'Uploader %d' % i} for i in range(CHANNELS)]).execute()
+        Playlist.insert_many([{'id': 'PL%03d' % i, 'title': 'Playlist %d' % i} for i in range(PLAYLISTS)]).execute()
+        database.execute_sql(GENERATE_SQL, (videos,))
+
+
+def python_report(since):
+    'The previous way, loading every row and parsing its upload date in Python.'
+    groups = defaultdict(lambda: [0, 0, 0])
+    rows = Video.select(Video.channel_id, Video.upload_date, Video.total_bytes, Video.duration).tuples()
+
+    for channel_id, upload_date, total_bytes, duration in rows.iterator():
+        if not upload_date or datetime.strptime(upload_date, '%Y%m%d').date() < since:
+            continue
+
+        group = groups[channel_id]
+        group[0] += 1
+        group[1] += total_bytes or 0
+        group[2] += duration or 0
+
+    return sorted(groups.items(), key=lambda item: -item[1][0])
+
+
+@click.command()
+@click.option('--videos', default=1000000, type=click.IntRange(min=1), show_default=True)
+@click.option('--since-days', default=365, type=click.IntRange(min=1), show_default=True,
+              help='Report the videos uploaded within these days before the latest one.')
+def main(videos, since_days):
+    database_file = os.path.join(os.environ['HOME'], 'bench.sqlite3')
+    setup_database(database_file)
+
+    _, elapsed = timed(lambda: generate(videos))
+    click.echo('generated %d videos in %.1fs' % (videos, elapsed))
+
+    def migrate():
+        count = Video.backfill_uploaded_at()
+        Video._meta.database.create_tables([Video])
+        Video._meta.database.execute_sql('ANALYZE')
+        return count
+
+    count, elapsed = timed(migrate)
+    click.echo('backfilled %d upload dates and built the indexes in %.1fs' % (count, elapsed))
+
+    since = date(2010, 1, 1) + timedelta(days=5800 - since_days)
+
+    legacy, legacy_elapsed = timed(lambda: python_report(since))
+    click.echo('python, per channel since %s: %d groups in %.0fms' % (since, len(legacy), legacy_elapsed * 1000))
+
+    for by, kwargs in [
+        ('channel', {'since': since}),
+        ('channel', {'since': since, 'uploader': 'UC0042'}),
+        ('playlist', {}),
+        ('month', {'since': since}),
+        ('uploader', {}),
+    ]:
+        rows, elapsed = timed(lambda: list(Video.report(by, **kwargs)))
+        click.echo('sql, per %s %s: %d groups in %.0fms' % (by, kwargs or '', len(rows), elapsed * 1000))
+
+        if by == 'channel' and not kwargs.get('uploader'):
+            assert dict((row[0], row[2]) for row in rows) == dict((key, value[0]) for key, value in legacy), 'Mismatched reports!'
+
+
+if __name__ == '__main__':
+    main()
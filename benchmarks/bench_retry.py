@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''Compare the retry policies fetching covers through an outage of their host.
+
+The immediate retries of the old loops hammer the host for the whole outage, the
+backoff spreads them out, and the circuit breaker fails the new fetches fast once the
+host is seen down, while the fetches under way keep their own retries:
+
+    python benchmarks/bench_retry.py --covers 100 --outage 3
+'''
+
+import os
+import sys
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeMediaServer
+from youtube_downloader_cli import covers, retry
+from youtube_downloader_cli.covers import CoverFetcher
+from youtube_downloader_cli.retry import RetryPolicy
+
+
+def run(server, count, outage, base_delay, breaker_threshold):
+    retry._breakers.clear()
+    RetryPolicy.breaker_threshold = breaker_threshold
+    RetryPolicy.breaker_reset_timeout = outage / 2
+    policy = covers._cover_retry = RetryPolicy('cover', base_delay=base_delay, max_delay=outage)
+    server.outage_until = time.monotonic() + outage
+    server.requests = server.outage_requests = 0
+
+    fetcher = CoverFetcher(jobs=4)
+    begin = time.perf_counter()
+    futures = [fetcher.submit(server.url + '/covers/%d.jpg' % i, '%d.jpg' % i) for i in range(count)]
+    fetched = sum(1 for future in futures if future.result()[0])
+    elapsed = time.perf_counter() - begin
+    fetcher.close()
+
+    return fetched, elapsed, policy
+
+
+@click.command()
+@click.option('--covers', 'count', default=100, type=click.IntRange(min=1), show_default=True)
+@click.option('--outage', default=3.0, type=click.FLOAT, show_default=True, help='Seconds of 503 from the host.')
+def main(count, outage):
+    server = FakeMediaServer(size=16 * 1024)
+
+    for name, base_delay, breaker_threshold in [
+        ('immediate retries', 0, 0),
+        ('backoff', 0.2, 0),
+        ('backoff and breaker', 0.2, 5),
+    ]:
+        fetched, elapsed, policy = run(server, count, outage, base_delay, breaker_threshold)
+        click.echo('%s: %d/%d covers in %.1fs, %d request(s) during the outage, %d retried, '
+                   'waited %.1fs, %d failed fast' % (name, fetched, count, elapsed, server.outage_requests,
+                                                   policy.retried, policy.waited, policy.failed_fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''Compare the full-text index against the LIKE scan over a large synthetic library.
+
+    python benchmarks/bench_search.py --videos 100000 --query tag42 --query v0000000042
+'''
+
+import os
+import sys
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import video_id, video_info
+from youtube_downloader_cli.models import Video, VideoBatch, VideoIndex, setup_database, fn
+
+
+def timed(func, repeat):
+    begin = time.perf_counter()
+
+    for _ in range(repeat):
+        result = func()
+
+    return result, (time.perf_counter() - begin) / repeat
+
+
+@click.command()
+@click.option('--videos', default=100000, type=click.IntRange(min=1), show_default=True)
+@click.option('--query', 'queries', default=['tag42', 'v0000000042'], multiple=True, show_default=True,
+              help='The queries to compare, a common tag and a rare title word by default.')
+@click.option('--limit', default=20, type=click.IntRange(min=1), show_default=True)
+@click.option('--repeat', default=5, type=click.IntRange(min=1), show_default=True)
+def main(videos, queries, limit, repeat):
+    setup_database(os.path.join(os.environ['HOME'], 'bench.sqlite3'))
+    batch = VideoBatch()
+    begin = time.perf_counter()
+
+    for i in range(videos):
+        video = Video.from_info(video_info(video_id(i), i))
+        batch.add(video, video.uploader)
+
+    batch.flush()
+    click.echo('stored and indexed %d videos in %.1fs' % (videos, time.perf_counter() - begin))
+
+    for query in queries:
+        # The scan has to collect every match before anything can be ranked.
+        like = (Video
+                .select()
+                .where(Video.title.contains(query) | Video.description.contains(query) |
+                       fn.json(Video.tags).contains(query)))
+        matches, like_elapsed = timed(lambda: list(like), repeat)
+        _, fts_elapsed = timed(lambda: list(VideoIndex.find(query).limit(limit)), repeat)
+
+        click.echo('%s: LIKE scan %.1fms for %d matches, FTS5 best %d in %.1fms, %.1fx' % (
+            query, like_elapsed * 1000, len(matches), limit, fts_elapsed * 1000, like_elapsed / fts_elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+'''Compare the segmented Range download against a single stream, and resume an interrupted one.
+
+The fake media server throttles every connection to --bandwidth, like the video hosts
+do, so the parallel segments add up. The interrupted download must resume with the
+missing segments only and come out byte-identical:
+
+    python benchmarks/bench_segmented.py --size 64 --bandwidth 8 --segments 8
+'''
+
+import os
+import sys
+import tempfile
+import time
+import click
+import requests
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeMediaServer
+from youtube_downloader_cli.segmented import SegmentedDownloader, SEGMENTS_SUFFIX
+
+MEDIA_PATH = '/media/v0000000000.mp4'
+
+
+class Interrupted(Exception):
+    pass
+
+
+def single_stream(url, filepath):
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+
+        with open(filepath, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=256 * 1024):
+                f.write(chunk)
+
+
+def interrupt_after(fraction):
+    'A progress hook interrupting the download once fraction of it is written and a segment is recorded.'
+    def hook(d):
+        if (d['status'] == 'downloading' and d['downloaded_bytes'] >= d['total_bytes'] * fraction and
+                os.path.exists(d['filename'] + SEGMENTS_SUFFIX)):
+            raise Interrupted()
+
+    return hook
+
+
+@click.command()
+@click.option('--size', default=64, type=click.IntRange(min=1), show_default=True, help='The media size in MiB.')
+@click.option('--bandwidth', default=8, type=click.FLOAT, show_default=True,
+              help='The bandwidth of every connection in MiB/s.')
+@click.option('--segments', default=8, type=click.IntRange(min=1), show_default=True)
+@click.option('--segment-size', default=4, type=click.IntRange(min=1), show_default=True, help='In MiB.')
+def main(size, bandwidth, segments, segment_size):
+    server = FakeMediaServer(size=size * 1024 ** 2, bandwidth=bandwidth * 1024 ** 2)
+    url = server.url + MEDIA_PATH
+    expected = server.content(MEDIA_PATH)
+    storage = os.environ['HOME']
+
+    SegmentedDownloader.segment_size = segment_size * 1024 ** 2
+    SegmentedDownloader.progress_interval = 0.1
+    downloader = SegmentedDownloader(segments)
+
+    begin = time.perf_counter()
+    single_stream(url, os.path.join(storage, 'single.mp4'))
+    single = time.perf_counter() - begin
+    click.echo('single stream: %.2fs, %.1f MiB/s' % (single, size / single))
+
+    filepath = os.path.join(storage, 'segmented.mp4')
+    begin = time.perf_counter()
+    downloader.download(url, filepath, total_bytes=len(expected))
+    segmented = time.perf_counter() - begin
+    click.echo('%d segments: %.2fs, %.1f MiB/s, %.2fx' % (segments, segmented, size / segmented, single / segmented))
+
+    with open(filepath, 'rb') as f:
+        assert f.read() == expected, 'Corrupted segmented download!'
+
+    filepath = os.path.join(storage, 'resumed.mp4')
+
+    try:
+        downloader.download(url, filepath, progress_hook=interrupt_after(0.5))
+        raise AssertionError('The download was never interrupted!')
+    except Interrupted:
+        pass
+
+    requests_before = server.requests
+    begin = time.perf_counter()
+    downloader.download(url, filepath, total_bytes=len(expected))
+    resumed = time.perf_counter() - begin
+
+    with open(filepath, 'rb') as f:
+        assert f.read() == expected, 'Corrupted resumed download!'
+
+    total = (len(expected) + SegmentedDownloader.segment_size - 1) // SegmentedDownloader.segment_size
+    # One request probes the size, every other one is a missing segment.
+    click.echo('resumed: %d of %d segments fetched again in %.2fs' % (
+        server.requests - requests_before - 1, total, resumed))
+
+    downloader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+'''Compare the flat storage layout and its file system scans against the sharded one indexed in the files table.
+
+Every synthetic video has an empty media file and cover, a few of them a partial
+download, first in a flat storage root, then migrated into the shards:
+
+    python benchmarks/bench_storage.py --videos 50000
+'''
+
+import os
+import sys
+import tempfile
+import time
+from fnmatch import fnmatch
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import video_id
+from youtube_downloader_cli.config import get_storage_path
+from youtube_downloader_cli.downloader import YTDownloader
+from youtube_downloader_cli.models import Video, File, setup_database
+from youtube_downloader_cli.storage import migrate_layout, reconcile
+
+
+def timed(func):
+    begin = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - begin
+
+
+def generate(root, videos, partial_every):
+    rows = []
+
+    for i in range(videos):
+        vid = video_id(i)
+        filename, thumbnail = 'Synthetic video %s-%s.mp4' % (vid, vid), '%s-cover.jpg' % vid
+
+        for name in (filename, thumbnail):
+            open(os.path.join(root, name), 'wb').close()
+
+        if i % partial_every == 0:
+            open(os.path.join(root, filename + '.part'), 'wb').close()
+
+        rows.append({'id': vid, 'filename': filename, 'thumbnail': thumbnail})
+
+    with Video._meta.database.atomic():
+        for i in range(0, len(rows), 300):
+            Video.insert_many(rows[i:i + 300]).execute()
+
+
+def legacy_cleanup(root):
+    'The previous cleanup, walking the storage and matching every name, without removing anything.'
+    return sum(1 for _, _, files in os.walk(root) for name in files if fnmatch(name, '*.mp4.*'))
+
+
+def legacy_existence(root, names):
+    return sum(1 for name in names if os.path.exists(os.path.join(root, name)))
+
+
+@click.command()
+@click.option('--videos', default=50000, type=click.IntRange(min=1), show_default=True)
+@click.option('--partial-every', default=100, type=click.IntRange(min=1), show_default=True)
+def main(videos, partial_every):
+    setup_database(os.path.join(os.environ['HOME'], 'bench.sqlite3'))
+    root = get_storage_path()
+
+    _, elapsed = timed(lambda: generate(root, videos, partial_every))
+    click.echo('generated %d videos in a flat root in %.1fs' % (videos, elapsed))
+
+    names = [name for name, in Video.select(Video.filename).tuples()]
+    count, elapsed = timed(lambda: legacy_cleanup(root))
+    click.echo('flat: cleanup walk found %d partial(s) in %.0fms' % (count, elapsed * 1000))
+    count, elapsed = timed(lambda: legacy_existence(root, names))
+    click.echo('flat: %d existence checks by stat in %.0fms' % (count, elapsed * 1000))
+    entries, elapsed = timed(lambda: os.listdir(root))
+    click.echo('flat: listing the root of %d entries in %.1fms' % (len(entries), elapsed * 1000))
+
+    moved, elapsed = timed(migrate_layout)
+    click.echo('migrated %d files into the shards in %.1fs' % (moved, elapsed))
+    counts, elapsed = timed(reconcile)
+    click.echo('reconciled the files table (%d added, %d updated, %d removed) in %.1fs' % (counts + (elapsed,)))
+
+    names = [name for name, in Video.select(Video.filename).tuples()]
+    count, elapsed = timed(lambda: File.select().where(File.kind == File.PARTIAL).count())
+    click.echo('sharded: cleanup query found %d partial(s) in %.1fms' % (count, elapsed * 1000))
+    found, elapsed = timed(lambda: File.existing(names))
+    click.echo('sharded: %d existence checks by the files table in %.0fms' % (len(found), elapsed * 1000))
+    shard = os.path.join(root, os.path.dirname(names[0]))
+    entries, elapsed = timed(lambda: os.listdir(shard))
+    click.echo('sharded: listing a shard of %d entries in %.2fms' % (len(entries), elapsed * 1000))
+
+    _, elapsed = timed(YTDownloader.cleanup)
+    click.echo('sharded: cleanup removed the partials in %.0fms' % (elapsed * 1000))
+    assert not File.select().where(File.kind == File.PARTIAL).exists(), 'Partial files left behind!'
+
+
+if __name__ == '__main__':
+    main()
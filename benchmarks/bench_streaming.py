@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+'''Compare the resident memory of iter_parse against collecting parse() on a large playlist.
+
+Every mode runs in its own process, sampling the RSS every --every videos, so the
+streaming curve should stay flat while the collecting one keeps growing:
+
+    python benchmarks/bench_streaming.py --entries 10000
+'''
+
+import os
+import sys
+import resource
+import subprocess
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeYoutubeDL, PLAYLIST_URL_PREFIX
+
+STREAM = 'stream'
+COLLECT = 'collect'
+
+
+def rss_mib():
+    'The current resident set size, falling back to the peak one off Linux.'
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(mode, entries, every, jobs):
+    from youtube_downloader_cli.downloader import YTDownloader
+    from youtube_downloader_cli.models import setup_database
+
+    setup_database(os.path.join(os.environ['HOME'], 'bench.sqlite3'))
+    FakeYoutubeDL.latency = 0
+    url = PLAYLIST_URL_PREFIX + 'PL%d' % entries
+    samples = []
+    begin = time.perf_counter()
+
+    with YTDownloader(download=False, jobs=jobs) as downloader:
+        downloader.ydl_class = FakeYoutubeDL
+
+        if mode == STREAM:
+            for count, video in enumerate(downloader.iter_parse(url), 1):
+                if count % every == 0:
+                    samples.append(rss_mib())
+        else:
+            videos = downloader.parse(url)
+            samples.append(rss_mib())
+            count = len(videos)
+
+    click.echo('%s: %d videos in %.1fs, RSS %s MiB, peak %.1f MiB' % (
+        mode, count, time.perf_counter() - begin, ' '.join('%.0f' % s for s in samples),
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+@click.command()
+@click.option('--entries', default=10000, type=click.IntRange(min=1), show_default=True)
+@click.option('--every', default=1000, type=click.IntRange(min=1), show_default=True,
+              help='Sample the RSS every these videos.')
+@click.option('--jobs', default=4, type=click.IntRange(min=1), show_default=True)
+@click.option('--mode', default=None, type=click.Choice([STREAM, COLLECT]),
+              help='Run a single mode in this process.')
+def main(entries, every, jobs, mode):
+    if mode:
+        return run(mode, entries, every, jobs)
+
+    for mode in (STREAM, COLLECT):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--entries', str(entries),
+                        '--every', str(every), '--jobs', str(jobs), '--mode', mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
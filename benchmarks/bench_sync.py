@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+'''Run a whole sync offline and compare it with the stored baseline of the same scenario.
+
+A synthetic playlist, channel tab or user page of --videos entries is extracted by
+FakeYoutubeDL with --latency per video, optionally translated by the fake translation
+endpoint and downloaded with the covers from the fake media server. It reports the end
+to end throughput, the latency percentiles of every instrumented stage and the peak
+memory. --save writes the results as the baseline of the scenario, the next runs of the
+same scenario are compared with it:
+
+    python benchmarks/bench_sync.py --videos 5000 --source channel --save
+    python benchmarks/bench_sync.py --videos 5000 --source channel --translate --download
+'''
+
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import (FakeYoutubeDL, FakeMediaServer, FakeTranslationServer, PLAYLIST_URL_PREFIX, CHANNEL_URL_PREFIX,
+                   TAB_URL_SUFFIX, USER_URL_PREFIX)
+from youtube_downloader_cli import config
+from youtube_downloader_cli.downloader import YTDownloader, DownloadPool
+from youtube_downloader_cli.metrics import metrics
+from youtube_downloader_cli.models import Video, setup_database, iter_translated
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+SOURCES = {
+    'playlist': lambda count: PLAYLIST_URL_PREFIX + 'PL%d' % count,
+    'tab': lambda count: CHANNEL_URL_PREFIX + 'UC%d' % count + TAB_URL_SUFFIX,
+    'channel': lambda count: USER_URL_PREFIX + 'UC%d' % count,
+}
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def at(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+    return {'count': len(ordered), 'p50': at(50), 'p95': at(95), 'p99': at(99), 'max': ordered[-1] if ordered else 0.0}
+
+
+def run(url, jobs, download, download_jobs, translate):
+    'Sync url like the parse command, returning the results.'
+    pool = None
+    handouts = []
+    first = None
+    count = 0
+    startup_rss = peak_rss_mib()
+    begin = time.perf_counter()
+
+    if download:
+        pool = DownloadPool(jobs=download_jobs)
+        pool.start()
+
+    with YTDownloader(download=download, jobs=jobs, cache_ttl=None) as downloader:
+        videos = downloader.iter_parse(url)
+
+        if translate:
+            videos = iter_translated(videos, jobs=jobs)
+
+        last = time.perf_counter()
+
+        # The time between the videos handed out, the latency the consumer of iter_parse sees.
+        for _ in videos:
+            now = time.perf_counter()
+            first = first or now - begin
+            handouts.append(now - last)
+            last = now
+            count += 1
+
+    parsed = time.perf_counter() - begin
+
+    if pool:
+        pool.join()
+
+    elapsed = time.perf_counter() - begin
+    snapshot = metrics.snapshot()
+    stages = dict((name, dict((key, timer[key]) for key in ('count', 'p50', 'p95', 'p99', 'max')))
+                  for name, timer in snapshot['timers'].items() if not name.startswith('network_'))
+    stages['handout'] = percentiles(handouts)
+
+    return {
+        'videos': count,
+        'stored': Video.select().count(),
+        'first_video_seconds': first or 0.0,
+        'parse_seconds': parsed,
+        'elapsed_seconds': elapsed,
+        'videos_per_second': count / elapsed if elapsed else 0.0,
+        'peak_rss_mib': peak_rss_mib(),
+        'rss_growth_mib': peak_rss_mib() - startup_rss,
+        'stages': stages,
+        'counters': snapshot['counters'],
+    }
+
+
+def scenario_name(source, videos, latency, jobs, download, translate):
+    return '%s-%d-%gms-j%d%s%s' % (source, videos, latency * 1000, jobs, '-download' if download else '',
+                                   '-translate' if translate else '')
+
+
+def change(value, baseline, tolerance, lower_is_better=True):
+    'The change of value against baseline, flagged once it is beyond the tolerance percent.'
+    if not baseline:
+        return ''
+
+    ratio = (value - baseline) / baseline * 100
+    better = ratio < 0 if lower_is_better else ratio > 0
+    return '%+6.1f%%%s' % (ratio, '' if abs(ratio) <= tolerance else (' better' if better else ' WORSE'))
+
+
+def report(results, baseline, tolerance):
+    base = baseline['results'] if baseline else {}
+    base_stages = base.get('stages', {})
+
+    click.echo('%d video(s), %d stored, the first one after %.2fs, parsed in %.2fs, %.2fs end to end' % (
+        results['videos'], results['stored'], results['first_video_seconds'], results['parse_seconds'],
+        results['elapsed_seconds']))
+    click.echo('throughput  %8.1f videos/s  %s' % (
+        results['videos_per_second'], change(results['videos_per_second'], base.get('videos_per_second'), tolerance, False)))
+    click.echo('peak RSS    %8.1f MiB       %s' % (results['peak_rss_mib'],
+                                                    change(results['peak_rss_mib'], base.get('peak_rss_mib'), tolerance)))
+    click.echo('RSS growth  %8.1f MiB       %s' % (results['rss_growth_mib'],
+                                                    change(results['rss_growth_mib'], base.get('rss_growth_mib'), tolerance)))
+    if results['counters']:
+        click.echo('counters    %s' % ', '.join('%s %s' % (name, value if isinstance(value, int) else '%.1f' % value)
+                                                for name, value in sorted(results['counters'].items())))
+
+    click.echo('%-18s %7s %9s %9s %9s %9s  %s' % ('stage', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms',
+                                                  'p95 vs baseline'))
+
+    for name, stage in sorted(results['stages'].items()):
+        click.echo('%-18s %7d %9.2f %9.2f %9.2f %9.2f  %s' % (
+            name, stage['count'], stage['p50'] * 1000, stage['p95'] * 1000, stage['p99'] * 1000, stage['max'] * 1000,
+            change(stage['p95'], base_stages.get(name, {}).get('p95'), tolerance)))
+
+
+@click.command()
+@click.option('--source', default='playlist', type=click.Choice(sorted(SOURCES)), show_default=True,
+              help='A playlist, the uploads tab of a channel, or a user page resolved to its tab.')
+@click.option('--videos', default=5000, type=click.IntRange(min=1), show_default=True)
+@click.option('--latency', default=0.0, type=click.FloatRange(min=0), show_default=True,
+              help='The seconds of every video extraction.')
+@click.option('--page-latency', default=0.0, type=click.FloatRange(min=0), show_default=True,
+              help='The seconds of every page of 100 playlist entries.')
+@click.option('--jobs', default=4, type=click.IntRange(min=1), show_default=True)
+@click.option('--download', default=False, is_flag=True, help='Download the media files and covers too.')
+@click.option('--download-jobs', default=2, type=click.IntRange(min=1), show_default=True)
+@click.option('--media-size', default=64, type=click.IntRange(min=1), show_default=True,
+              help='The size of every media file in KiB.')
+@click.option('--translate', default=False, is_flag=True, help='Translate the videos with the fake endpoint.')
+@click.option('--translate-latency', default=0.01, type=click.FloatRange(min=0), show_default=True)
+@click.option('--tolerance', default=15, type=click.FloatRange(min=0), show_default=True,
+              help='The percents of change against the baseline taken for noise.')
+@click.option('--save', default=False, is_flag=True, help='Store the results as the baseline of the scenario.')
+def main(source, videos, latency, page_latency, jobs, download, download_jobs, media_size, translate,
+         translate_latency, tolerance, save):
+    setup_database(os.path.join(os.environ['HOME'], 'bench.sqlite3'))
+    metrics.enable()
+
+    FakeYoutubeDL.latency = latency
+    FakeYoutubeDL.page_latency = page_latency
+    FakeYoutubeDL.media_size = media_size * 1024
+    YTDownloader.ydl_class = FakeYoutubeDL
+    DownloadPool.ydl_class = FakeYoutubeDL
+    DownloadPool.poll_interval = 0.1
+
+    if download:
+        server = FakeMediaServer(size=media_size * 1024)
+        FakeYoutubeDL.media_url = FakeYoutubeDL.cover_url = server.url
+
+    if translate:
+        translator = FakeTranslationServer(latency=translate_latency)
+        config._load_config().set('TRANSLATION', 'endpoint', translator.endpoint)
+
+    name = scenario_name(source, videos, latency, jobs, download, translate)
+    path = os.path.join(BASELINES, name + '.json')
+    baseline = None
+
+    if os.path.exists(path):
+        with open(path) as f:
+            baseline = json.load(f)
+
+        click.echo('Comparing with the baseline of %s, recorded %s on %s.' % (
+            name, baseline['recorded_at'], baseline['machine']))
+    else:
+        click.echo('No baseline of %s yet, run it with --save to record one.' % name)
+
+    results = run(SOURCES[source](videos), jobs, download, download_jobs, translate)
+    report(results, baseline, tolerance)
+
+    if save:
+        os.makedirs(BASELINES, exist_ok=True)
+
+        with open(path, 'w') as f:
+            json.dump({
+                'scenario': name,
+                'recorded_at': datetime.now().isoformat(timespec='seconds'),
+                'machine': '%s, %s, %d CPU(s), Python %s' % (platform.system(), platform.machine(), os.cpu_count(),
+                                                            platform.python_version()),
+                'results': results,
+            }, f, indent=4, sort_keys=True)
+            f.write('\n')
+
+        click.echo('Saved the baseline to %s.' % os.path.relpath(path, ROOT))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''Compare translating the localized fields one by one with the batched pipeline.
+
+Both runs talk to a local fake translation endpoint, the number of its requests is
+reported along with the elapsed time.
+
+    python benchmarks/bench_translate.py --videos 200 --jobs 4
+'''
+
+import os
+import sys
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeTranslationServer, video_id, video_info
+from youtube_downloader_cli import config, translate
+from youtube_downloader_cli.models import Video, prefetch_translations, setup_database
+
+
+def run_one_by_one(videos):
+    for video in videos:
+        video.localized_title()
+        video.localized_description()
+        video.localized_tags()
+        video.localized_categories()
+
+
+def run_batch(videos, jobs):
+    prefetch_translations(videos, jobs=jobs)
+    # The accessors are pure cache lookups now.
+    run_one_by_one(videos)
+
+
+@click.command()
+@click.option('--videos', default=200, type=click.IntRange(min=1), show_default=True)
+@click.option('--latency', default=0.01, type=click.FLOAT, show_default=True)
+@click.option('--jobs', default=4, type=click.IntRange(min=1), show_default=True)
+def main(videos, latency, jobs):
+    # The prefetched translations are indexed for the search as well.
+    setup_database(os.path.join(os.environ['HOME'], 'bench.sqlite3'))
+    server = FakeTranslationServer(latency=latency)
+    config._load_config().set('TRANSLATION', 'endpoint', server.endpoint)
+    items = [Video.from_info(video_info(video_id(i), i)) for i in range(videos)]
+
+    for name, func, args in [
+        ('one by one', run_one_by_one, (items,)),
+        ('batch', run_batch, (items, jobs)),
+    ]:
+        # Start every run from an empty cache.
+        translate._cache = translate.TranslationCache(os.path.join(os.environ['HOME'], '%s.sqlite3' % name))
+        server.requests = 0
+        begin = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - begin
+        click.echo('%s: %.2fs, %d request(s)' % (name, elapsed, server.requests))
+
+
+if __name__ == '__main__':
+    main()
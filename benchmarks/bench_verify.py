@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''Measure hashing the downloaded media files, in full and incrementally.
+
+The files are hashed with plain buffered reads in this process first, as a baseline,
+then by verify with memory mapped reads in a process pool, then again by verify with
+nothing changed, which must skip every file:
+
+    python benchmarks/bench_verify.py --files 32 --size 16 --jobs 4
+'''
+
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import video_id
+from youtube_downloader_cli.config import get_storage_path, get_shard
+from youtube_downloader_cli.models import File, setup_database
+from youtube_downloader_cli.storage import reconcile
+from youtube_downloader_cli.verify import verify
+
+
+def generate(root, files, size):
+    block = os.urandom(1024 ** 2)
+
+    for i in range(files):
+        vid = video_id(i)
+        path = os.path.join(root, get_shard(vid), 'Synthetic video %s-%s.webm' % (vid, vid))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as f:
+            # A distinct file per video, the last one duplicates the first.
+            f.write(('%d' % (i % (files - 1) if files > 1 else 0)).encode('ascii'))
+
+            for _ in range(size):
+                f.write(block)
+
+
+def read_hash(root):
+    'The baseline, buffered reads into a fresh bytes object per chunk.'
+    total = 0
+
+    for path, in File.select(File.path).tuples():
+        digest = hashlib.blake2b(digest_size=32)
+
+        with open(os.path.join(root, path), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(chunk)
+                total += len(chunk)
+
+    return total
+
+
+@click.command()
+@click.option('--files', default=32, type=click.IntRange(min=1), show_default=True)
+@click.option('--size', default=16, type=click.IntRange(min=1), show_default=True, help='The file size in MiB.')
+@click.option('--jobs', default=os.cpu_count(), type=click.IntRange(min=1), show_default=True)
+def main(files, size, jobs):
+    setup_database(os.path.join(os.environ['HOME'], 'bench.sqlite3'))
+    root = get_storage_path()
+    generate(root, files, size)
+    reconcile()
+
+    begin = time.perf_counter()
+    total = read_hash(root)
+    elapsed = time.perf_counter() - begin
+    click.echo('buffered reads, 1 process: %.0f MiB in %.2fs, %.0f MiB/s' % (total / 1024 ** 2, elapsed,
+                                                                          total / 1024 ** 2 / elapsed))
+
+    report = verify(jobs=jobs)
+    click.echo('verify, mmap, %d process(es): %.0f MiB in %.2fs, %.0f MiB/s, %d group(s) of duplicates' % (
+        jobs, report.hashed_bytes / 1024 ** 2, report.elapsed, report.hashed_bytes / 1024 ** 2 / report.elapsed,
+        len(report.duplicates)))
+    assert report.hashed == files and len(report.duplicates) == (1 if files > 1 else 0)
+
+    begin = time.perf_counter()
+    report = verify(jobs=jobs)
+    click.echo('verify again, nothing changed: %d hashed, %d skipped in %.0fms' % (
+        report.hashed, report.skipped, (time.perf_counter() - begin) * 1000))
+    assert report.hashed == 0
+
+
+# The hashing processes are spawned, they import this module again.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''Compare refreshing every channel from cron against the adaptive schedule of the watch daemon.
+
+The channels upload at different paces, a few of them several times a day, most daily or
+weekly and some not at all any more. Cron polls all of them at the same --cron-minutes,
+the watch daemon derives each interval from the upload history. Every cron run also pays
+for starting the process and setting up the database, measured here with a subprocess:
+
+    python benchmarks/bench_watch.py --channels 200 --cron-minutes 60
+'''
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from youtube_downloader_cli.models import Video, Playlist, PlaylistEntry, setup_database
+from youtube_downloader_cli.watch import Watcher
+
+# (name, share of the channels, days between the uploads, days since the last upload)
+PACES = [
+    ('several a day', 0.1, 0, 0),
+    ('daily', 0.3, 1, 0),
+    ('weekly', 0.4, 7, 3),
+    ('dormant', 0.2, 7, 365),
+]
+
+
+def generate(channels, uploads, today):
+    rand = random.Random(0)
+    paces = []
+    rows = []
+
+    for i in range(channels):
+        name, _, gap, idle = rand.choices(PACES, weights=[share for _, share, _, _ in PACES])[0]
+        playlist = 'PL%05d' % i
+        Playlist.create(id=playlist)
+        paces.append((playlist, name))
+
+        for j in range(uploads):
+            uploaded_at = today - timedelta(days=idle + gap * j)
+            rows.append({'id': '%s-%d' % (playlist, j), 'playlist': playlist, 'uploaded_at': uploaded_at})
+
+    entries = [{'playlist': row['playlist'], 'video': row['id'], 'uploaded_at': row['uploaded_at']} for row in rows]
+
+    with Video._meta.database.atomic():
+        for i in range(0, len(rows), 300):
+            Video.insert_many(rows[i:i + 300]).execute()
+            PlaylistEntry.insert_many(entries[i:i + 300]).execute()
+
+    return paces
+
+
+def startup_cost(database_file):
+    'The seconds of a cron run before it does anything, importing the package and opening the database.'
+    code = ('from youtube_downloader_cli.downloader import YTDownloader\n'
+            'from youtube_downloader_cli.models import setup_database\n'
+            'setup_database(%r)\n' % database_file)
+    begin = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+    return time.perf_counter() - begin
+
+
+@click.command()
+@click.option('--channels', default=200, type=click.IntRange(min=1), show_default=True)
+@click.option('--uploads', default=20, type=click.IntRange(min=2), show_default=True,
+              help='The uploads in the history of every channel.')
+@click.option('--cron-minutes', default=60, type=click.IntRange(min=1), show_default=True)
+def main(channels, uploads, cron_minutes):
+    database_file = os.path.join(os.environ['HOME'], 'bench.sqlite3')
+    setup_database(database_file)
+    today = date.today()
+    paces = generate(channels, uploads, today)
+    watcher = Watcher([], min_interval=timedelta(minutes=30), max_interval=timedelta(days=1))
+
+    cron_polls = channels * 24 * 60 / cron_minutes
+    click.echo('cron: %d polls/day, every new upload seen within %.0f minutes on average'
+               % (cron_polls, cron_minutes / 2))
+
+    stats = {}
+
+    for playlist, name in paces:
+        interval = watcher.interval(playlist, today).total_seconds()
+        polls, delay, count = stats.get(name, (0, 0, 0))
+        stats[name] = (polls + 86400 / interval, delay + interval / 2 / 60, count + 1)
+
+    for name, (polls, delay, count) in stats.items():
+        click.echo('watch, %d %s channel(s): %.0f polls/day, new uploads seen within %.0f minutes on average'
+                   % (count, name, polls, delay / count))
+
+    watch_polls = sum(polls for polls, _, _ in stats.values())
+    click.echo('watch: %d polls/day, %.1fx fewer than cron' % (watch_polls, cron_polls / watch_polls))
+
+    cost = min(startup_cost(database_file) for _ in range(3))
+    click.echo('cron: %.0fms of process startup and database setup per run, %.0fs/day at %d run(s)/day'
+               % (cost * 1000, cost * 24 * 60 / cron_minutes, 24 * 60 / cron_minutes))
+
+
+if __name__ == '__main__':
+    main()
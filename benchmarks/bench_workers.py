@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''Measure the parse worker processes sharing one url backlog, and their lease recovery.
+
+Every entry must be parsed exactly once whatever the worker count. With --kill, one
+worker is killed in the middle of the run and its job must be reclaimed by the others
+once its lease expires:
+
+    python benchmarks/bench_workers.py --entries 200 --latency 0.05 --workers 4 --kill
+'''
+
+import os
+import sys
+import multiprocessing
+import tempfile
+import time
+from datetime import timedelta
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeYoutubeDL, PLAYLIST_URL_PREFIX
+
+LEASE = timedelta(seconds=2)
+
+
+def run_worker(database_file, latency):
+    from youtube_downloader_cli.downloader import YTDownloader
+    from youtube_downloader_cli.jobs import JobQueue, PARSE_JOB
+    from youtube_downloader_cli.workers import ParseWorker, run_parse_worker
+
+    FakeYoutubeDL.latency = latency
+    YTDownloader.ydl_class = FakeYoutubeDL
+    ParseWorker.poll_interval = 0.2
+    ParseWorker.renew_interval = LEASE.total_seconds() / 4
+    run_parse_worker(database_file, queue=JobQueue(PARSE_JOB, lease=LEASE), download=False, cache_ttl=None)
+
+
+def wait_for_job(pid):
+    'Wait until the worker process of pid is running an entry job.'
+    from youtube_downloader_cli.jobs import PARSE_JOB, RUNNING
+    from youtube_downloader_cli.models import Job
+
+    while not (Job
+               .select()
+               .where((Job.kind == PARSE_JOB) & (Job.status == RUNNING) & (Job.payload['playlist'].is_null(False)) &
+                      (Job.lease_owner.contains(':%d:' % pid)))
+               .exists()):
+        time.sleep(0.05)
+
+
+def run(entries, latency, workers, kill):
+    from youtube_downloader_cli.jobs import JobQueue, PARSE_JOB, DONE
+    from youtube_downloader_cli.models import Job, Video, setup_database
+
+    database_file = os.path.join(os.environ['HOME'], 'bench-%d-%d.sqlite3' % (workers, kill))
+    setup_database(database_file)
+    url = PLAYLIST_URL_PREFIX + 'PL%d' % entries
+    JobQueue(PARSE_JOB).enqueue(url, {'url': url}, requeue=True)
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_worker, args=(database_file, latency)) for _ in range(workers)]
+    begin = time.perf_counter()
+
+    for process in processes:
+        process.start()
+
+    if kill:
+        wait_for_job(processes[0].pid)
+        processes[0].kill()
+        Job._meta.database.close()
+
+    for process in processes:
+        process.join()
+
+    elapsed = time.perf_counter() - begin
+    setup_database(database_file)
+
+    jobs = list(Job.select().where(Job.kind == PARSE_JOB))
+    done = sum(1 for job in jobs if job.status == DONE)
+    retried = sum(1 for job in jobs if job.attempts > 1)
+    videos = Video.select().count()
+
+    assert done == len(jobs) == entries + 1, 'Unfinished jobs: %d of %d done' % (done, len(jobs))
+    assert videos == entries, 'Parsed %d videos of %d entries' % (videos, entries)
+    assert retried <= (1 if kill else 0), 'Duplicated work: %d job(s) ran more than once' % retried
+
+    return elapsed, retried
+
+
+@click.command()
+@click.option('--entries', default=200, type=click.IntRange(min=1), show_default=True)
+@click.option('--latency', default=0.05, type=click.FLOAT, show_default=True)
+@click.option('--workers', default=4, type=click.IntRange(min=1), show_default=True)
+@click.option('--kill', default=False, is_flag=True, help='Kill a worker in the middle of the run.')
+def main(entries, latency, workers, kill):
+    single, _ = run(entries, latency, 1, False)
+    click.echo('workers=1: %.2fs' % single)
+
+    multiple, retried = run(entries, latency, workers, kill)
+    click.echo('workers=%d%s: %.2fs, %d job(s) reclaimed' % (workers, ', one killed' if kill else '', multiple, retried))
+    click.echo('speedup: %.2fx' % (single / multiple))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''Measure the per-entry overhead of constructing a YoutubeDL for every url against reusing one.
+
+The extractor is a real YoutubeDL whose extract_info is stubbed out, so only the
+construction and bookkeeping costs are measured.
+
+    python benchmarks/bench_ydl_reuse.py --entries 500
+'''
+
+import os
+import sys
+import tempfile
+import time
+import click
+
+# Keep the config, database and storage of the benchmark away from the real ones.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='ytdl-bench-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl import YoutubeDL
+from fakes import VIDEO_URL_PREFIX, video_id, video_info
+from youtube_downloader_cli.config import get_proxy, get_storage_path
+from youtube_downloader_cli.downloader import YTDownloader
+
+
+class StubYoutubeDL(YoutubeDL):
+    def extract_info(self, url, download=True, *args, **kwargs):
+        vid = url[len(VIDEO_URL_PREFIX):]
+        return video_info(vid, int(vid[1:]))
+
+
+def run_per_url(urls):
+    'The previous behaviour, a new instance and config lookups for every url.'
+    for url in urls:
+        ydl_opts = {
+            'proxy': get_proxy(),
+            'extract_flat': True,
+            'outtmpl': os.path.join(get_storage_path(), '%(title)s-%(id)s.%(ext)s'),
+        }
+
+        with StubYoutubeDL(ydl_opts) as ydl:
+            ydl.extract_info(url, download=False)
+
+
+def run_reused(urls):
+    with YTDownloader(download=False) as downloader:
+        downloader.ydl_class = StubYoutubeDL
+
+        for url in urls:
+            downloader._extract(url)
+
+
+@click.command()
+@click.option('--entries', default=500, type=click.IntRange(min=1), show_default=True)
+def main(entries):
+    urls = [VIDEO_URL_PREFIX + video_id(i) for i in range(entries)]
+
+    for name, func in [
+        ('per url', run_per_url),
+        ('reused', run_reused),
+    ]:
+        begin = time.perf_counter()
+        func(urls)
+        elapsed = time.perf_counter() - begin
+        click.echo('%s: %.2fs, %.3fms per entry' % (name, elapsed, elapsed * 1000 / entries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+'''Deterministic stand-ins for the network facing parts, used by the benchmarks.'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import os
+import random
+import re
+import threading
+import time
+
+VIDEO_URL_PREFIX = 'https://youtu.be/'
+PLAYLIST_URL_PREFIX = 'https://www.youtube.com/playlist?list='
+WATCH_URL_PREFIX = 'https://www.youtube.com/watch?v='
+# The uploads tab of a channel, e.g. CHANNEL_URL_PREFIX + 'UC100' + TAB_URL_SUFFIX lists 100 videos.
+CHANNEL_URL_PREFIX = 'https://www.youtube.com/channel/'
+TAB_URL_SUFFIX = '/videos'
+# A user page, resolved to the uploads tab of its channel like the legacy youtube:user urls.
+USER_URL_PREFIX = 'https://www.youtube.com/user/'
+# The entries youtube returns per page of a playlist or tab.
+PAGE_SIZE = 100
+
+
+def video_id(index):
+    return 'v%010d' % index
+
+
+def video_info(vid, index=0):
+    'Build a youtube-dl like info dict of a single video.'
+    rand = random.Random(vid)
+    uploader_id = 'UC%04d' % (index % 50)
+
+    return {
+        'extractor': 'youtube',
+        'id': vid,
+        'title': 'Synthetic video %s' % vid,
+        'url': 'https://example.com/media/%s.mp4' % vid,
+        'webpage_url': 'https://www.youtube.com/watch?v=%s' % vid,
+        'duration': rand.randint(30, 3600),
+        'width': 1280,
+        'height': 720,
+        'fps': 30,
+        'ext': 'mp4',
+        'filesize': rand.randint(10 ** 6, 10 ** 9),
+        'view_count': rand.randint(0, 10 ** 7),
+        'like_count': rand.randint(0, 10 ** 5),
+        'average_rating': round(rand.uniform(1, 5), 2),
+        'channel_id': uploader_id,
+        'channel_url': 'https://www.youtube.com/channel/%s' % uploader_id,
+        'upload_date': '20%02d%02d%02d' % (rand.randint(10, 25), rand.randint(1, 12), rand.randint(1, 28)),
+        'thumbnail': 'https://example.com/covers/%s.jpg' % vid,
+        'description': 'Description of %s. ' % vid * 5,
+        'categories': ['Education'],
+        'tags': ['tag%d' % rand.randint(0, 200) for _ in range(10)],
+        'uploader': 'Uploader %s' % uploader_id,
+        'uploader_id': uploader_id,
+        'uploader_url': 'https://www.youtube.com/channel/%s' % uploader_id,
+    }
+
+
+def _entries(count, url_prefix=''):
+    entries = []
+
+    for i in range(count):
+        info = video_info(video_id(i), i)
+        entries.append({
+            '_type': 'url',
+            'ie_key': 'Youtube',
+            'id': info['id'],
+            'url': url_prefix + info['id'],
+            'title': info['title'],
+            'duration': info['duration'],
+            'view_count': info['view_count'],
+        })
+
+    return entries
+
+
+def playlist_info(playlist_id, count):
+    'Build a flat youtube-dl like info dict of a playlist with count entries.'
+    entries = _entries(count)
+
+    return {
+        '_type': 'playlist',
+        'extractor': 'youtube:playlist',
+        'id': playlist_id,
+        'title': 'Synthetic playlist %s' % playlist_id,
+        'webpage_url': PLAYLIST_URL_PREFIX + playlist_id,
+        'uploader': 'Uploader UC0000',
+        'uploader_id': 'UC0000',
+        'uploader_url': 'https://www.youtube.com/channel/UC0000',
+        'entries': entries,
+    }
+
+
+def tab_info(channel_id, count):
+    'Build a flat youtube-dl like info dict of the uploads tab of a channel, its entries are watch urls.'
+    return {
+        '_type': 'playlist',
+        'extractor': 'youtube:tab',
+        'id': channel_id,
+        'title': 'Synthetic channel %s - Videos' % channel_id,
+        'webpage_url': CHANNEL_URL_PREFIX + channel_id + TAB_URL_SUFFIX,
+        'uploader': 'Uploader %s' % channel_id,
+        'uploader_id': channel_id,
+        'uploader_url': CHANNEL_URL_PREFIX + channel_id,
+        'entries': _entries(count, WATCH_URL_PREFIX),
+    }
+
+
+def channel_info(channel_id):
+    'Build a youtube-dl like info dict of a user page, pointing to the uploads tab of its channel.'
+    return {
+        '_type': 'playlist',
+        'extractor': 'youtube:user',
+        'id': channel_id,
+        'url': CHANNEL_URL_PREFIX + channel_id + TAB_URL_SUFFIX,
+    }
+
+
+class FakeYoutubeDL(object):
+    '''Stand-in for youtube_dl.YoutubeDL serving synthetic playlists, tabs and channels.
+
+    The playlist and channel ids encode the entry count, e.g. PL100 and UC100 have 100
+    entries, and every single video extraction sleeps for latency seconds to mimic the
+    network round trip, every page of PAGE_SIZE entries for page_latency. Downloading
+    writes media_size bytes to the output template and reports it to the progress
+    hooks. With a media_url, the selected format points to that server over plain HTTP
+    instead, so the segmented downloads fetch it from there, and with a cover_url the
+    thumbnails point to that server.
+    '''
+
+    latency = 0.05
+    page_latency = 0.0
+    media_size = 1024
+    media_url = None
+    cover_url = None
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, url, download=True):
+        if url.startswith(VIDEO_URL_PREFIX):
+            time.sleep(self.latency)
+            vid = url[len(VIDEO_URL_PREFIX):]
+            info = video_info(vid, int(vid[1:]))
+
+            if self.media_url:
+                info.update(url='%s/media/%s.mp4' % (self.media_url, vid), protocol='http', filesize=self.media_size)
+
+            if self.cover_url:
+                info['thumbnail'] = '%s/covers/%s.jpg' % (self.cover_url, vid)
+
+            if download:
+                self._download(info)
+
+            return info
+
+        if url.startswith(WATCH_URL_PREFIX):
+            return self.extract_info(VIDEO_URL_PREFIX + url[len(WATCH_URL_PREFIX):], download)
+
+        if url.startswith(USER_URL_PREFIX):
+            return channel_info(url[len(USER_URL_PREFIX):])
+
+        if url.startswith(CHANNEL_URL_PREFIX):
+            channel_id = url[len(CHANNEL_URL_PREFIX):].split('/')[0]
+            count = int(channel_id[2:])
+            self._paginate(count)
+            return tab_info(channel_id, count)
+
+        playlist_id = url[len(PLAYLIST_URL_PREFIX):]
+        count = int(playlist_id[2:])
+        self._paginate(count)
+        return playlist_info(playlist_id, count)
+
+    def _paginate(self, count):
+        if self.page_latency:
+            time.sleep(self.page_latency * max(1, (count + PAGE_SIZE - 1) // PAGE_SIZE))
+
+    def prepare_filename(self, info):
+        return self.params['outtmpl'] % info
+
+    def process_info(self, info):
+        self._download(info)
+
+    def _download(self, info):
+        filename = self.prepare_filename(info)
+        # Like youtube-dl, create the directory of the output template.
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        with open(filename, 'wb') as f:
+            f.write(random.Random(info['id']).randbytes(self.media_size))
+
+        for hook in self.params.get('progress_hooks', []):
+            hook({'status': 'finished', 'filename': filename, 'total_bytes': self.media_size})
+
+
+class FakeTranslationHandler(BaseHTTPRequestHandler):
+    '''MyMemory compatible translation endpoint prefixing every line of the query.
+
+    Serve it with FakeTranslationServer, its requests counter tells how many round trips
+    the client made.
+    '''
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+        translated = '\n'.join('[zh] %s' % line for line in query.split('\n'))
+        body = json.dumps({'responseData': {'translatedText': translated}, 'matches': []}).encode('utf-8')
+
+        with self.server.lock:
+            self.server.requests += 1
+
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTranslationServer(ThreadingHTTPServer):
+    'Local fake translation endpoint, listening on a random port in a daemon thread.'
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.01):
+        super(FakeTranslationServer, self).__init__(('127.0.0.1', 0), FakeTranslationHandler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:%d/get' % self.server_address[1]
+
+
+class FakeMediaHandler(BaseHTTPRequestHandler):
+    'Serve deterministic bytes for every path, honouring If-None-Match, Range and If-Range.'
+
+    def do_GET(self):
+        body = self.server.content(self.path)
+        etag = '"%08x"' % (hash(body) & 0xffffffff)
+
+        with self.server.lock:
+            self.server.requests += 1
+
+        if time.monotonic() < self.server.outage_until:
+            with self.server.lock:
+                self.server.outage_requests += 1
+
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak_active = max(self.server.peak_active, self.server.active)
+
+        try:
+            self._send(body, etag)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def _send(self, body, etag):
+        time.sleep(self.server.latency)
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        size = len(body)
+
+        if match and self.headers.get('If-Range', etag) == etag:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self._write(body)
+
+    def _write(self, body):
+        'Send the body at the bandwidth of a single connection, if limited.'
+        if not self.server.bandwidth:
+            self.wfile.write(body)
+            return
+
+        chunk_size = 64 * 1024
+
+        try:
+            for i in range(0, len(body), chunk_size):
+                self.wfile.write(body[i:i + chunk_size])
+                time.sleep(len(body[i:i + chunk_size]) / self.server.bandwidth)
+        except ConnectionError:
+            # The client gave up the rest, e.g. an interrupted download.
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMediaServer(ThreadingHTTPServer):
+    '''Local server of the covers and media files, listening on a random port in a daemon thread.
+
+    The bandwidth in bytes per second caps every connection, not the server as a whole,
+    like the per-connection throttling of the video hosts. Until the outage_until time
+    of time.monotonic(), every request gets a 503.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, size=64 * 1024, latency=0.0, bandwidth=None):
+        super(FakeMediaServer, self).__init__(('127.0.0.1', 0), FakeMediaHandler)
+        self.size = size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        # The concurrent requests being served, and their peak.
+        self.active = 0
+        self.peak_active = 0
+        self.outage_until = 0
+        self.outage_requests = 0
+        self.lock = threading.Lock()
+        self._last = (None, None)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def content(self, path):
+        # The segments of a large file hit the same path over and over.
+        last_path, body = self._last
+
+        if last_path != path:
+            body = random.Random(path).randbytes(self.size)
+            self._last = (path, body)
+
+        return body
@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 
-import coloredlogs, logging, logging.config
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
 from functools import partial
 import click
-from youtube_downloader_cli.downloader import YTDownloader
-from youtube_downloader_cli.models import setup_database
-from youtube_downloader_cli.config import DATABASE_FILE
+from youtube_downloader_cli.metrics import metrics, JSON_FORMAT, PROMETHEUS_FORMAT
+
+# The commands import youtube-dl, peewee, requests and the rest of the package themselves,
+# so the help output and the option errors never pay for loading them.
 
 # Refer to
 #   1. https://stackoverflow.com/a/7507842/1677041
@@ -66,31 +67,493 @@ LOGGING_CONFIG = {
     }
 }
 
-logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
+def setup_logging():
+    'Configure the handlers once a command runs, the log file is not created by the help output.'
+    import logging.config
+    logging.config.dictConfig(LOGGING_CONFIG)
+
 click.option = partial(click.option, show_default=True)
 
-@click.command()
+class DefaultGroup(click.Group):
+    'Command group running the default command unless a command name is given, e.g. "main.py URL".'
+
+    def __init__(self, *args, default_command=None, **kwargs):
+        super(DefaultGroup, self).__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args.insert(0, self.default_command)
+
+        return super(DefaultGroup, self).parse_args(ctx, args)
+
+def filter_options(func):
+    'The video filter options shared by the parsing commands.'
+    for option in reversed([
+        click.option('--date-after', default='now-3years',
+                     help='Only keep the videos uploaded on or after the date, e.g. 20200101 or now-1year.'),
+        click.option('--date-before', default=None,
+                     help='Only keep the videos uploaded on or before the date.'),
+        click.option('--min-duration', default=None, type=click.IntRange(min=0),
+                     help='Only keep the videos lasting at least these seconds.'),
+        click.option('--max-duration', default=None, type=click.IntRange(min=0),
+                     help='Only keep the videos lasting at most these seconds.'),
+        click.option('--min-views', default=None, type=click.IntRange(min=0),
+                     help='Only keep the videos viewed at least these times.'),
+        click.option('--title-regex', default=None,
+                     help='Only keep the videos whose title matches the case-insensitive regex.'),
+    ]):
+        func = option(func)
+
+    return func
+
+@click.group(cls=DefaultGroup, default_command='parse')
+def main():
+    """This tool is used to parse and download the youtube videos."""
+
+@main.command()
 @click.option('--download', '-d', default=False, is_flag=True, type=click.BOOL,
               help='Whether download video or not.')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1),
+              help='The number of playlist entries to extract concurrently.')
+@click.option('--download-jobs', default=2, type=click.IntRange(min=1),
+              help='The number of media files to download concurrently.')
+@click.option('--segments', default=4, type=click.IntRange(min=1),
+              help='Download every media file in these parallel Range segments, resuming the interrupted ones. '
+                   '1 to leave the download to youtube-dl.')
+@click.option('--incremental', '-i', default=False, is_flag=True, type=click.BOOL,
+              help='Skip extracting the videos synced recently.')
+@click.option('--refresh-days', default=7, type=click.IntRange(min=0),
+              help='Extract the known videos again once they are older than these days in incremental mode.')
+@click.option('--translate', '-t', default=False, is_flag=True, type=click.BOOL,
+              help='Translate the title, description, tags and categories of the parsed videos.')
+@click.option('--cache-minutes', default=60, type=click.IntRange(min=0),
+              help='Reuse the meta data extracted within these minutes, 0 to always extract again. '
+                   'The new uploads of a cached playlist stay hidden for that long.')
+@click.option('--purge-cache', default=False, is_flag=True, type=click.BOOL,
+              help='Delete the cached meta data older than --cache-minutes at the end, the cache is kept '
+                   'for --offline otherwise and grows with every url parsed.')
+@click.option('--offline', default=False, is_flag=True, type=click.BOOL,
+              help='Replay the cached meta data without any network access.')
+@click.option('--workers', '-w', default=0, type=click.IntRange(min=0),
+              help='Parse the urls and their entries with these processes sharing the backlog in the database, '
+                   'other runs on the same machine join it. The database must be on a local disk, SQLite '
+                   'locks it through shared memory. 0 to parse in this process.')
+@filter_options
+@click.option('--metrics-file', default=None, type=click.Path(dir_okay=False, writable=True),
+              help='Write the per-stage timers and counters to the file during and at the end of the run.')
+@click.option('--metrics-format', default=JSON_FORMAT, type=click.Choice([JSON_FORMAT, PROMETHEUS_FORMAT]),
+              help='The format of the metrics file, prometheus writes a node exporter textfile.')
+@click.option('--metrics-interval', default=60, type=click.IntRange(min=1),
+              help='Seconds between the periodic writes of the metrics file.')
 @click.argument('urls', type=click.STRING, nargs=-1)
-def main(download, urls):
-    """This tool is used to parse and download the youtube videos."""
+def parse(download, jobs, download_jobs, segments, incremental, refresh_days, translate, cache_minutes, purge_cache,
+          offline, workers, date_after, date_before, min_duration, max_duration, min_views, title_regex,
+          metrics_file, metrics_format, metrics_interval, urls):
+    """Parse the videos of urls, queueing and downloading the media files with --download.
+
+    The unfinished downloads of the previous runs are resumed as well, even without urls,
+    so are the unfinished urls of the previous runs with --workers.
+    """
+    from youtube_downloader_cli.downloader import YTDownloader, DownloadPool, VideoMemo
+    from youtube_downloader_cli.filters import VideoFilter
+    from youtube_downloader_cli.jobs import JobQueue, PARSE_JOB
+    from youtube_downloader_cli.models import setup_database, iter_translated, InfoCache
+    from youtube_downloader_cli.workers import ParsePool
+    from youtube_downloader_cli.retry import retry_summary
+    from youtube_downloader_cli.config import DATABASE_FILE
 
+    setup_logging()
     logger.info('Debug is %s', 'on' if __debug__ else 'off')
+
+    if download and offline:
+        raise click.UsageError('Unable to download in offline mode.')
+
+    setup_database(DATABASE_FILE)
+
+    if metrics_file:
+        metrics.enable()
+        metrics.start_exporter(metrics_file, metrics_format, metrics_interval)
+
+    try:
+        filter_options = dict(date_after=date_after, date_before=date_before,
+                              min_duration=min_duration, max_duration=max_duration,
+                              min_views=min_views, title_regex=title_regex)
+        options = dict(download=download, jobs=jobs, incremental=incremental,
+                       refresh_age=timedelta(days=refresh_days), cache_ttl=timedelta(minutes=cache_minutes),
+                       offline=offline)
+        video_filter = VideoFilter(**filter_options)
+        # Shared by the downloaders of every url, so a video listed by several urls is handled once.
+        memo = VideoMemo()
+        parsers = None
+        pool = None
+
+        if workers:
+            JobQueue(PARSE_JOB).enqueue_many([(url, {'url': url}) for url in urls], requeue=True)
+            parsers = ParsePool(workers, DATABASE_FILE, LOGGING_CONFIG, translate=translate and not offline,
+                                filter_options=filter_options, **options)
+            parsers.start()
+
+        if download:
+            pool = DownloadPool(jobs=download_jobs, video_filter=video_filter, segments=segments)
+            pool.start()
+
+        # The parse workers take over the urls in the worker mode.
+        for url in ([] if workers else urls):
+            with YTDownloader(video_filter=video_filter, memo=memo, **options) as downloader:
+                videos = downloader.iter_parse(url)
+
+                if translate and not offline:
+                    videos = iter_translated(videos, jobs=jobs)
+
+                for video in videos:
+                    logger.debug('Result: %s' % video)
+
+        if parsers:
+            logger.info('Waiting for the parse workers to drain the backlog...')
+            failed = parsers.join()
+
+            if failed:
+                logger.error(f'{failed} parse worker(s) exited abnormally.')
+        else:
+            logger.info(video_filter.summary())
+            logger.info(memo.summary())
+
+        if pool:
+            logger.info('Waiting for the download workers to drain the queue...')
+            pool.join()
+
+        if purge_cache:
+            purged = InfoCache.purge(timedelta(minutes=cache_minutes))
+            logger.info(f'Purged {purged} cached meta data item(s) older than {cache_minutes} minute(s).')
+
+        summary = retry_summary()
+
+        if summary:
+            logger.info('Retries of this process:\n' + summary)
+    finally:
+        if metrics_file:
+            metrics.stop_exporter()
+            metrics.write(metrics_file, metrics_format)
+
+@main.command()
+@click.option('--download', '-d', default=False, is_flag=True, type=click.BOOL,
+              help='Whether download video or not.')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1),
+              help='The number of playlist entries to extract concurrently.')
+@click.option('--download-jobs', default=2, type=click.IntRange(min=1),
+              help='The number of media files to download concurrently.')
+@click.option('--segments', default=4, type=click.IntRange(min=1),
+              help='Download every media file in these parallel Range segments, 1 to leave the download to youtube-dl.')
+@click.option('--refresh-days', default=7, type=click.IntRange(min=0),
+              help='Extract the known videos again once they are older than these days.')
+@click.option('--translate', '-t', default=False, is_flag=True, type=click.BOOL,
+              help='Translate the title, description, tags and categories of the parsed videos.')
+@click.option('--min-interval', default=30, type=click.IntRange(min=1),
+              help='The minutes between the refreshes of the busiest urls.')
+@click.option('--max-interval', default=24 * 60, type=click.IntRange(min=1),
+              help='The minutes between the refreshes of the quietest urls.')
+@click.option('--status-port', default=8765, type=click.IntRange(min=0, max=65535),
+              help='Serve the schedule and backlog at http://127.0.0.1:PORT/status and the metrics at /metrics, '
+                   '0 to turn it off.')
+@click.option('--urls-file', default=None, type=click.File('r'),
+              help='Watch the urls of the file too, one per line.')
+@filter_options
+@click.argument('urls', type=click.STRING, nargs=-1)
+def watch(download, jobs, download_jobs, segments, refresh_days, translate, min_interval, max_interval, status_port,
+          urls_file, date_after, date_before, min_duration, max_duration, min_views, title_regex, urls):
+    """Keep refreshing the urls, each as often as its channel uploads, until interrupted.
+
+    Unlike parse runs from cron, the process, its database connection and extractors are
+    kept between the refreshes, and an unchanged channel stops at its sync watermark.
+    """
+    import signal
+    from youtube_downloader_cli.downloader import DownloadPool
+    from youtube_downloader_cli.filters import VideoFilter
+    from youtube_downloader_cli.models import setup_database
+    from youtube_downloader_cli.watch import Watcher
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
+
+    if min_interval > max_interval:
+        raise click.BadParameter('It must not exceed --max-interval.', param_hint='--min-interval')
+
+    if urls_file:
+        urls += tuple(line.strip() for line in urls_file if line.strip() and not line.startswith('#'))
+
+    if not urls:
+        raise click.UsageError('Missing the urls to watch.')
+
+    setup_database(DATABASE_FILE)
+    metrics.enable()
+
+    video_filter = VideoFilter(date_after=date_after, date_before=date_before,
+                               min_duration=min_duration, max_duration=max_duration,
+                               min_views=min_views, title_regex=title_regex)
+    # The meta data cache would hide the new uploads, the watermark saves the work instead.
+    watcher = Watcher(urls, min_interval=timedelta(minutes=min_interval), max_interval=timedelta(minutes=max_interval),
+                      translate=translate, download=download, jobs=jobs, incremental=True,
+                      refresh_age=timedelta(days=refresh_days), cache_ttl=None, video_filter=video_filter)
+    pool = None
+
+    def stop(signum, frame):
+        logger.info('Stopping once the running refresh is done, interrupt again to abort it.')
+        watcher.stop()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        if status_port:
+            watcher.serve_status(status_port)
+
+        if download:
+            pool = DownloadPool(jobs=download_jobs, video_filter=video_filter, segments=segments)
+            pool.start()
+
+        watcher.run()
+
+        if pool:
+            logger.info('Waiting for the download workers to drain the queue...')
+            pool.join()
+    finally:
+        watcher.close()
+
+@main.command()
+@click.option('--kind', default='download', type=click.Choice(['download', 'parse']),
+              help='The queue to show, the media downloads or the url backlog of the parse workers.')
+def status(kind):
+    """Show the depth and throughput of the download queue, or the url backlog with --kind parse."""
+    from youtube_downloader_cli.jobs import JobQueue, PENDING, RUNNING, DONE, FAILED
+    from youtube_downloader_cli.models import setup_database
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
+    setup_database(DATABASE_FILE)
+    queue = JobQueue(kind)
+    counts = queue.counts()
+
+    for state in (PENDING, RUNNING, DONE, FAILED):
+        click.echo('%-8s %d' % (state, counts.get(state, 0)))
+
+    count, total_bytes = queue.throughput(datetime.now() - timedelta(hours=1))
+    click.echo('Last hour: %d %s job(s), %.1f MiB, %.1f KiB/s' % (count, kind, total_bytes / 1024 ** 2, total_bytes / 1024 / 3600))
+
+@main.command()
+@click.option('--field', '-f', 'fields', multiple=True,
+              type=click.Choice(['title', 'description', 'tags', 'localized_title', 'localized_tags']),
+              help='Only match the query against these fields, repeat it for more fields.')
+@click.option('--uploader', default=None, help='Only show the videos of the uploader id.')
+@click.option('--playlist', default=None, help='Only show the videos of the playlist id.')
+@click.option('--date-after', default=None,
+              help='Only show the videos uploaded on or after the date, e.g. 20200101 or now-1year.')
+@click.option('--date-before', default=None,
+              help='Only show the videos uploaded on or before the date.')
+@click.option('--limit', '-n', default=20, type=click.IntRange(min=1),
+              help='The number of the best matches to show.')
+@click.option('--raw', default=False, is_flag=True, type=click.BOOL,
+              help='Pass the query as is, allowing the FTS5 syntax like OR, NOT, NEAR and prefix*.')
+@click.option('--reindex', default=False, is_flag=True, type=click.BOOL,
+              help='Rebuild the search index of the stored videos before searching.')
+@click.argument('query', type=click.STRING, required=False)
+def search(fields, uploader, playlist, date_after, date_before, limit, raw, reindex, query):
+    """Search the parsed videos by their titles, descriptions, tags and translations."""
+    from youtube_downloader_cli.filters import VideoFilter
+    from youtube_downloader_cli.models import Video, VideoIndex, setup_database
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
     setup_database(DATABASE_FILE)
 
-    def filter_video(video):
-        'Filter the uploaded date less than last 3 years.'
-        upload_date = datetime.strptime(video.upload_date, '%Y%m%d')
-        date_delta = upload_date - datetime.now()
-        return date_delta.days <= 365 * 3
+    if reindex:
+        logger.info(f'Indexed {VideoIndex.reindex()} stored video(s).')
+
+    if not query:
+        if not reindex:
+            raise click.UsageError('Missing the search query.')
+
+        return
+
+    dates = VideoFilter(date_after=date_after, date_before=date_before)
+    videos = VideoIndex.find(query, fields=fields, raw=raw)
+
+    if uploader:
+        videos = videos.where(Video.uploader == uploader)
+
+    if playlist:
+        videos = videos.where(Video.playlist == playlist)
+
+    if dates.date_after:
+        videos = videos.where(Video.uploaded_at >= Video.parse_upload_date(dates.date_after))
+
+    if dates.date_before:
+        videos = videos.where(Video.uploaded_at <= Video.parse_upload_date(dates.date_before))
+
+    for video in videos.limit(limit):
+        click.echo('%8.2f  %s  %s  %s' % (-video.score, video.upload_date or '-', video.id, video.title))
+
+@main.command()
+@click.option('--by', '-b', default='channel', type=click.Choice(['channel', 'uploader', 'playlist', 'year', 'month']),
+              help='Group the videos by this.')
+@click.option('--since', default=None,
+              help='Only count the videos uploaded on or after the date, e.g. 20200101 or now-1year.')
+@click.option('--until', default=None,
+              help='Only count the videos uploaded on or before the date.')
+@click.option('--uploader', default=None, help='Only count the videos of the uploader id.')
+@click.option('--playlist', default=None, help='Only count the videos of the playlist id.')
+@click.option('--limit', '-n', default=50, type=click.IntRange(min=0),
+              help='The number of the biggest groups to show, 0 for all of them.')
+def report(by, since, until, uploader, playlist, limit):
+    """Show the number, size and duration of the parsed videos per group."""
+    from youtube_downloader_cli.filters import VideoFilter
+    from youtube_downloader_cli.models import Video, setup_database
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
+    setup_database(DATABASE_FILE)
+
+    dates = VideoFilter(date_after=since, date_before=until)
+    rows = Video.report(by, since=Video.parse_upload_date(dates.date_after),
+                        until=Video.parse_upload_date(dates.date_before), uploader=uploader, playlist=playlist)
+
+    if limit:
+        rows = rows.limit(limit)
+
+    click.echo('%-40s %8s %10s %10s %8s  %-10s  %s' % (by, 'videos', 'downloaded', 'size MiB', 'hours', 'first', 'last'))
+
+    for key, name, videos, downloaded, total_bytes, duration, first, last in rows:
+        label = '%s (%s)' % (key, name) if name else str(key)
+        click.echo('%-40s %8d %10d %10.1f %8.1f  %-10s  %s' % (
+            label[:40], videos, downloaded, total_bytes / 1024 ** 2, duration / 3600, first or '-', last or '-'))
+
+@main.command()
+@click.option('--kind', '-k', 'kinds', multiple=True, default=['media'], type=click.Choice(['media', 'cover']),
+              help='Verify the files of this kind, repeat it for more kinds.')
+@click.option('--jobs', '-j', default=0, type=click.IntRange(min=0),
+              help='The number of hashing processes, 0 for one per CPU.')
+@click.option('--full', default=False, is_flag=True, type=click.BOOL,
+              help='Hash the unchanged files too, telling the silent corruption apart.')
+def verify(kinds, jobs, full):
+    """Hash the downloaded files, reporting the damaged, size mismatched and duplicated ones.
+
+    Only the files changed since the last run are hashed unless --full. Exits with 1 if
+    any problem is found. Run "storage reconcile" first for the files added by hand.
+    """
+    from youtube_downloader_cli.models import setup_database
+    from youtube_downloader_cli.verify import verify as verify_files
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
+    setup_database(DATABASE_FILE)
+    report = verify_files(kinds=kinds, jobs=jobs or None, full=full)
+
+    for path, problem in report.damaged:
+        click.echo('damaged     %s: %s' % (path, problem))
+
+    for path, size, expected in report.mismatched:
+        click.echo('size        %s: %d bytes, %d expected' % (path, size, expected))
 
-    for url in urls:
-        downloader = YTDownloader(download=download, filter_func=filter_video)
-        videos = downloader.parse(url)
-        [logger.debug('Result: %s' % video) for video in videos]
+    for checksum, paths in report.duplicates.items():
+        click.echo('duplicates  %s: %s' % (checksum[:16], ', '.join(paths)))
+
+    click.echo(report.summary())
+
+    if report.problems:
+        raise SystemExit(1)
+
+@main.command()
+@click.option('--table', default='videos', type=click.Choice(['videos', 'playlists', 'uploaders']),
+              help='The table to export, with the names of its uploaders and playlists joined in.')
+@click.option('--format', '-f', 'format_', default='jsonl', type=click.Choice(['jsonl', 'csv', 'parquet']),
+              help='The output format, parquet requires pyarrow.')
+@click.option('--output', '-o', default='-', type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+              help='The output file, compressed if it ends with .gz, - for the standard output.')
+@click.option('--since', default=None,
+              type=click.DateTime(['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']),
+              help='Only export the videos synced, downloaded or listed by another playlist at or after the time, '
+                   'the watermark of the previous export.')
+@click.option('--chunk-size', default=10000, type=click.IntRange(min=1),
+              help='The rows fetched and written at a time.')
+def export(table, format_, output, since, chunk_size):
+    """Stream a table of the library into a JSONL, CSV or Parquet file."""
+    from youtube_downloader_cli.models import setup_database
+    from youtube_downloader_cli.export import export as export_table
+    from youtube_downloader_cli.config import DATABASE_FILE
+    import sys
+
+    if since and table != 'videos':
+        raise click.BadOptionUsage('since', 'Only the videos are exported incrementally.')
+
+    if format_ == 'parquet' and output == '-':
+        raise click.BadOptionUsage('output', 'The parquet export must be written to a file.')
+
+    if output != '-':
+        # The console log goes to the standard output, keep it for the exported rows otherwise.
+        setup_logging()
+
+    setup_database(DATABASE_FILE)
+
+    try:
+        rows, watermark = export_table(table, format_, sys.stdout if output == '-' else output, since=since,
+                                       chunk_size=chunk_size)
+    except ImportError as e:
+        raise click.UsageError(str(e))
+
+    click.echo('Exported %d %s.' % (rows, table), err=True)
+
+    if watermark:
+        click.echo('Export the later changes with --since "%s".' % watermark, err=True)
+
+@main.group()
+def storage():
+    """Manage the downloaded files of the storage root."""
+
+@storage.command()
+@click.option('--dry-run', default=False, is_flag=True, type=click.BOOL,
+              help='Only log the files to move.')
+def migrate(dry_run):
+    """Move the files of the flat layout into the shards of their videos, then index them.
+
+    It's safe to interrupt and run again, the moved files are picked up where it stopped.
+    """
+    from youtube_downloader_cli.models import setup_database
+    from youtube_downloader_cli.storage import migrate_layout, reconcile
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
+    setup_database(DATABASE_FILE)
+
+    click.echo('%s %d file(s) into the sharded layout.' % ('Would move' if dry_run else 'Moved',
+                                                           migrate_layout(dry_run=dry_run)))
+
+    if not dry_run:
+        click.echo('Indexed the storage: %d added, %d updated, %d removed.' % reconcile())
+
+@storage.command(name='reconcile')
+def reconcile_storage():
+    """Scan the storage root once and bring the files table in line with it."""
+    from youtube_downloader_cli.models import setup_database
+    from youtube_downloader_cli.storage import reconcile
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
+    setup_database(DATABASE_FILE)
+    click.echo('Indexed the storage: %d added, %d updated, %d removed.' % reconcile())
+
+@storage.command()
+def cleanup():
+    """Remove the temporary files of the unfinished downloads, keeping the resumable ones."""
+    from youtube_downloader_cli.downloader import YTDownloader
+    from youtube_downloader_cli.models import setup_database
+    from youtube_downloader_cli.config import DATABASE_FILE
+
+    setup_logging()
+    setup_database(DATABASE_FILE)
+    YTDownloader.cleanup()
 
 if __name__ == '__main__':
     main()
@@ -28,6 +28,9 @@ setup(
         'youtube-dl>=2020.1.15',
         'translate==3.6.1',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     entry_points={
         'console_scripts': ['youtube-downloader-cli=main'],
     },
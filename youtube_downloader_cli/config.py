@@ -1,19 +1,23 @@
 from os import makedirs, remove
-from os.path import join, exists, expanduser
+from os.path import join, exists, expanduser, dirname
 import configparser
+import hashlib
 import json
 
+# Nothing is created on import, the directory is made once a file is written into it.
 _root = expanduser('~/.config/youtube-downloader-cli')
-exists(_root) or makedirs(_root)
 
 _config = None
 
 CONFIG_FILE = join(_root, 'config')
 DATABASE_FILE = join(_root, 'data.sqlite3')
 TRANSLATION_FILE = join(_root, 'translation')
+TRANSLATION_DATABASE_FILE = join(_root, 'translation.sqlite3')
 
 _SECTION_PROXY = 'PROXY'
 _SECTION_STORAGE = 'STORAGE'
+_SECTION_TRANSLATION = 'TRANSLATION'
+_SECTION_NETWORK = 'NETWORK'
 
 def _load_config():
     global _config
@@ -30,11 +34,30 @@ def _load_config():
             _config.add_section(_SECTION_STORAGE)
             _config.set(_SECTION_STORAGE, 'root_path', '~/Downloads/youtube-downloader-cli')
 
+            _config.add_section(_SECTION_TRANSLATION)
+            _config.set(_SECTION_TRANSLATION, 'endpoint', '')
+
+            _config.add_section(_SECTION_NETWORK)
+            _config.set(_SECTION_NETWORK, 'bandwidth_kib', '0')
+            _config.set(_SECTION_NETWORK, 'host_connections', '8')
+            _config.set(_SECTION_NETWORK, 'host_limits', '')
+
+            ensure_parent_directory(CONFIG_FILE)
+
             with open(CONFIG_FILE, 'w') as f:
                 _config.write(f)
 
     return _config
 
+def ensure_parent_directory(path):
+    'Create the directory of path if missing, returning path.'
+    directory = dirname(path)
+
+    if directory and not exists(directory):
+        makedirs(directory, exist_ok=True)
+
+    return path
+
 def pretty_json_string(dic):
     return json.dumps(dic, sort_keys=True, indent=4)
 
@@ -59,3 +82,33 @@ def get_storage_path():
     path = expanduser(config.get(_SECTION_STORAGE, 'root_path'))
     exists(path) or makedirs(path)
     return path
+
+def get_shard(key):
+    '''The storage subdirectory of the files of key, e.g. a video id.
+
+    The hashed keys spread evenly over 4096 directories, so none of them grows past a
+    few hundred files even for a library of a million videos.
+    '''
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=2).hexdigest()[:3]
+
+def get_translation_endpoint():
+    'The MyMemory compatible translation endpoint, empty for the public one.'
+    return _load_config().get(_SECTION_TRANSLATION, 'endpoint', fallback='')
+
+def get_network_limits():
+    '''The (bandwidth in bytes per second, connections per host, {host: connections}) limits.
+
+    The host_limits option reads like "i.ytimg.com:4, api.mymemory.translated.net:2",
+    a zero bandwidth or connection count means unlimited.
+    '''
+    config = _load_config()
+    bandwidth = config.getint(_SECTION_NETWORK, 'bandwidth_kib', fallback=0) * 1024
+    host_connections = config.getint(_SECTION_NETWORK, 'host_connections', fallback=8)
+    host_limits = {}
+
+    for item in config.get(_SECTION_NETWORK, 'host_limits', fallback='').split(','):
+        if item.strip():
+            host, _, limit = item.strip().rpartition(':')
+            host_limits[host] = int(limit)
+
+    return bandwidth, host_connections, host_limits
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from .config import get_storage_path, get_proxy, ensure_parent_directory
+from .metrics import metrics
+from .network import get_scheduler, COVER
+from .retry import RetryPolicy, CircuitOpenError
+import os
+import tempfile
+import requests
+import logging
+
+logger = logging.getLogger(__name__)
+
+_cover_retry = RetryPolicy('cover')
+
+class CoverFetcher(object):
+    '''Download the video covers in background threads over a shared pooled session.
+
+    The covers are streamed into a temporary file and renamed into place atomically, an
+    existing cover is only fetched again when the server reports a change of it. The
+    requests go through the network scheduler, ahead of the media files.
+    '''
+
+    # (connect, read) timeouts in seconds.
+    timeout = (10, 60)
+    chunk_size = 64 * 1024
+
+    def __init__(self, jobs=4):
+        self.session = requests.Session()
+        self.session.proxies = {
+            'http': get_proxy(),
+            'https': get_proxy(),
+        }
+
+        adapter = HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='cover')
+
+    @staticmethod
+    def cover_filename(url, prefix, default_extension):
+        'The local filename of the cover url.'
+        _, filename = os.path.split(urlparse(url).path)
+
+        if '.' in filename:
+            return '%s-%s' % (prefix, filename)
+        else:
+            return '%s-%s.%s' % (prefix, filename, default_extension)
+
+    def submit(self, url, filename, etag=None, last_modified=None):
+        'Schedule downloading url to filename, the future resolves to the result of fetch.'
+        return self._executor.submit(self.fetch, url, filename, etag, last_modified)
+
+    def fetch(self, url, filename, etag=None, last_modified=None, retry=10):
+        '''Download url to filename in the storage path, returning (filename, etag, last_modified).
+
+        The filename is None if the cover is failed to download.
+        '''
+        with metrics.timer('cover_download'):
+            return self._fetch(url, filename, etag, last_modified, retry)
+
+    def _fetch(self, url, filename, etag, last_modified, retry):
+        filepath = ensure_parent_directory(os.path.join(get_storage_path(), filename))
+        headers = {}
+
+        if os.path.exists(filepath):
+            if etag:
+                headers['If-None-Match'] = etag
+
+            headers['If-Modified-Since'] = last_modified or formatdate(os.path.getmtime(filepath), usegmt=True)
+
+        def fetch():
+            logger.info('Downloading cover %s' % url)
+
+            with get_scheduler().request(url, COVER), \
+                    self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 304:
+                    metrics.incr('cover_not_modified')
+                    logger.info('Found unchanged cover file "%s", reusing it...', filename)
+                    return filename, etag, last_modified
+
+                response.raise_for_status()
+                self._write(response, filepath)
+
+                logger.info('Downloaded cover to %s' % filepath)
+                return filename, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+        try:
+            return _cover_retry.call(fetch, url, retries=retry)
+        except CircuitOpenError:
+            metrics.incr('cover_failures')
+            logger.warning('Skip downloading cover [%s] while its host is down.', url)
+        except (requests.RequestException, OSError) as e:
+            metrics.incr('cover_failures')
+            logger.exception('Encounter an exception [%s] when downloading cover [%s]', e, url)
+
+        return None, etag, last_modified
+
+    def _write(self, response, filepath):
+        'Stream the response body into filepath atomically.'
+        head, tail = os.path.split(filepath)
+        fd, temp_path = tempfile.mkstemp(prefix='.%s.' % tail, suffix='.part', dir=head)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in get_scheduler().iter_content(response, self.chunk_size, COVER):
+                    f.write(chunk)
+                    metrics.incr('cover_bytes', len(chunk))
+
+            os.replace(temp_path, filepath)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self.session.close()
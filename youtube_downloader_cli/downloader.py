@@ -1,24 +1,161 @@
 from __future__ import unicode_literals
 from youtube_dl import YoutubeDL
+from youtube_dl.extractor.youtube import YoutubeIE
 from youtube_dl.utils import DownloadError
-from urllib.parse import urlparse
-from fnmatch import fnmatch
-from .config import get_storage_path, get_proxy
+from collections import deque
+from datetime import datetime, timedelta
+from os.path import exists, join
+from concurrent.futures import Future, ThreadPoolExecutor
+from .config import get_storage_path, get_proxy, get_shard, ensure_parent_directory
+from .covers import CoverFetcher
+from .jobs import JobQueue, DOWNLOAD_JOB, worker_id
+from .metrics import metrics
+from .network import get_scheduler, METADATA, MEDIA
+from .retry import RetryPolicy, CircuitOpenError, is_retryable
 from .models import *
+from .segmented import SegmentedDownloader, SegmentError, RangeNotSupported, PART_SUFFIX, SEGMENTS_SUFFIX
 import os
+import re
+import time
+import threading
 import requests
 import logging
 
 logger = logging.getLogger(__name__)
 
+_extract_retry = RetryPolicy('extract')
+
+def _ydl_options(storage_path, progress_hooks=None, video_filter=None):
+    options = {
+        'format': 'worst' if __debug__ else 'best',
+        'logger': logger,
+        'progress_hooks': progress_hooks or [],
+        'proxy': get_proxy(),
+        'forcejson': True,
+        # 'verbose': True,
+        # 'simulate': True,
+        # 'skip_download': True,
+        'extract_flat': True,
+        # The shard of the video id is set by the DownloadPool, see get_shard.
+        'outtmpl': os.path.join(storage_path, '%(shard)s', '%(title)s-%(id)s.%(ext)s'),
+    }
+
+    if video_filter:
+        options.update(video_filter.ydl_options())
+
+    return options
+
+# The uploads of a channel, its videos tab or its uploads playlist, are the only listings
+# known to be newest first, the other playlists grow at their end.
+_UPLOADS_URL = re.compile(r'/(?:channel|c|user)/[^/?#]+(?:/videos)?/?$|/@[^/?#]+(?:/videos)?/?$')
+
+def lists_uploads(meta):
+    'Whether the playlist meta data lists the uploads of a channel, newest first.'
+    return (str(meta.get('id') or '').startswith('UU') or
+            bool(_UPLOADS_URL.search(meta.get('webpage_url') or '')))
+
+def video_id_of(url):
+    'The video id of a single video url, None for the playlists, tabs and channels.'
+    return YoutubeIE._match_id(url) if YoutubeIE.suitable(url) else None
+
+class VideoMemo(object):
+    '''The ids of the videos handled in a run, shared by the YTDownloader instances of the run.
+
+    A video listed again by another playlist, tab or direct link is neither extracted nor
+    written again, only its extra playlist association is. The ids are claimed before
+    the extraction, so the concurrent occurrences don't race, and released if it fails.
+    The entries queued for the parse workers are tracked apart, they are claimed by the
+    worker extracting them.
+    '''
+
+    def __init__(self):
+        self.hits = 0
+        self.avoided = 0
+        self._ids = set()
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids | self._queued)
+
+    def claim(self, video_ids):
+        'Claim the ids not handled yet, returning them, the other ones are repeats.'
+        with self._lock:
+            claimed = set(video_id for video_id in video_ids if video_id not in self._ids)
+            self._ids.update(claimed)
+            return claimed
+
+    def queue(self, video_ids):
+        'Mark the ids not queued yet for the parse workers, returning them, the other ones are repeats.'
+        with self._lock:
+            queued = set(video_id for video_id in video_ids if video_id not in self._queued)
+            self._queued.update(queued)
+            return queued
+
+    def release(self, video_id):
+        'Let a later occurrence handle the video, its extraction failed.'
+        with self._lock:
+            self._ids.discard(video_id)
+
+    def hit(self, extraction=True):
+        'Count a repeated occurrence, and an avoided extraction unless it was known anyway.'
+        with self._lock:
+            self.hits += 1
+            self.avoided += int(extraction)
+
+        metrics.incr('memo_hits')
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._queued.clear()
+
+    def summary(self):
+        return (f'Found {self.hits} repeated occurrence(s) of {len(self)} video(s), '
+                f'avoided {self.avoided} extraction(s).')
+
 class YTDownloader(object):
-    'Youtube video downloader.'
+    '''Youtube video downloader.
+
+    The parsing only extracts the meta data, with download on, the covers are fetched
+    and the media files are queued for the DownloadPool. With a parse_queue, the playlist
+    entries are queued for the ParseWorker processes instead of being extracted here.
+    Pass the same memo to every instance of a run, so each video is handled once.
+    '''
+
+    # The extractor class, replaceable with a stub for benchmarking.
+    ydl_class = YoutubeDL
 
-    def __init__(self, download, filter_func=None):
+    def __init__(self, download, filter_func=None, jobs=1, incremental=False, refresh_age=timedelta(days=7),
+                 cache_ttl=timedelta(hours=1), offline=False, video_filter=None, parse_queue=None, memo=None):
+        assert not (download and offline), 'Unable to download in offline mode.'
         self.download = download
+        self.jobs = max(1, jobs)
+        self.incremental = incremental
+        self.refresh_age = refresh_age
+        self.cache_ttl = cache_ttl
+        self.offline = offline
+        self.video_filter = video_filter
+        self.parse_queue = parse_queue
+        self.memo = VideoMemo() if memo is None else memo
+        self.failures = 0
+        # The failures retrying won't fix, e.g. a private or removed video.
+        self.fatal_failures = 0
+        self.started_at = datetime.now()
         self._filter_func = filter_func
         self._result_playlist = None
         self._result_videos = None
+        self._executor = None
+        self._batch = VideoBatch()
+        self._covers = None
+        self._cover_futures = []
+
+        self._downloads = JobQueue(DOWNLOAD_JOB)
+
+        self._ydl_opts = _ydl_options(get_storage_path())
+        self._local = threading.local()
+        self._ydls = []
+        self._ydls_lock = threading.Lock()
 
     @property
     def filter_func(self):
@@ -33,120 +170,371 @@ class YTDownloader(object):
         return self._result_videos
 
     def parse(self, url, retry=10):
-        'Parse the video url.'
-        results = []
-
-        output_filename, output_total_bytes = None, None
-
-        def progress(d):
-            if d['status'] != 'finished':
-                return
-
-            logger.info(f'Download completed with info: {d}')
-
-            nonlocal output_filename, output_total_bytes
-            head, tail = os.path.split(d.get('filename'))
-            assert head == get_storage_path()
-            output_filename = tail
-            output_total_bytes = d.get('total_bytes')
-
-        ydl_opts = {
-            'format': 'worst' if __debug__ else 'best',
-            'logger': logger,
-            'progress_hooks': [progress],
-            'proxy': get_proxy(),
-            'forcejson': True,
-            # 'verbose': True,
-            # 'simulate': True,
-            # 'skip_download': True,
-            'extract_flat': True,
-            'outtmpl': os.path.join(get_storage_path(), '%(title)s-%(id)s.%(ext)s'),
-        }
+        'Parse the video url, returning the list of the valid videos.'
+        results = list(self.iter_parse(url, retry))
+
+        self._result_videos = results
+        return results
+
+    def iter_parse(self, url, retry=10, playlist=None):
+        '''Parse the video url, yielding the valid videos once they are persisted.
+
+        The videos are written and handed out batch by batch, so the memory stays flat
+        whatever the size of the channel, and the consumer starts working on the first
+        videos while the rest are still being extracted. A single video is attached to
+        playlist if given. The playlist of url, if any, is kept as result_playlist.
+        '''
+        self._result_playlist = None
+        video_id = video_id_of(url)
+
+        if video_id and not self.memo.claim([video_id]):
+            logger.debug(f'Skip extracting the repeated video url: {url}')
+            self.memo.hit()
+
+            if playlist:
+                self._batch.add_entry(playlist.id, video_id)
+
+            yield from self._persisted(())
+            return
+
+        meta, _ = next(self._extract_entries([url], retry))
+
+        if meta:
+            yield from self._persisted(self._handle(meta, playlist))
+        elif video_id:
+            self.memo.release(video_id)
+
+    def _persisted(self, videos):
+        'Yield the videos after flushing the batch holding them.'
+        ready = []
+
+        for video in videos:
+            ready.append(video)
+
+            if len(ready) >= self._batch.size:
+                self._collect_covers()
+                self._batch.flush()
+                yield from ready
+                ready = []
+
+        self._collect_covers(wait=True)
+        self._batch.flush()
+        yield from ready
+
+    def close(self):
+        'Shut down the entry extraction and cover download workers.'
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        with self._ydls_lock:
+            for ydl in self._ydls:
+                ydl.__exit__(None, None, None)
+
+            self._ydls = []
+            self._local = threading.local()
+
+        if self._covers:
+            self._covers.close()
+            self._covers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _extract(self, url, retry=10):
+        '''Extract the meta data of url, it's safe to be called from the worker threads.
+
+        Nothing here touches the database, the returned meta data and extraction output
+        are persisted by _handle in the calling thread.
+        '''
+        def extract():
+            logger.info(f'Parsing url: {url}')
+
+            with get_scheduler().request(url, METADATA), metrics.timer('extract_info'):
+                return self._ydl().extract_info(url, download=False)
 
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                logger.info(f'Parsing url: {url}')
-                meta = ydl.extract_info(url, download=self.download)
-                extractor = meta.get('extractor')
-
-                if extractor == 'youtube:playlist':
-                    results.extend(self._parse_playlist(meta))
-                elif extractor == 'youtube:tab':
-                    results.extend(self._parse_tab(meta))
-                elif extractor in ('youtube:channel', 'youtube:user'):
-                    results.extend(self._parse_channel(meta))
-                elif extractor == 'youtube':
-                    video = self._parse_video(meta)
-
-                    if video and output_filename:
-                        video.filename = output_filename
-                        video.total_bytes = output_total_bytes
-                        video.save()
-
-                    results.append(video)
-                else:
-                    logger.warning(f'Unknown extractor: {extractor}')
+            return _extract_retry.call(extract, url, retries=retry), {}
+        except CircuitOpenError as e:
+            logger.warning(f'Skip parsing url [{url}] while its host is down.')
+            error = e
         except (requests.RequestException, DownloadError) as e:
-            logger.exception(f'Encounter an exception [{e}] when parsing url [{url}], download option: {self.download}')
+            logger.exception(f'Encounter an exception [{e}] when parsing url [{url}]')
+            error = e
 
-            if retry > 0:
-                logger.warning(f'Retry to parse URL: {url}')
-                results = self.parse(url, retry=retry-1)
+        metrics.incr('extract_failures')
+        return None, {'error': error}
 
-        self._result_videos = results
-        return results
+    def _ydl(self):
+        'The long-lived YoutubeDL instance of the current thread.'
+        ydl = getattr(self._local, 'ydl', None)
+
+        if ydl is None:
+            ydl = self._local.ydl = self.ydl_class(self._ydl_opts).__enter__()
+
+            with self._ydls_lock:
+                self._ydls.append(ydl)
+
+        return ydl
+
+    def _extract_entries(self, urls, retry=10):
+        '''Extract the urls with the worker pool, yielding (meta, output) in the order of urls.
+
+        The cached meta data are served without touching the network, and the freshly
+        extracted ones are scheduled for caching. At most jobs * 2 urls are in flight, so
+        the finished results never pile up while the calling thread is busy persisting
+        the earlier ones.
+        '''
+        cached = self._cached_infos(urls)
+
+        def extract(url):
+            if url in cached:
+                logger.debug(f'Found cached meta data of url: {url}')
+                return cached.pop(url).info(), {'cached': True}
+
+            if self.offline:
+                logger.warning(f'Skip the uncached url in offline mode: {url}')
+                return None, {}
+
+            return self._extract(url, retry)
+
+        def submit(url):
+            if url in cached or self.offline or self.jobs <= 1:
+                future = Future()
+                future.set_result(extract(url))
+                return future
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='extractor')
+
+            return self._executor.submit(self._extract, url, retry)
+
+        def complete(url, future):
+            meta, output = future.result()
+
+            if output.get('cached'):
+                metrics.incr('info_cache_hits')
+            elif meta:
+                metrics.incr('info_cache_misses')
+                self._batch.add_info(InfoCache.pack(url, meta))
+            else:
+                self.failures += 1
+                error = output.get('error')
+
+                # The host being down is worth another try later.
+                if error is not None and not isinstance(error, CircuitOpenError) and not is_retryable(error):
+                    self.fatal_failures += 1
+
+            return meta, output
+
+        pending = deque()
+
+        for url in urls:
+            pending.append((url, submit(url)))
+
+            if len(pending) >= self.jobs * 2:
+                yield complete(*pending.popleft())
+
+        while pending:
+            yield complete(*pending.popleft())
+
+    def _cached_infos(self, urls):
+        'Look up the usable cached meta data of urls, keyed by url.'
+        if self.offline:
+            return InfoCache.lookup(urls)
+
+        if not self.cache_ttl:
+            return {}
+
+        return InfoCache.lookup(urls, self.cache_ttl)
+
+    def _handle(self, meta, playlist=None):
+        '''Persist the extracted meta data, yielding the valid videos.
+
+        Must be iterated in the database writer thread, the yielded videos may still be
+        waiting in the batch, see _persisted.
+        '''
+        extractor = meta.get('extractor')
+
+        if extractor == 'youtube:playlist':
+            yield from self._parse_playlist(meta)
+        elif extractor == 'youtube:tab':
+            yield from self._parse_tab(meta)
+        elif extractor in ('youtube:channel', 'youtube:user'):
+            yield from self._parse_channel(meta)
+        elif extractor == 'youtube':
+            video = self._parse_video(meta, playlist)
+
+            if video:
+                yield video
+        else:
+            logger.warning(f'Unknown extractor: {extractor}')
 
     def _parse_playlist(self, meta):
         'Parse the playlist result.'
         logger.debug(f'Found playlist meta data: {meta}')
 
-        results = []
-        playlist = Playlist.initialize(meta)
+        playlist = self._result_playlist = Playlist.initialize(meta)
         entries = meta.get('entries', [])
         count = len(entries)
         logger.info(f'Parse playlist: {playlist}, entry count: {count}')
 
-        for i in range(count):
-            entry = entries[i]
-            video_id = entry.get('id')
-            video_url = 'https://youtu.be/%s' % video_id
+        urls = ['https://youtu.be/%s' % entry.get('id') for entry in entries]
+        yield from self._parse_entries(playlist, entries, urls, newest_first=lists_uploads(meta))
 
-            logger.debug(f'Start parsing entry {i}:')
-            videos = self.parse(video_url)
-            assert len(videos) == 1
-            video = videos[0]
-
-            video.playlist = playlist
-            video.save()
-            results.append(video)
-
-        logger.debug(f'Finish parsing playlist with {len(results)} video(s).')
-        return results
+        logger.debug(f'Finish parsing playlist {playlist}.')
 
     def _parse_tab(self, meta):
         'Parse the tab result.'
         logger.debug(f'Found tab meta data: {meta}')
 
-        results = []
-        playlist = Playlist.initialize(meta)
+        playlist = self._result_playlist = Playlist.initialize(meta)
         entries = meta.get('entries', [])
         count = len(entries)
         logger.info(f'Parse tab playlist: {playlist}, entry count: {count}')
 
-        for i in range(count):
-            entry = entries[i]
-            video_url = entry.get('url')
+        urls = [entry.get('url') for entry in entries]
+        yield from self._parse_entries(playlist, entries, urls, newest_first=lists_uploads(meta))
 
-            logger.debug(f'Start parsing entry {i}:')
-            videos = self.parse(video_url)
+        logger.debug(f'Finish parsing tab {playlist}.')
 
-            for video in videos:
-                video.playlist = playlist
-                video.save()
-                results.append(video)
+    def _parse_entries(self, playlist, entries, urls, newest_first=False):
+        '''Extract the flat playlist entries and attach the videos to playlist, yielding the valid ones.
 
-        logger.debug(f'Finish parsing tab with {len(results)} video(s).')
-        return results
+        In incremental mode, the entries behind the sync watermark of a fresh playlist
+        listed newest_first, i.e. the uploads of a channel, are skipped entirely. The other
+        playlists get their new videos at the end, so they are walked in full. The videos
+        synced within refresh_age are reused from the database instead of being extracted
+        again. The entries rejected by the video filter with their flat data or stored rows
+        are never extracted.
+
+        The entries are looked up in chunks of the batch size, so only one chunk of the
+        stored rows is held at a time.
+        '''
+        complete = True
+        count = len(entries)
+        watermark = entries[0].get('id') if entries and newest_first else None
+
+        if self.incremental and newest_first:
+            entries, urls = self._entries_before_watermark(playlist, entries, urls)
+
+        full_pass = len(entries) == count
+        size = self._batch.size
+
+        for i in range(0, len(entries), size):
+            chunk_complete = yield from self._parse_chunk(playlist, entries[i:i + size], urls[i:i + size])
+            complete = complete and chunk_complete
+
+        self._collect_covers()
+        self._batch.flush()
+
+        if self.incremental and complete:
+            playlist.watermark = watermark
+
+            # Only a full pass renews the sync time, a partial one must not postpone the next full pass.
+            if full_pass:
+                playlist.synced_at = datetime.now()
+
+            playlist.save()
+
+    def _parse_chunk(self, playlist, entries, urls):
+        'Parse a chunk of the playlist entries, returning whether every entry is extracted.'
+        stored = {}
+        known = {}
+        complete = True
+
+        if self.incremental or self.video_filter:
+            stored = Video.stored_videos([entry.get('id') for entry in entries])
+
+        if self.incremental:
+            known = dict((vid, video) for vid, video in stored.items() if video.is_fresh(self.refresh_age))
+            logger.info(f'Found {len(known)} known video(s) out of {len(entries)} entries.')
+
+        if self.video_filter:
+            matched = [(entry, url) for entry, url in zip(entries, urls)
+                       if entry.get('ie_key', 'Youtube') != 'Youtube'
+                       or self.video_filter.match_entry(entry, stored.get(entry.get('id')))]
+            entries, urls = [entry for entry, _ in matched], [url for _, url in matched]
+
+        # The videos handled already in this run, by another playlist or earlier in this one, are only listed.
+        # The queued entries are claimed by the worker parsing them, they are only queued once.
+        video_ids = [entry.get('id') for entry in entries if entry.get('ie_key', 'Youtube') == 'Youtube']
+        fresh = self.memo.queue(video_ids) if self.parse_queue else self.memo.claim(video_ids)
+        repeated = []
+
+        for entry in entries:
+            repeated.append(entry.get('ie_key', 'Youtube') == 'Youtube' and entry.get('id') not in fresh)
+            fresh.discard(entry.get('id'))
+
+        pending = [url for entry, url, repeat in zip(entries, urls, repeated)
+                   if not repeat and entry.get('id') not in known]
+
+        if self.parse_queue:
+            # Shard the entries across the worker processes instead of extracting them here.
+            # The jobs finished by the earlier runs are parsed again, not the ones of this run.
+            self.parse_queue.enqueue_many([(url, {'url': url, 'playlist': playlist.id}) for url in pending],
+                                          requeue=True, requeue_before=self.started_at)
+            logger.info(f'Queued {len(pending)} entries of playlist {playlist} for the parse workers.')
+            pending = []
+
+        extracted = self._extract_entries(pending)
+
+        for i, (entry, repeat) in enumerate(zip(entries, repeated)):
+            video = known.get(entry.get('id'))
+
+            if repeat:
+                logger.debug(f'Skip the repeated entry {i}: {entry.get("id")}')
+                self.memo.hit(extraction=not video)
+                self._batch.add_entry(playlist.id, entry.get('id'))
+            elif video:
+                logger.debug(f'Skip extracting known entry {i}: {video}')
+                self._batch.add_entry(playlist.id, video.id)
+
+                if self.filter_func and not self.filter_func(video):
+                    continue
+
+                if self.video_filter and not self.video_filter.match_video(video):
+                    continue
+
+                if video.playlist_id != playlist.id:
+                    video.playlist = playlist
+                    self._batch.add(video)
+
+                if self.download and not video.filename:
+                    self._queue_download(video)
+
+                yield video
+            elif self.parse_queue:
+                # The worker extracting a video queued by several playlists only knows one of them.
+                if entry.get('ie_key', 'Youtube') == 'Youtube':
+                    self._batch.add_entry(playlist.id, entry.get('id'))
+            else:
+                entry_meta, _ = next(extracted)
+                logger.debug(f'Finish extracting entry {i}.')
+
+                if not entry_meta:
+                    complete = False
+                    self.memo.release(entry.get('id'))
+                    continue
+
+                yield from self._handle(entry_meta, playlist)
+
+        return complete
+
+    def _entries_before_watermark(self, playlist, entries, urls):
+        'Cut off the entries synced by the previous pass of a fresh playlist.'
+        if not (playlist.watermark and playlist.is_fresh(self.refresh_age)):
+            return entries, urls
+
+        for i, entry in enumerate(entries):
+            if entry.get('id') == playlist.watermark:
+                logger.info(f'Reached the sync watermark of playlist {playlist}, skipping {len(entries) - i} entries.')
+                return entries[:i], urls[:i]
+
+        return entries, urls
 
     def _parse_channel(self, meta):
         'Parse the channel result.'
@@ -155,76 +543,300 @@ class YTDownloader(object):
         assert(meta.get('_type') == 'playlist')
         url = meta.get('url')
         logger.info(f'Parse channel list: {url}')
-        return self.parse(url)
+        yield from self.iter_parse(url)
 
-    def _parse_video(self, meta):
+    def _parse_video(self, meta, playlist=None):
         'Parse the specified single video.'
         logger.debug(f'Found video meta data: {meta.get("url")}')
 
-        video = Video.initialize(meta)
+        with metrics.timer('video_init'):
+            video = Video.from_info(meta)
+
+        video.playlist = playlist
         valid = True
 
+        if playlist:
+            self._batch.add_entry(playlist.id, video.id)
+
         if self.filter_func:
             valid = self.filter_func(video)
 
-        if self.download and 'http' in video.thumbnail:
-            _, filename = self._download_cover(video.thumbnail, video.id, 'jpg')
-            video.thumbnail = filename
-            video.save()
+        if valid and self.video_filter:
+            valid = self.video_filter.match_info(meta)
+
+        if valid and self.download:
+            if video.thumbnail and 'http' in video.thumbnail:
+                self._fetch_cover(video)
+
+            self._queue_download(video)
 
         if valid:
             logger.info(f'Found video: {video}')
-            return video
-        elif self.download:
-            logger.info(f'Remove the downloaded files of invalid video: {video}')
-            video.remove_cached_file()
         else:
             logger.info(f'Skipping video: {video}')
 
-        return None
+        self._batch.add(video, video.uploader)
+        return video if valid else None
 
-    def _download_cover(self, url, prefix, default_extension, retry=10):
-        try:
-            _, filename = os.path.split(urlparse(url).path)
+    def _queue_download(self, video):
+        'Schedule the media file of video for the download workers.'
+        self._batch.add_job(self._downloads.job(video.id, {'url': video.webpage_url or 'https://youtu.be/%s' % video.id}))
 
-            if '.' in filename:
-                filename = '%s-%s' % (prefix, filename)
-            else:
-                filename = '%s-%s.%s' % (prefix, filename, default_extension)
+    def _fetch_cover(self, video):
+        'Download the cover of video in background, pointing its thumbnail to the local file.'
+        if self._covers is None:
+            self._covers = CoverFetcher(jobs=self.jobs)
 
-            filepath = os.path.join(get_storage_path(), filename)
+        url = video.thumbnail
+        filename = join(get_shard(video.id), CoverFetcher.cover_filename(url, video.id, 'jpg'))
+        cover = Cover.get_or_none(Cover.filename == filename)
 
-            if exists(filepath):
-                logger.info('Found existing cover file "%s", reusing it...', filename)
-                return filepath, filename
+        if cover:
+            future = self._covers.submit(url, filename, cover.etag, cover.last_modified)
+        else:
+            future = self._covers.submit(url, filename)
 
-            logger.info('Downloading cover %s' % url)
-            response = requests.get(url, proxies={
-                'http': get_proxy(),
-                'https': get_proxy(),
-            })
-            logger.info('Downloaded cover to %s' % filepath)
+        self._cover_futures.append((url, video.id, future))
+        video.thumbnail = filename
 
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-        except (requests.RequestException, DownloadError) as e:
-            if retry > 0:
-                logger.warning('Retry to parse URL: %s' % url)
-                filepath, filename = self._download_cover(url, prefix, default_extension, retry-1)
-            else:
-                logger.exception('Encounter an exception [%s] when downloading cover [%s]', e, url)
-                filepath = None
+    def _collect_covers(self, wait=False):
+        'Schedule the validators of the downloaded covers for writing.'
+        pending = []
+
+        for url, video_id, future in self._cover_futures:
+            if not (wait or future.done()):
+                pending.append((url, video_id, future))
+                continue
+
+            filename, etag, last_modified = future.result()
+
+            if filename:
+                self._batch.add_cover(Cover(filename=filename, url=url, etag=etag, last_modified=last_modified))
+                file = File.stat(filename, File.COVER, video_id)
+
+                if file:
+                    self._batch.add_file(file)
 
-        return filepath, filename
+        self._cover_futures = pending
 
     @classmethod
     def cleanup(cls):
-        'Clean up all the temporarily files generated by youtube-dl when downloading.'
-        patterns = ['*.mp4.*']
-
-        for root, dirs, files in os.walk(get_storage_path(), topdown=False):
-            for name in files:
-                if any(fnmatch(name, p) for p in patterns):
-                    path = os.path.join(root, name)
-                    logger.info('Removing file %s' % path)
-                    os.remove(path)
+        '''Clean up all the temporarily files generated when downloading.
+
+        The unfinished downloads are looked up in the files table rather than walking the
+        storage. The partial files of the segmented downloads are kept along with their
+        segment maps, the next download of them resumes with the missing segments.
+        '''
+        storage_path = get_storage_path()
+
+        for file in File.select().where(File.kind == File.PARTIAL):
+            # The partial rows are keyed by the part file, the other temporary files go along.
+            filepath = join(storage_path, file.path[:-len(PART_SUFFIX)])
+
+            if SegmentedDownloader.is_resumable(filepath + PART_SUFFIX):
+                logger.info('Keeping resumable file %s' % filepath)
+                continue
+
+            for suffix in (PART_SUFFIX, '.ytdl', SEGMENTS_SUFFIX):
+                if exists(filepath + suffix):
+                    logger.info('Removing file %s' % (filepath + suffix))
+                    os.remove(filepath + suffix)
+
+            file.delete_instance()
+
+class DownloadPool(object):
+    '''Drain the queued download jobs with worker threads, each owning a YoutubeDL instance.
+
+    The workers keep polling the queue until join() is called, then exit once there is
+    nothing left to claim. The unfinished jobs stay in the database for the next run.
+
+    With segments, a selected format served over plain HTTP is fetched in that many
+    parallel Range segments and resumed from its segment map after an interruption,
+    the other ones are left to youtube-dl.
+    '''
+
+    # The downloader class, replaceable with a stub for benchmarking.
+    ydl_class = YoutubeDL
+    poll_interval = 5
+    renew_interval = 30
+
+    def __init__(self, jobs=2, queue=None, video_filter=None, segments=4):
+        self.jobs = max(1, jobs)
+        self.queue = queue or JobQueue(DOWNLOAD_JOB)
+        self.video_filter = video_filter
+        self.segments = segments
+        self.storage_path = get_storage_path()
+        self._segmented = None
+        self._draining = threading.Event()
+        self._threads = []
+        self._local = threading.local()
+
+    def start(self):
+        if self.segments > 1:
+            self._segmented = SegmentedDownloader(self.segments, pool_size=self.jobs * self.segments)
+
+        for i in range(self.jobs):
+            thread = threading.Thread(target=self._run, name='downloader-%d' % i, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        'Wait for the workers to drain the queue.'
+        self._draining.set()
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+
+        if self._segmented:
+            self._segmented.close()
+            self._segmented = None
+
+    def _run(self):
+        owner = worker_id()
+
+        with self.ydl_class(_ydl_options(self.storage_path, [self._progress, self._throttle], self.video_filter)) as ydl:
+            while True:
+                job = self.queue.claim(owner)
+
+                if job:
+                    try:
+                        self._download(ydl, job)
+                    except Exception as e:
+                        # Anything else, e.g. a full disk or a post processing error, must not kill the worker.
+                        logger.exception(f'Encounter an exception [{e}] when downloading {job}')
+                        metrics.incr('download_failures')
+                        self.queue.fail(job, e)
+                elif self._draining.is_set():
+                    break
+                else:
+                    self._draining.wait(self.poll_interval)
+
+        Job._meta.database.close()
+
+    def _download(self, ydl, job):
+        video = Video.get_or_none(Video.id == job.key)
+
+        if video and video.filename and File.existing([video.filename]):
+            logger.info(f'Found downloaded video file "{video.filename}", skipping it...')
+            self.queue.complete(job, video.total_bytes)
+            return
+
+        # Collected by the progress hook of the same thread.
+        self._local.job = job
+        self._local.renewed_at = time.monotonic()
+        output = self._local.output = {}
+
+        try:
+            logger.info(f'Downloading {job}')
+
+            with metrics.timer('media_download'):
+                self._fetch(ydl, job.payload['url'])
+        except (requests.RequestException, DownloadError, SegmentError, CircuitOpenError) as e:
+            metrics.incr('download_failures')
+            self.queue.fail(job, e)
+            return
+
+        with Job._meta.database.atomic():
+            File.delete().where((File.video == job.key) & (File.kind == File.PARTIAL)).execute()
+
+            if output.get('filename'):
+                (Video
+                 .update(filename=output['filename'], total_bytes=output.get('total_bytes'),
+                         updated_at=datetime.now())
+                 .where(Video.id == job.key)
+                 .execute())
+
+                File.record(output['filename'], File.MEDIA, job.key)
+
+            self.queue.complete(job, output.get('total_bytes'))
+
+        metrics.incr('downloads')
+
+    def _fetch(self, ydl, url):
+        '''Download the media file of url, in Range segments if the selected format allows it.
+
+        The extraction and the transfer take their slots of the network scheduler apart,
+        so the metadata requests of the parsers never queue behind a long download.
+        '''
+        with get_scheduler().request(url, METADATA):
+            info = ydl.extract_info(url, download=False)
+
+        if not info:
+            return
+
+        info['shard'] = get_shard(info['id'])
+        filepath = ydl.prepare_filename(info)
+
+        # Tell cleanup about the temporary files in the making, the row goes once it's done.
+        File.replace(path=os.path.relpath(filepath, self.storage_path) + PART_SUFFIX, video=info['id'],
+                     kind=File.PARTIAL).execute()
+
+        if not (self._segmented and self._segmentable(info)):
+            self._process(ydl, info)
+            return
+
+        # The criteria youtube-dl checks in process_info, which is bypassed here.
+        if self.video_filter and not self.video_filter.match_info(info):
+            return
+
+        ensure_parent_directory(filepath)
+
+        if exists(filepath):
+            logger.info(f'Found downloaded file "{filepath}", skipping it...')
+            self._progress({'status': 'finished', 'filename': filepath, 'total_bytes': os.path.getsize(filepath)})
+            return
+
+        try:
+            self._segmented.download(info['url'], filepath, info.get('filesize'), info.get('http_headers'),
+                                     self._progress)
+            metrics.incr('segmented_downloads')
+        except RangeNotSupported:
+            logger.info(f'Downloading {url} as a single stream, its server ignores Range.')
+            self._process(ydl, info)
+
+    def _process(self, ydl, info):
+        'Leave the download of the extracted info to youtube-dl, paced by _throttle.'
+        self._local.downloaded_bytes = 0
+
+        with get_scheduler().request(info.get('url') or info.get('webpage_url') or '', MEDIA):
+            ydl.process_info(info)
+
+    @staticmethod
+    def _segmentable(info):
+        'Whether the selected format is a single file served over plain HTTP.'
+        return bool(info and info.get('url') and not info.get('requested_formats') and
+                    info.get('protocol') in ('http', 'https'))
+
+    def _throttle(self, d):
+        'Pace the youtube-dl downloads within the shared bandwidth, the hook runs in its download loop.'
+        if d['status'] != 'downloading':
+            return
+
+        downloaded = d.get('downloaded_bytes') or 0
+        get_scheduler().throttle(max(0, downloaded - self._local.downloaded_bytes), MEDIA)
+        self._local.downloaded_bytes = downloaded
+
+    def _progress(self, d):
+        if time.monotonic() - self._local.renewed_at > self.renew_interval:
+            self.queue.renew(self._local.job)
+            self._local.renewed_at = time.monotonic()
+
+        if d['status'] == 'downloading' and d.get('speed'):
+            metrics.gauge('media_bytes_per_second', d['speed'])
+
+        if d['status'] != 'finished':
+            return
+
+        logger.info(f'Download completed with info: {d}')
+
+        metrics.incr('media_bytes', d.get('total_bytes') or 0)
+
+        if d.get('elapsed'):
+            metrics.observe('media_transfer', d['elapsed'])
+
+        filename = os.path.relpath(d.get('filename'), self.storage_path)
+        assert not filename.startswith(os.pardir)
+        self._local.output['filename'] = filename
+        self._local.output['total_bytes'] = d.get('total_bytes')
@@ -0,0 +1,274 @@
+from .models import (Uploader, Playlist, Video, PlaylistEntry, fn, JOIN, JSONField, IntegerField, DoubleField,
+                     DateTimeField, DateField)
+import csv
+import gzip
+import json
+import logging
+import operator
+
+logger = logging.getLogger(__name__)
+
+JSONL_FORMAT = 'jsonl'
+CSV_FORMAT = 'csv'
+PARQUET_FORMAT = 'parquet'
+
+EXPORT_FORMATS = (JSONL_FORMAT, CSV_FORMAT, PARQUET_FORMAT)
+EXPORT_TABLES = ('videos', 'playlists', 'uploaders')
+
+def _video_columns():
+    playlists = (PlaylistEntry
+                 .select(fn.GROUP_CONCAT(PlaylistEntry.playlist))
+                 .where(PlaylistEntry.video == Video.id))
+
+    return [
+        ('id', Video.id),
+        ('title', Video.title),
+        ('webpage_url', Video.webpage_url),
+        ('duration', Video.duration),
+        ('width', Video.width),
+        ('height', Video.height),
+        ('fps', Video.fps),
+        ('ext', Video.ext),
+        ('view_count', Video.view_count),
+        ('like_count', Video.like_count),
+        ('average_rating', Video.average_rating),
+        ('channel_id', Video.channel_id),
+        ('channel_url', Video.channel_url),
+        ('upload_date', Video.upload_date),
+        ('uploaded_at', Video.uploaded_at),
+        ('thumbnail', Video.thumbnail),
+        ('description', Video.description),
+        ('categories', Video.categories),
+        ('tags', Video.tags),
+        ('filename', Video.filename),
+        ('total_bytes', Video.total_bytes),
+        ('synced_at', Video.synced_at),
+        ('updated_at', Video.updated_at),
+        ('uploader_id', Video.uploader),
+        ('uploader_name', Uploader.name),
+        ('uploader_url', Uploader.url),
+        ('playlist_id', Video.playlist),
+        ('playlist_title', Playlist.title),
+        # Every playlist listing the video, comma separated.
+        ('playlists', playlists, None),
+    ]
+
+def export_query(table, since=None):
+    '''The (columns, query) of the export of table, the joins resolved by SQLite.
+
+    The columns are (name, field) pairs, the field tells the type of the column. Only
+    the videos changed at or after since are selected, the other tables have no
+    timestamps to export incrementally.
+    '''
+    if table == 'videos':
+        columns = _video_columns()
+        query = (Video
+                 .select(*[column[1] for column in columns])
+                 .join(Uploader, JOIN.LEFT_OUTER, on=(Video.uploader == Uploader.id))
+                 .switch(Video)
+                 .join(Playlist, JOIN.LEFT_OUTER, on=(Video.playlist == Playlist.id)))
+
+        if since:
+            query = query.where(Video.updated_at >= since)
+
+        return _typed(columns), query.order_by(Video.id)
+
+    assert not since, 'Only the videos are exported incrementally.'
+
+    if table == 'playlists':
+        videos = PlaylistEntry.select(fn.COUNT(1)).where(PlaylistEntry.playlist == Playlist.id)
+        columns = [
+            ('id', Playlist.id),
+            ('title', Playlist.title),
+            ('webpage_url', Playlist.webpage_url),
+            ('uploader_id', Playlist.uploader),
+            ('uploader_name', Uploader.name),
+            ('synced_at', Playlist.synced_at),
+            ('videos', videos, IntegerField()),
+        ]
+        query = (Playlist
+                 .select(*[column[1] for column in columns])
+                 .join(Uploader, JOIN.LEFT_OUTER, on=(Playlist.uploader == Uploader.id)))
+        return _typed(columns), query.order_by(Playlist.id)
+
+    if table == 'uploaders':
+        videos = Video.select(fn.COUNT(1)).where(Video.uploader == Uploader.id)
+        columns = [
+            ('id', Uploader.id),
+            ('name', Uploader.name),
+            ('url', Uploader.url),
+            ('videos', videos, IntegerField()),
+        ]
+        return _typed(columns), Uploader.select(*[column[1] for column in columns]).order_by(Uploader.id)
+
+    raise ValueError('Unknown table %s' % table)
+
+def _typed(columns):
+    'The (name, field) of the (name, node[, field]) columns, the subqueries without a field are text.'
+    return [(column[0], column[2] if len(column) > 2 else column[1]) for column in columns]
+
+def iter_chunks(query, chunk_size=10000):
+    '''Yield the rows of query as lists of raw tuples, chunk_size rows at a time.
+
+    The query runs on a plain DB-API cursor, so neither model instances nor the field
+    conversions are involved, the dates stay ISO strings and the JSON fields their
+    stored text. Only one chunk is held in memory.
+    '''
+    cursor = query._database.execute(query)
+
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+
+            if not rows:
+                break
+
+            yield rows
+    finally:
+        cursor.close()
+
+class JSONLWriter(object):
+    'Write a JSON object per line, the JSON fields are spliced in as stored rather than decoded.'
+
+    def __init__(self, stream, columns):
+        self.stream = stream
+        self._names = [name for name, field in columns if not isinstance(field, JSONField)]
+        self._plain = operator.itemgetter(*[i for i, (_, field) in enumerate(columns)
+                                            if not isinstance(field, JSONField)])
+        self._json = [(i, ', %s: ' % json.dumps(name)) for i, (name, field) in enumerate(columns)
+                      if isinstance(field, JSONField)]
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write(self, rows):
+        names, plain, encode = self._names, self._plain, self._encode
+        lines = []
+
+        for row in rows:
+            line = encode(dict(zip(names, plain(row))))
+
+            if self._json:
+                line = line[:-1] + ''.join(key + (row[i] or 'null') for i, key in self._json) + '}'
+
+            lines.append(line + '\n')
+
+        self.stream.writelines(lines)
+
+    def close(self):
+        pass
+
+class CSVWriter(object):
+    'Write the rows with a header line, the JSON fields as their JSON text.'
+
+    def __init__(self, stream, columns):
+        self._writer = csv.writer(stream)
+        self._writer.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        pass
+
+class ParquetWriter(object):
+    '''Write a row group per chunk with typed columns, requires pyarrow.
+
+    The JSON lists become list<string> columns, the dates and times date32 and
+    timestamp columns.
+    '''
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('The parquet export requires pyarrow, install it with "pip install pyarrow".')
+
+        self._pa = pyarrow
+        self.schema = pyarrow.schema([(name, self._arrow_type(field)) for name, field in columns])
+        self._json = set(i for i, (_, field) in enumerate(columns) if isinstance(field, JSONField))
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def _arrow_type(self, field):
+        pa = self._pa
+
+        if isinstance(field, JSONField):
+            return pa.list_(pa.string())
+
+        if isinstance(field, IntegerField):
+            return pa.int64()
+
+        if isinstance(field, DoubleField):
+            return pa.float64()
+
+        if isinstance(field, DateTimeField):
+            return pa.timestamp('us')
+
+        if isinstance(field, DateField):
+            return pa.date32()
+
+        return pa.string()
+
+    def write(self, rows):
+        pa = self._pa
+        arrays = []
+
+        for i, field in enumerate(self.schema):
+            values = [row[i] for row in rows]
+
+            if i in self._json:
+                arrays.append(pa.array([json.loads(value) if value else None for value in values], field.type))
+            elif pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+                # SQLite stores them as ISO strings, let arrow parse them.
+                arrays.append(pa.array(values, pa.string()).cast(field.type))
+            else:
+                arrays.append(pa.array(values, field.type))
+
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+def export(table, format, output, since=None, chunk_size=10000):
+    '''Stream table into output in format, returning (rows, watermark).
+
+    output is a path, a .gz one is compressed, or a text stream for the JSONL and CSV
+    formats. The watermark is the latest updated_at of the exported videos, the since of
+    the next incremental export.
+    '''
+    columns, query = export_query(table, since=since)
+    names = [name for name, _ in columns]
+    updated_at = names.index('updated_at') if table == 'videos' else None
+    stream = None
+
+    if format == PARQUET_FORMAT:
+        if not isinstance(output, str):
+            raise ValueError('The parquet export must be written to a file.')
+
+        writer = ParquetWriter(output, columns)
+    else:
+        if isinstance(output, str):
+            opener = gzip.open if output.endswith('.gz') else open
+            output = stream = opener(output, 'wt', encoding='utf-8', newline='')
+
+        writer = (JSONLWriter if format == JSONL_FORMAT else CSVWriter)(output, columns)
+
+    rows = 0
+    watermark = None
+
+    try:
+        for chunk in iter_chunks(query, chunk_size):
+            writer.write(chunk)
+            rows += len(chunk)
+
+            if updated_at is not None:
+                latest = max((row[updated_at] for row in chunk if row[updated_at]), default=None)
+                watermark = max(watermark, latest) if watermark and latest else watermark or latest
+
+            logger.debug(f'Exported {rows} {table} so far.')
+    finally:
+        writer.close()
+
+        if stream:
+            stream.close()
+
+    return rows, watermark
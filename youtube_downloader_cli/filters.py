@@ -0,0 +1,132 @@
+from youtube_dl.utils import DateRange, date_from_str
+from .metrics import metrics
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The fields never changing after the upload, safe to be checked against the stale rows.
+_STABLE_FIELDS = ('upload_date', 'duration', 'title')
+
+class VideoFilter(object):
+    '''Declarative video filter, evaluated as early as the available data allows.
+
+    Every criterion is optional. The flat playlist entries and the stored Video rows are
+    only rejected by the criteria their fields can decide, so the excluded videos are
+    never extracted, and the download workers pass the same criteria to youtube-dl so
+    nothing is transferred for them. The dates accept the youtube-dl date syntax, e.g.
+    20200101 or now-3years.
+    '''
+
+    def __init__(self, date_after=None, date_before=None, min_duration=None, max_duration=None,
+                 min_views=None, title_regex=None):
+        self.date_after = self._date(date_after)
+        self.date_before = self._date(date_before)
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.min_views = min_views
+        self.title_regex = re.compile(title_regex, re.IGNORECASE) if title_regex else None
+
+        self.skipped_entries = 0
+        self.rejected_videos = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _date(value):
+        return date_from_str(value).strftime('%Y%m%d') if value else None
+
+    def reason(self, data, fields=None):
+        '''The reason to reject the data, None if it passes.
+
+        The data is a dict like the info dicts or the flat entries, the missing fields
+        are not checked. With fields, only the criteria of these fields are checked.
+        '''
+        def get(field):
+            return data.get(field) if fields is None or field in fields else None
+
+        upload_date = get('upload_date')
+        duration = get('duration')
+        view_count = get('view_count')
+        title = get('title')
+
+        if upload_date:
+            if self.date_after and upload_date < self.date_after:
+                return f'uploaded at {upload_date} before {self.date_after}'
+
+            if self.date_before and upload_date > self.date_before:
+                return f'uploaded at {upload_date} after {self.date_before}'
+
+        if duration is not None:
+            if self.min_duration is not None and duration < self.min_duration:
+                return f'duration {duration}s shorter than {self.min_duration}s'
+
+            if self.max_duration is not None and duration > self.max_duration:
+                return f'duration {duration}s longer than {self.max_duration}s'
+
+        if view_count is not None and self.min_views is not None and view_count < self.min_views:
+            return f'view count {view_count} less than {self.min_views}'
+
+        if title is not None and self.title_regex and not self.title_regex.search(title):
+            return f'title "{title}" not matching {self.title_regex.pattern}'
+
+        return None
+
+    def match_entry(self, entry, video=None):
+        'Check the flat playlist entry and its stored video row if any before extracting it.'
+        reason = self.reason(entry)
+
+        if not reason and video:
+            reason = self.reason(video.__data__, _STABLE_FIELDS)
+
+        if reason:
+            logger.info(f'Skip extracting entry {entry.get("id")}: {reason}')
+
+            with self._lock:
+                self.skipped_entries += 1
+
+            metrics.incr('filter_skipped_entries')
+
+        return reason is None
+
+    def match_info(self, info):
+        'Check the extracted info dict, counting the size of its selected formats for the rejected one.'
+        reason = self.reason(info)
+
+        if reason:
+            logger.info(f'Reject video {info.get("id")}: {reason}')
+
+            size = self._size(info)
+
+            with self._lock:
+                self.rejected_videos += 1
+                self.bytes_saved += size
+
+            metrics.incr('filter_rejected_videos')
+            metrics.incr('filter_bytes_saved', size)
+
+        return reason is None
+
+    def match_video(self, video):
+        'Check the stored video row.'
+        return self.reason(video.__data__) is None
+
+    @staticmethod
+    def _size(info):
+        formats = info.get('requested_formats') or [info]
+        return sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats)
+
+    def ydl_options(self):
+        'The youtube-dl options enforcing the same criteria before downloading.'
+        def match_filter(info, *args):
+            return None if self.match_info(info) else 'Rejected by the video filter.'
+
+        return {
+            'daterange': DateRange(self.date_after, self.date_before),
+            'match_filter': match_filter,
+        }
+
+    def summary(self):
+        return 'Skipped %d entries before extraction, rejected %d video(s), saved %.1f MiB of downloads.' % (
+            self.skipped_entries, self.rejected_videos, self.bytes_saved / 1024 ** 2)
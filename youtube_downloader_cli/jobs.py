@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+from .models import Job, fn, chunked, EXCLUDED
+import os
+import socket
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+DOWNLOAD_JOB = 'download'
+PARSE_JOB = 'parse'
+
+def worker_id():
+    'The lease owner name of the current thread, unique across hosts, processes and threads.'
+    return '%s:%d:%d' % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+class JobQueue(object):
+    '''Persistent queue of one kind of jobs in the Job table, shared by threads and processes.
+
+    The jobs are claimed with leases, a running job whose lease expires without being
+    renewed, e.g. its worker died, is handed out again until it runs out of attempts.
+    A failed job is put back with an exponential backoff from retry_delay, so the other
+    jobs go first instead of the same one failing over and over.
+    '''
+
+    def __init__(self, kind, lease=timedelta(minutes=2), max_attempts=5, retry_delay=timedelta(seconds=30),
+                 max_retry_delay=timedelta(hours=1)):
+        self.kind = kind
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+    def job(self, key, payload=None):
+        'Build an unsaved pending job, persist it with VideoBatch or enqueue.'
+        return Job(kind=self.kind, key=key, payload=payload, status=PENDING, created_at=datetime.now())
+
+    def enqueue(self, key, payload=None, requeue=False):
+        'Add the job of key unless it is queued already.'
+        self.enqueue_many([(key, payload)], requeue)
+
+    def enqueue_many(self, items, requeue=False, requeue_before=None):
+        '''Add the jobs of the (key, payload) items in one transaction.
+
+        The jobs queued already are left as is, with requeue the finished or failed ones
+        are put back to the queue with the new payload, only those finished before
+        requeue_before if given, the pending and running ones are never touched.
+        '''
+        rows = [self.job(key, payload).__data__ for key, payload in items]
+
+        with Job._meta.database.atomic():
+            for batch in chunked(rows, max(1, 999 // len(Job._meta.sorted_fields))):
+                query = Job.insert_many(batch)
+
+                if requeue:
+                    finished = Job.status.in_([DONE, FAILED])
+
+                    if requeue_before:
+                        finished &= Job.finished_at < requeue_before
+
+                    query = query.on_conflict(
+                        conflict_target=[Job.kind, Job.key],
+                        update={
+                            Job.payload: EXCLUDED.payload,
+                            Job.status: PENDING,
+                            Job.attempts: 0,
+                            Job.lease_owner: None,
+                            Job.lease_expires: None,
+                            Job.not_before: None,
+                            Job.error: None,
+                            Job.started_at: None,
+                            Job.finished_at: None,
+                        },
+                        where=finished)
+                else:
+                    query = query.on_conflict_ignore()
+
+                query.execute()
+
+    def claim(self, owner):
+        'Lease the oldest available job to owner, None if there is no one.'
+        now = datetime.now()
+        expired = (Job.status == RUNNING) & (Job.lease_expires < now)
+
+        with Job._meta.database.atomic():
+            # Give up the jobs whose workers keep dying on them.
+            (Job
+             .update(status=FAILED, error='Lease expired too many times.', finished_at=now)
+             .where((Job.kind == self.kind) & expired & (Job.attempts >= self.max_attempts))
+             .execute())
+
+            available = (Job
+                         .select(Job.id)
+                         .where((Job.kind == self.kind) & (self._due(now) | expired))
+                         .order_by(Job.id)
+                         .limit(1))
+
+            # A single statement, so no other worker can claim the same job in between.
+            claimed = (Job
+                       .update(status=RUNNING, lease_owner=owner, lease_expires=now + self.lease,
+                               attempts=Job.attempts + 1, started_at=now)
+                       .where(Job.id.in_(available))
+                       .execute())
+
+        if not claimed:
+            return None
+
+        return Job.get_or_none((Job.kind == self.kind) & (Job.status == RUNNING) & (Job.lease_owner == owner))
+
+    def renew(self, job):
+        'Extend the lease of the running job.'
+        return self._update(job, lease_expires=datetime.now() + self.lease)
+
+    def complete(self, job, total_bytes=0):
+        'Mark the job done.'
+        return self._update(job, status=DONE, total_bytes=total_bytes or 0, error=None,
+                            lease_expires=None, finished_at=datetime.now())
+
+    def fail(self, job, error, retry=True):
+        '''Put the job back to the queue after its backoff, or mark it failed once it runs out of attempts.
+
+        Without retry the job is marked failed right away, for the errors another attempt
+        won't fix.
+        '''
+        now = datetime.now()
+        status = FAILED if not retry or job.attempts >= self.max_attempts else PENDING
+        not_before = now + min(self.retry_delay * 2 ** max(0, job.attempts - 1), self.max_retry_delay)
+        logger.warning(f'Job {job} failed with {error}, status: {status}' +
+                       (f', retrying after {not_before:%H:%M:%S}' if status == PENDING else ''))
+        return self._update(job, status=status, error=str(error), lease_expires=None, finished_at=now,
+                            not_before=not_before if status == PENDING else None)
+
+    @staticmethod
+    def _due(now):
+        return (Job.status == PENDING) & (Job.not_before.is_null() | (Job.not_before <= now))
+
+    def active(self):
+        'Whether a job is running or pending and due, the ones backing off are left to a later run.'
+        return (Job
+                .select()
+                .where((Job.kind == self.kind) & ((Job.status == RUNNING) | self._due(datetime.now())))
+                .exists())
+
+    def _update(self, job, **fields):
+        # Skip the job reclaimed by another worker in the meantime.
+        return (Job
+                .update(**fields)
+                .where((Job.id == job.id) & (Job.status == RUNNING) & (Job.lease_owner == job.lease_owner))
+                .execute())
+
+    def counts(self):
+        'The number of jobs keyed by status.'
+        query = (Job
+                 .select(Job.status, fn.COUNT(Job.id).alias('count'))
+                 .where(Job.kind == self.kind)
+                 .group_by(Job.status)
+                 .tuples())
+        return dict(query)
+
+    def throughput(self, since):
+        'The number of jobs and bytes finished since then.'
+        count, total_bytes = (Job
+                              .select(fn.COUNT(Job.id), fn.COALESCE(fn.SUM(Job.total_bytes), 0))
+                              .where((Job.kind == self.kind) & (Job.status == DONE) & (Job.finished_at >= since))
+                              .tuples()
+                              .get())
+        return count, total_bytes
@@ -0,0 +1,183 @@
+from collections import deque
+from contextlib import contextmanager
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+JSON_FORMAT = 'json'
+PROMETHEUS_FORMAT = 'prometheus'
+
+class _Timer(object):
+    'Running statistics of a stage, with a bounded window of the latest samples for the percentiles.'
+
+    def __init__(self, window):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class Metrics(object):
+    '''Per-stage timers, counters and gauges of a run.
+
+    Everything is a no-op until enable() is called, so the instrumented code pays one
+    attribute check when the metrics are off.
+    '''
+
+    window = 1024
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+        self._gauges = {}
+        self._exporter = None
+        self._stopping = threading.Event()
+
+    def enable(self):
+        self.enabled = True
+        return self
+
+    @contextmanager
+    def timer(self, name):
+        'Time the block as a sample of the stage name.'
+        if not self.enabled:
+            yield
+            return
+
+        begin = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - begin)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            timer = self._timers.get(name)
+
+            if timer is None:
+                timer = self._timers[name] = _Timer(self.window)
+
+            timer.add(seconds)
+
+    def incr(self, name, value=1):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self):
+        'The current values as a JSON serializable dict.'
+        with self._lock:
+            timers = dict((name, {
+                'count': timer.count,
+                'total': timer.total,
+                'max': timer.max,
+                'p50': timer.percentile(50),
+                'p95': timer.percentile(95),
+                'p99': timer.percentile(99),
+            }) for name, timer in self._timers.items())
+
+            return {
+                'timestamp': time.time(),
+                'timers': timers,
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True, indent=4)
+
+    def to_prometheus(self):
+        'Render the current values in the Prometheus text exposition format.'
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, timer in sorted(snapshot['timers'].items()):
+            metric = 'ytdl_%s_seconds' % _metric_name(name)
+            lines.append('# TYPE %s summary' % metric)
+
+            for quantile in ('50', '95', '99'):
+                lines.append('%s{quantile="0.%s"} %f' % (metric, quantile, timer['p' + quantile]))
+
+            lines.append('%s_sum %f' % (metric, timer['total']))
+            lines.append('%s_count %d' % (metric, timer['count']))
+
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = 'ytdl_%s_total' % _metric_name(name)
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s %s' % (metric, value))
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = 'ytdl_%s' % _metric_name(name)
+            lines.append('# TYPE %s gauge' % metric)
+            lines.append('%s %s' % (metric, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, format=JSON_FORMAT):
+        'Write the current values to path atomically, so the collectors never read a partial file.'
+        content = self.to_prometheus() if format == PROMETHEUS_FORMAT else self.to_json()
+        head, tail = os.path.split(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix='.%s.' % tail, dir=head)
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+
+        os.replace(temp_path, path)
+
+    def start_exporter(self, path, format=JSON_FORMAT, interval=60):
+        'Write the metrics file every interval seconds until stop_exporter().'
+        def run():
+            while not self._stopping.wait(interval):
+                try:
+                    self.write(path, format)
+                except OSError as e:
+                    logger.warning(f'Failed to write the metrics file {path}: {e}')
+
+        self._stopping.clear()
+        self._exporter = threading.Thread(target=run, name='metrics-exporter', daemon=True)
+        self._exporter.start()
+
+    def stop_exporter(self):
+        if self._exporter:
+            self._stopping.set()
+            self._exporter.join()
+            self._exporter = None
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+# The metrics of the current process.
+metrics = Metrics()
@@ -1,9 +1,19 @@
 from peewee import *
 from playhouse.sqlite_ext import *
+from playhouse.migrate import SqliteMigrator, migrate
+from datetime import datetime
 from os.path import exists, join
 from os import remove
-from .config import get_storage_path
-from .translate import translate2chinese as translate
+import os
+import json
+import zlib
+import hashlib
+import logging
+from .config import get_storage_path, ensure_parent_directory
+from .translate import translate2chinese as translate, translate_many, get_translation_cache
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 # http://docs.peewee-orm.com/en/latest/peewee/database.html#run-time-database-configuration
 _db_proxy = DatabaseProxy()
@@ -33,18 +43,36 @@ class Uploader(PeeweeModel):
             return None
 
         item, _ = cls.get_or_create(id=data.get('uploader_id'))
-        item.name = data.get('uploader')
-        item.url = data.get('uploader_url')
+        item._assign(data)
 
         item.save()
         return item
 
+    @classmethod
+    def from_info(cls, data):
+        'Build an unsaved uploader, persist it with VideoBatch.'
+        super(Uploader, cls).initialize(data)
+
+        if not data.get('uploader_id'):
+            return None
+
+        item = cls(id=data.get('uploader_id'))
+        item._assign(data)
+        return item
+
+    def _assign(self, data):
+        self.name = data.get('uploader')
+        self.url = data.get('uploader_url')
+
 class Playlist(PeeweeModel):
     id = CharField(primary_key=True)
     title = CharField(null=True)
     webpage_url = CharField(null=True)
     uploader = ForeignKeyField(Uploader, backref='videos', null=True)
 
+    synced_at = DateTimeField(null=True)
+    watermark = CharField(null=True)
+
     def __str__(self):
         return 'id: %s, title: %s' % (self.id, self.title)
 
@@ -60,6 +88,10 @@ class Playlist(PeeweeModel):
         item.save()
         return item
 
+    def is_fresh(self, refresh_age):
+        'Whether the last full sync happened within refresh_age.'
+        return bool(self.synced_at and self.synced_at >= datetime.now() - refresh_age)
+
 class Video(PeeweeModel):
     id = CharField(primary_key=True)
     title = CharField(null=True)
@@ -78,6 +110,7 @@ class Video(PeeweeModel):
     channel_id = CharField(null=True)
     channel_url = CharField(null=True)
     upload_date = CharField(null=True)
+    uploaded_at = DateField(null=True)
     thumbnail = CharField(null=True)
     description = CharField(null=True)
     categories = JSONField(null=True)
@@ -89,6 +122,24 @@ class Video(PeeweeModel):
     uploader = ForeignKeyField(Uploader, backref='videos', null=True)
     playlist = ForeignKeyField(Playlist, backref='videos', null=True)
 
+    synced_at = DateTimeField(null=True)
+    # Bumped by every write of the row, the sync, the download and the playlist changes.
+    updated_at = DateTimeField(null=True)
+
+    class Meta:
+        # Covering the report aggregates, so a report never reads the table rows.
+        indexes = (
+            (('uploaded_at', 'duration', 'total_bytes'), False),
+            (('channel_id', 'uploaded_at', 'duration', 'total_bytes'), False),
+            (('uploader', 'uploaded_at', 'duration', 'total_bytes'), False),
+            (('playlist', 'uploaded_at', 'duration', 'total_bytes'), False),
+            # The incremental exports.
+            (('updated_at',), False),
+        )
+
+    # The report groupings, keyed by name.
+    REPORT_GROUPS = ('channel', 'uploader', 'playlist', 'year', 'month')
+
     def __str__(self):
         return 'id: %s, title: %s, date: %s' % (self.id, self.title, self.upload_date)
 
@@ -97,39 +148,147 @@ class Video(PeeweeModel):
         super(Video, cls).initialize(data)
 
         item, _ = cls.get_or_create(id=data.get('id'))
-        item.title = data.get('title')
-        item.url = data.get('url')
-        item.webpage_url = data.get('webpage_url')
-        item.duration = data.get('duration')
-        item.width = data.get('width')
-        item.height = data.get('height')
-        item.fps = data.get('fps')
-        item.ext = data.get('ext')
-        item.view_count = data.get('view_count')
-        item.like_count = data.get('like_count')
-        item.average_rating = data.get('average_rating')
-        item.channel_id = data.get('channel_id')
-        item.channel_url = data.get('channel_url')
-        item.upload_date = data.get('upload_date')
-        item.thumbnail = data.get('thumbnail')
-        item.description = data.get('description')
-        item.categories = data.get('categories')
-        item.tags = data.get('tags')
+        item._assign(data)
         item.uploader = Uploader.initialize(data)
 
         item.save()
         return item
 
-    def check_for_upload(self):
-        'Check condition for upload.'
+    def save(self, *args, **kwargs):
+        self.updated_at = datetime.now()
+        return super(Video, self).save(*args, **kwargs)
+
+    @classmethod
+    def from_info(cls, data):
+        'Build an unsaved video, persist it with VideoBatch.'
+        super(Video, cls).initialize(data)
+
+        item = cls(id=data.get('id'))
+        item._assign(data)
+        item.uploader = Uploader.from_info(data)
+        return item
+
+    def _assign(self, data):
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.webpage_url = data.get('webpage_url')
+        self.duration = data.get('duration')
+        self.width = data.get('width')
+        self.height = data.get('height')
+        self.fps = data.get('fps')
+        self.ext = data.get('ext')
+        self.view_count = data.get('view_count')
+        self.like_count = data.get('like_count')
+        self.average_rating = data.get('average_rating')
+        self.channel_id = data.get('channel_id')
+        self.channel_url = data.get('channel_url')
+        self.upload_date = data.get('upload_date')
+        self.uploaded_at = self.parse_upload_date(self.upload_date)
+        self.thumbnail = data.get('thumbnail')
+        self.description = data.get('description')
+        self.categories = data.get('categories')
+        self.tags = data.get('tags')
+        self.synced_at = datetime.now()
 
-        def check_existence(file):
-            return file and exists(join(get_storage_path(), file))
+    @classmethod
+    def stored_videos(cls, ids):
+        'Query the stored videos of ids, keyed by id.'
+        results = {}
+
+        # Stay below the host parameter limit of the old sqlite versions.
+        for batch in chunked(ids, 500):
+            results.update((video.id, video) for video in cls.select().where(cls.id.in_(batch)))
+
+        return results
+
+    @staticmethod
+    def parse_upload_date(value):
+        'The date of the YYYYMMDD upload date, None if missing or malformed.'
+        try:
+            return datetime.strptime(value, '%Y%m%d').date() if value else None
+        except ValueError:
+            return None
+
+    @classmethod
+    def backfill_updated_at(cls):
+        'Start the change times of the rows stored before the column existed at their sync times.'
+        return cls.update(updated_at=cls.synced_at).where(cls.updated_at.is_null()).execute()
 
-        if not check_existence(self.thumbnail):
+    @classmethod
+    def backfill_uploaded_at(cls):
+        'Fill the upload dates of the rows stored before the column existed, returning the number of them.'
+        year = fn.substr(cls.upload_date, 1, 4)
+        month = fn.substr(cls.upload_date, 5, 2)
+        day = fn.substr(cls.upload_date, 7, 2)
+
+        return (cls
+                .update(uploaded_at=fn.date(fn.printf('%s-%s-%s', year, month, day)))
+                .where(cls.uploaded_at.is_null() & (fn.length(cls.upload_date) == 8))
+                .execute())
+
+    @classmethod
+    def report(cls, by, since=None, until=None, uploader=None, playlist=None):
+        '''Aggregate the videos grouped by one of REPORT_GROUPS in SQL, the biggest groups first.
+
+        The query yields (key, name, videos, downloaded, total_bytes, duration, first, last)
+        tuples, the name is the title of the uploader or the playlist if known. The videos
+        with a downloaded size count as downloaded, keeping the filenames out of the indexes.
+        '''
+        assert by in cls.REPORT_GROUPS, f'Unknown report group: {by}'
+        name = Value(None)
+        query = cls.select()
+
+        # The names are looked up once per group rather than joined to every row.
+        if by == 'channel':
+            key = cls.channel_id
+        elif by == 'uploader':
+            key = cls.uploader
+            name = Uploader.select(Uploader.name).where(Uploader.id == key)
+        elif by == 'playlist':
+            key = cls.playlist
+            name = Playlist.select(Playlist.title).where(Playlist.id == key)
+        elif by == 'year':
+            key = fn.strftime('%Y', cls.uploaded_at)
+        else:
+            key = fn.strftime('%Y-%m', cls.uploaded_at)
+
+        if since:
+            query = query.where(cls.uploaded_at >= since)
+
+        if until:
+            query = query.where(cls.uploaded_at <= until)
+
+        if uploader:
+            query = query.where(cls.uploader == uploader)
+
+        if playlist:
+            query = query.where(cls.playlist == playlist)
+
+        videos = fn.COUNT(SQL('*'))
+
+        return (query
+                .select(key.alias('key'), name.alias('name'), videos,
+                        fn.SUM(cls.total_bytes > 0),
+                        fn.COALESCE(fn.SUM(cls.total_bytes), 0),
+                        fn.COALESCE(fn.SUM(cls.duration), 0),
+                        fn.MIN(cls.uploaded_at),
+                        fn.MAX(cls.uploaded_at))
+                .group_by(key)
+                .order_by(videos.desc(), key)
+                .tuples())
+
+    def is_fresh(self, refresh_age):
+        'Whether the video is synced within refresh_age.'
+        return bool(self.synced_at and self.synced_at >= datetime.now() - refresh_age)
+
+    def check_for_upload(self):
+        'Check condition for upload, by the files table rather than the file system.'
+        indexed = File.existing([self.thumbnail, self.filename])
+
+        if self.thumbnail not in indexed:
             return False, 'Invalid video thumbnail!'
 
-        if not check_existence(self.filename):
+        if self.filename not in indexed:
             return False, 'Invalid video file!'
 
         return True, None
@@ -142,6 +301,7 @@ class Video(PeeweeModel):
                 return False
 
             filepath = join(get_storage_path(), file)
+            File.delete().where(File.path == file).execute()
 
             if exists(filepath):
                 remove(filepath)
@@ -161,27 +321,567 @@ class Video(PeeweeModel):
         return translate(self.title)
 
     def localized_tags(self):
-        return list(map(translate, self.tags))
+        return list(map(translate, self.tags or []))
 
     def localized_categories(self):
-        return list(map(translate, self.categories))
+        return list(map(translate, self.categories or []))
 
     def localized_description(self):
         return translate(self.description)
 
+class PlaylistEntry(PeeweeModel):
+    '''A video listed by a playlist, a video shows up in every playlist, tab or channel listing it.
+
+    Video.playlist holds a single one of them, the one the video was last parsed with.
+    uploaded_at copies the upload date of the video, so the latest uploads of a playlist
+    are read off the (playlist, uploaded_at) index without sorting its videos.
+    '''
+
+    playlist = ForeignKeyField(Playlist, backref='entries')
+    video = ForeignKeyField(Video, backref='entries')
+    uploaded_at = DateField(null=True)
+
+    class Meta:
+        primary_key = CompositeKey('playlist', 'video')
+        indexes = (
+            (('video',), False),
+            (('playlist', 'uploaded_at'), False),
+        )
+
+    @classmethod
+    def backfill_uploaded_at(cls, video_ids=None):
+        'Copy the upload dates of the videos into their entries, returning the number of the entries filled.'
+        query = cls.update(uploaded_at=Video
+                           .select(Video.uploaded_at)
+                           .where(Video.id == cls.video))
+
+        if video_ids is not None:
+            query = query.where(cls.video.in_(video_ids))
+
+        return query.where(cls.uploaded_at.is_null()).execute()
+
+    def __str__(self):
+        return 'playlist: %s, video: %s' % (self.playlist_id, self.video_id)
+
+class Cover(PeeweeModel):
+    filename = CharField(primary_key=True)
+    url = CharField(null=True)
+    etag = CharField(null=True)
+    last_modified = CharField(null=True)
+
+    def __str__(self):
+        return 'filename: %s, url: %s' % (self.filename, self.url)
+
+class File(PeeweeModel):
+    '''A file of the storage root by its path relative to it, with its size and mtime when indexed.
+
+    The existence checks, cleanup and reconciliation query this table instead of walking
+    and stat-ing the storage. A partial row stands for the temporary files of a download
+    in progress, its path is the one of the final file with the .part suffix.
+    '''
+
+    MEDIA = 'media'
+    COVER = 'cover'
+    PARTIAL = 'partial'
+
+    path = CharField(primary_key=True)
+    video = ForeignKeyField(Video, backref='files', null=True)
+    kind = CharField()
+    size = BigIntegerField(null=True)
+    mtime = DoubleField(null=True)
+    indexed_at = DateTimeField(default=datetime.now)
+    # The content hash of the file at size and mtime, and what's wrong with it if anything, see verify.
+    checksum = CharField(null=True)
+    problem = CharField(null=True)
+    verified_at = DateTimeField(null=True)
+
+    class Meta:
+        table_name = 'files'
+        indexes = (
+            (('kind', 'path'), False),
+            (('checksum',), False),
+        )
+
+    def __str__(self):
+        return 'path: %s, kind: %s, size: %s' % (self.path, self.kind, self.size)
+
+    @classmethod
+    def stat(cls, path, kind, video_id=None):
+        'Build an unsaved row of the stored file at path, None if it\'s missing.'
+        try:
+            st = os.stat(join(get_storage_path(), path))
+        except FileNotFoundError:
+            return None
+
+        return cls(path=path, video=video_id, kind=kind, size=st.st_size, mtime=st.st_mtime,
+                   indexed_at=datetime.now())
+
+    @classmethod
+    def record(cls, path, kind, video_id=None):
+        'Index the stored file at path, returning its row, None if it\'s missing.'
+        file = cls.stat(path, kind, video_id)
+
+        if file:
+            cls.replace(**file.__data__).execute()
+
+        return file
+
+    @classmethod
+    def existing(cls, paths):
+        'The indexed ones of paths, the partial rows never match a final path.'
+        paths = [path for path in paths if path]
+        results = set()
+
+        # Stay below the host parameter limit of the old sqlite versions.
+        for batch in chunked(paths, 500):
+            query = cls.select(cls.path).where(cls.path.in_(batch))
+            results.update(path for path, in query.tuples())
+
+        return results
+
+class InfoCache(PeeweeModel):
+    url = CharField(primary_key=True)
+    extractor = CharField(null=True)
+    data = BlobField()
+    created_at = DateTimeField(default=datetime.now)
+
+    def __str__(self):
+        return 'url: %s, extractor: %s, date: %s' % (self.url, self.extractor, self.created_at)
+
+    @classmethod
+    def pack(cls, url, info):
+        'Build an unsaved cache item of the extracted info dict, persist it with VideoBatch.'
+        data = zlib.compress(json.dumps(info, default=str).encode('utf-8'))
+        return cls(url=url, extractor=info.get('extractor'), data=data, created_at=datetime.now())
+
+    @classmethod
+    def lookup(cls, urls, ttl=None):
+        'Query the cache items of urls created within ttl, keyed by url.'
+        results = {}
+
+        # Stay below the host parameter limit of the old sqlite versions.
+        for batch in chunked(urls, 500):
+            query = cls.select().where(cls.url.in_(batch))
+
+            if ttl:
+                query = query.where(cls.created_at >= datetime.now() - ttl)
+
+            results.update((item.url, item) for item in query)
+
+        return results
+
+    @classmethod
+    def purge(cls, ttl=None):
+        'Delete the cache items older than ttl, all of them without ttl, returning their number.'
+        query = cls.delete()
+
+        if ttl:
+            query = query.where(cls.created_at < datetime.now() - ttl)
+
+        return query.execute()
+
+    def info(self):
+        'The unpacked info dict.'
+        return json.loads(zlib.decompress(self.data).decode('utf-8'))
+
+class Job(PeeweeModel):
+    kind = CharField()
+    key = CharField()
+    payload = JSONField(null=True)
+    status = CharField(default='pending')
+    attempts = IntegerField(default=0)
+    lease_owner = CharField(null=True)
+    lease_expires = DateTimeField(null=True)
+    # A failed job waits until then before it's claimed again.
+    not_before = DateTimeField(null=True)
+    error = TextField(null=True)
+    total_bytes = BigIntegerField(default=0)
+    created_at = DateTimeField(default=datetime.now)
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+
+    class Meta:
+        indexes = (
+            (('kind', 'key'), True),
+            (('kind', 'status', 'id'), False),
+        )
+
+    def __str__(self):
+        return 'kind: %s, key: %s, status: %s' % (self.kind, self.key, self.status)
+
+class VideoIndex(FTS5Model):
+    '''Full-text index of the searchable video fields, including their cached translations.
+
+    The rowid is derived from the video id, so a video is reindexed by rowid without any
+    lookup, and the index never depends on the rowids of the Video table.
+    '''
+    video_id = SearchField(unindexed=True)
+    title = SearchField()
+    description = SearchField()
+    tags = SearchField()
+    localized_title = SearchField()
+    localized_tags = SearchField()
+
+    class Meta:
+        database = _db_proxy
+        options = {'tokenize': 'unicode61 remove_diacritics 2'}
+
+    # The bm25 weights of the columns in the order above, a title match outranks a tag match
+    # which outranks a description match.
+    WEIGHTS = (0.0, 10.0, 1.0, 5.0, 10.0, 5.0)
+    FIELDS = ('title', 'description', 'tags', 'localized_title', 'localized_tags')
+
+    def __str__(self):
+        return 'video_id: %s, title: %s' % (self.video_id, self.title)
+
+    @staticmethod
+    def key(video_id):
+        'The rowid of video_id, the leading 8 bytes of its digest as a signed integer.'
+        digest = hashlib.blake2b(video_id.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big', signed=True)
+
+    @classmethod
+    def row(cls, video, translations):
+        'The index row of video, with the translations keyed by the source text.'
+        tags = video.tags or []
+
+        return {
+            'rowid': cls.key(video.id),
+            'video_id': video.id,
+            'title': video.title,
+            'description': video.description,
+            'tags': ' '.join(tags),
+            'localized_title': translations.get(video.title),
+            'localized_tags': ' '.join(filter(None, map(translations.get, tags))),
+        }
+
+    @classmethod
+    def sync(cls, videos):
+        'Reindex videos, meant to run in the transaction writing them.'
+        videos = list(videos)
+        texts = [video.title for video in videos if video.title]
+        texts.extend(tag for video in videos for tag in video.tags or [] if tag)
+
+        # The translations are only looked up in the cache, they're indexed once prefetched.
+        translations = get_translation_cache().get_many(texts)
+        rows = [cls.row(video, translations) for video in videos]
+
+        # Stay below the host parameter limit of the old sqlite versions.
+        for batch in chunked(rows, 999 // len(rows[0]) if rows else 1):
+            cls.delete().where(cls.rowid.in_([row['rowid'] for row in batch])).execute()
+            cls.insert_many(batch).execute()
+
+    @classmethod
+    def reindex(cls, size=1000):
+        'Rebuild the index of every stored video, returning the number of them.'
+        count = 0
+
+        with cls._meta.database.atomic():
+            cls.delete().execute()
+
+            for videos in chunked(Video.select().iterator(), size):
+                cls.sync(videos)
+                count += len(videos)
+
+        cls.optimize()
+        return count
+
+    @classmethod
+    def find(cls, query, fields=None, raw=False):
+        '''Query the videos matching the full-text query, best match first, with their score.
+
+        The query is stripped of the FTS5 syntax unless raw, with fields, only these
+        columns are matched.
+        '''
+        if not raw:
+            query = cls.clean_query(query)
+
+        if fields:
+            query = '{%s} : (%s)' % (' '.join(fields), query)
+
+        score = cls.bm25(*cls.WEIGHTS)
+
+        return (Video
+                .select(Video, score.alias('score'))
+                .join(cls, on=(cls.video_id == Video.id))
+                .where(cls.match(query))
+                .order_by(score))
+
+def prefetch_translations(videos, jobs=4):
+    '''Translate the localized fields of videos in batch, so the localized accessors become cache lookups.
+
+    The search index of videos is refreshed with the translations.
+    '''
+
+    texts = []
+
+    for video in videos:
+        texts.append(video.title)
+        texts.append(video.description)
+        texts.extend(video.tags or [])
+        texts.extend(video.categories or [])
+
+    results = translate_many(texts, jobs=jobs)
+
+    with VideoIndex._meta.database.atomic():
+        VideoIndex.sync(videos)
+
+    return results
+
+def iter_translated(videos, jobs=4, size=500):
+    '''Prefetch the translations of the streamed videos a batch at a time, yielding them afterwards.
+
+    The batches keep the grouped translation requests full while the videos come in.
+    '''
+    batch = []
+
+    for video in videos:
+        batch.append(video)
+
+        if len(batch) >= size:
+            prefetch_translations(batch, jobs=jobs)
+            yield from batch
+            batch = []
+
+    if batch:
+        prefetch_translations(batch, jobs=jobs)
+        yield from batch
+
+class VideoBatch(object):
+    '''Collect the parsed videos and persist them with bulk upserts, one transaction per batch.
+
+    The uploaders are deduplicated in memory, and the download output columns of the
+    existing rows are kept unless the batched video carries a new one.
+    '''
+
+    def __init__(self, size=500):
+        self.size = size
+        self._uploaders = {}
+        self._videos = {}
+        self._covers = {}
+        self._infos = {}
+        self._jobs = {}
+        self._files = {}
+        self._entries = set()
+
+    def __len__(self):
+        return len(self._videos)
+
+    def add(self, video, uploader=None):
+        'Schedule the video and its uploader for writing, flushing once the batch is full.'
+        if uploader:
+            self._uploaders[uploader.id] = uploader
+
+        self._videos[video.id] = video
+
+        if len(self._videos) >= self.size:
+            self.flush()
+
+    def add_cover(self, cover):
+        'Schedule the cover validators for writing.'
+        self._covers[cover.filename] = cover
+
+    def add_file(self, file):
+        'Schedule the files table row for writing.'
+        self._files[file.path] = file
+
+    def add_entry(self, playlist_id, video_id):
+        'Schedule the playlist association of the video for writing.'
+        self._entries.add((playlist_id, video_id))
+
+    def add_info(self, info):
+        'Schedule the info cache item for writing.'
+        self._infos[info.url] = info
+
+    def add_job(self, job):
+        'Schedule the job for queueing, the job already queued is left as is.'
+        self._jobs[(job.kind, job.key)] = job
+
+    def flush(self):
+        'Write the collected records in a single transaction.'
+        if not (self._uploaders or self._videos or self._covers or self._infos or self._jobs or self._files or
+                self._entries):
+            return
+
+        uploaders = [self._row(uploader) for uploader in self._uploaders.values()]
+        videos = [self._row(video) for video in self._videos.values()]
+        covers = [self._row(cover) for cover in self._covers.values()]
+        infos = [self._row(info) for info in self._infos.values()]
+        jobs = [self._row(job) for job in self._jobs.values()]
+        files = [self._row(file) for file in self._files.values()]
+        entries = [{'playlist': playlist_id, 'video': video_id} for playlist_id, video_id in self._entries]
+
+        now = datetime.now()
+
+        for row in videos:
+            row['updated_at'] = now
+
+            if row['filename'] is None:
+                row['total_bytes'] = None
+
+        # The entries get the upload dates of the videos of either side of the batch.
+        dated = set(self._videos) | set(video_id for _, video_id in self._entries)
+
+        with metrics.timer('db_flush'), Video._meta.database.atomic():
+            self._upsert(Uploader, uploaders)
+            self._upsert(Video, videos, update={
+                Video.filename: fn.COALESCE(EXCLUDED.filename, Video.filename),
+                Video.total_bytes: fn.COALESCE(EXCLUDED.total_bytes, Video.total_bytes),
+                Video.playlist: fn.COALESCE(EXCLUDED.playlist_id, Video.playlist),
+                # The local cover of a downloaded video is kept over the remote url of a later sync.
+                Video.thumbnail: Case(None, [(EXCLUDED.thumbnail.startswith('http') &
+                                              ~Video.thumbnail.startswith('http'), Video.thumbnail)],
+                                      EXCLUDED.thumbnail),
+            })
+            VideoIndex.sync(self._videos.values())
+            self._upsert(Cover, covers)
+            self._upsert(InfoCache, infos)
+            self._upsert(File, files)
+
+            for batch in chunked(jobs, max(1, 999 // len(Job._meta.sorted_fields))):
+                Job.insert_many(batch).on_conflict_ignore().execute()
+
+            for batch in chunked(entries, 999 // 2):
+                video_ids = list(set(row['video'] for row in batch))
+                known = set(PlaylistEntry
+                            .select(PlaylistEntry.playlist, PlaylistEntry.video)
+                            .where(PlaylistEntry.video.in_(video_ids))
+                            .tuples())
+                listed = set(row['video'] for row in batch if (row['playlist'], row['video']) not in known)
+
+                PlaylistEntry.insert_many(batch).on_conflict_ignore().execute()
+                # A video found by a direct link first gets the playlist found later.
+                (Video
+                 .update(playlist=PlaylistEntry
+                         .select(PlaylistEntry.playlist)
+                         .where(PlaylistEntry.video == Video.id)
+                         .limit(1),
+                         updated_at=now)
+                 .where(Video.id.in_(video_ids) & Video.playlist.is_null())
+                 .execute())
+                # The exported playlists of the videos listed by one more playlist changed.
+                Video.update(updated_at=now).where(Video.id.in_(list(listed))).execute()
+
+            for batch in chunked(list(dated), 999):
+                PlaylistEntry.backfill_uploaded_at(batch)
+
+        metrics.incr('videos_written', len(videos))
+
+        self._uploaders.clear()
+        self._videos.clear()
+        self._covers.clear()
+        self._infos.clear()
+        self._jobs.clear()
+        self._files.clear()
+        self._entries.clear()
+
+    @staticmethod
+    def _row(item):
+        return dict((field.name, item.__data__.get(field.name)) for field in item._meta.sorted_fields)
+
+    @staticmethod
+    def _upsert(model, rows, update=None):
+        if not rows:
+            return
+
+        update = update or {}
+        fields = model._meta.sorted_fields
+        preserve = [field for field in fields if not field.primary_key and field not in update]
+
+        # Stay below the host parameter limit of the old sqlite versions.
+        for batch in chunked(rows, max(1, 999 // len(fields))):
+            model.insert_many(batch).on_conflict(
+                conflict_target=[model._meta.primary_key],
+                preserve=preserve,
+                update=update).execute()
+
 def setup_database(dbpath):
     '''Initialize database.'''
 
-    database = SqliteDatabase(dbpath, pragmas={
+    database = SqliteDatabase(ensure_parent_directory(dbpath), pragmas={
         'journal_mode': 'wal',
     })
     _db_proxy.initialize(database)
 
     database.connect(reuse_if_open=True)
-    database.create_tables([
+
+    models = [
         Uploader,
         Playlist,
         Video,
-    ])
+        PlaylistEntry,
+        Cover,
+        InfoCache,
+        Job,
+        VideoIndex,
+        File,
+    ]
+    backfill = Video.table_exists() and not VideoIndex.table_exists()
+    unindexed = Video.table_exists() and not File.table_exists()
+    unlisted = Video.table_exists() and not PlaylistEntry.table_exists()
+
+    added = _migrate_columns(database, models)
+
+    if (Video, 'uploaded_at') in added:
+        logger.info(f'Filled the upload dates of {Video.backfill_uploaded_at()} stored video(s).')
+
+    if (Video, 'updated_at') in added:
+        Video.backfill_updated_at()
+        # The incremental exports moved to the change times.
+        database.execute_sql('DROP INDEX IF EXISTS video_synced_at')
+
+    database.create_tables(models)
+
+    if added:
+        # Let the planner know the new indexes.
+        database.execute_sql('ANALYZE')
+
+    if backfill:
+        logger.info(f'Indexed {VideoIndex.reindex()} stored video(s) for the full-text search.')
+
+    if unlisted:
+        (PlaylistEntry
+         .insert_from(Video.select(Video.playlist, Video.id).where(Video.playlist.is_null(False)),
+                      [PlaylistEntry.playlist, PlaylistEntry.video])
+         .execute())
+        logger.info(f'Listed {PlaylistEntry.select().count()} stored video(s) in their playlists.')
+
+    if unlisted or (PlaylistEntry, 'uploaded_at') in added:
+        logger.info(f'Dated {PlaylistEntry.backfill_uploaded_at()} playlist entries.')
+
+    if unindexed and Video.select().where(Video.filename.is_null(False)).exists():
+        logger.warning('The downloaded files are not in the files table yet, '
+                       'run "storage migrate" to move them into the sharded layout and index them.')
 
     return database
+
+def _migrate_columns(database, models):
+    '''Add the columns introduced after the tables were created, returning the (model, field name) of them.'''
+
+    migrator = SqliteMigrator(database)
+    operations = []
+    added = []
+
+    for model in models:
+        # The virtual tables can't be altered, nor are they the ones having old schemas.
+        if issubclass(model, VirtualModel) or not model.table_exists():
+            continue
+
+        table = model._meta.table_name
+        columns = set(column.name for column in database.get_columns(table))
+
+        for field in model._meta.sorted_fields:
+            if field.column_name not in columns:
+                # The indexes of the nullable columns are left to create_tables, so they're built
+                # once after the backfill rather than updated row by row.
+                if field.null:
+                    operations.append(migrator.alter_add_column(table, field.column_name, field))
+                else:
+                    operations.append(migrator.add_column(table, field.column_name, field))
+
+                added.append((model, field.name))
+
+    if operations:
+        migrate(*operations)
+
+    return added
@@ -0,0 +1,172 @@
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from .config import get_network_limits
+from .metrics import metrics
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The priorities of the network traffic, the lower value goes first.
+METADATA = 0
+COVER = 1
+MEDIA = 2
+
+_PRIORITY_NAMES = {METADATA: 'metadata', COVER: 'cover', MEDIA: 'media'}
+
+class _PriorityGate(object):
+    'The waiters bookkeeping shared by the bucket and the host slots, the higher priorities pass first.'
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._waiting = Counter()
+
+    def _outranked(self, priority):
+        return any(count for p, count in self._waiting.items() if p < priority)
+
+class TokenBucket(_PriorityGate):
+    '''Thread-safe token bucket of rate bytes per second, refilled up to burst.
+
+    A consumer may take more than the tokens left and put the bucket in debt, the next
+    ones wait until it's paid back, so a large chunk never starves behind the small
+    ones. While a higher priority is waiting, the lower ones hold back.
+    '''
+
+    def __init__(self, rate, burst=None):
+        super(TokenBucket, self).__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+
+    def consume(self, amount, priority=MEDIA):
+        'Take amount tokens, blocking until they are available, returning the seconds waited.'
+        if not self.rate:
+            return 0.0
+
+        begin = time.monotonic()
+
+        with self._condition:
+            self._waiting[priority] += 1
+
+            try:
+                while True:
+                    self._refill()
+
+                    if self._tokens > 0 and not self._outranked(priority):
+                        self._tokens -= amount
+                        break
+
+                    self._condition.wait(max(0.001, -self._tokens / self.rate))
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+        return time.monotonic() - begin
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+class HostSlots(_PriorityGate):
+    'Cap the concurrent requests to a host, handing the freed slots to the higher priorities first.'
+
+    def __init__(self, limit):
+        super(HostSlots, self).__init__()
+        self.limit = limit
+        self.active = 0
+
+    def acquire(self, priority=MEDIA):
+        'Take a slot, blocking until one is free, returning the seconds waited.'
+        begin = time.monotonic()
+
+        with self._condition:
+            self._waiting[priority] += 1
+
+            try:
+                while self.active >= self.limit or self._outranked(priority):
+                    self._condition.wait()
+
+                self.active += 1
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+        return time.monotonic() - begin
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+class NetworkScheduler(object):
+    '''Coordinate the network usage of every transfer in the process.
+
+    The requests take a slot of their host, capped by host_connections or the specific
+    limit of host_limits, and the transferred bytes are paced by a shared token bucket
+    of bandwidth bytes per second. Both serve the metadata before the covers and the
+    covers before the media files. A zero bandwidth or limit means unlimited.
+    '''
+
+    def __init__(self, bandwidth=0, host_connections=0, host_limits=None):
+        self.bandwidth = TokenBucket(bandwidth)
+        self.host_connections = host_connections
+        self.host_limits = dict(host_limits or {})
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _slots(self, host):
+        with self._lock:
+            slots = self._hosts.get(host)
+
+            if slots is None:
+                slots = self._hosts[host] = HostSlots(self.host_limits.get(host, self.host_connections))
+
+            return slots
+
+    @contextmanager
+    def request(self, url, priority=MEDIA):
+        'Hold a connection slot of the host of url during the block.'
+        slots = self._slots(urlparse(url).hostname or '')
+
+        if not slots.limit:
+            yield
+            return
+
+        waited = slots.acquire(priority)
+        metrics.observe('network_slot_wait_%s' % _PRIORITY_NAMES[priority], waited)
+
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def throttle(self, amount, priority=MEDIA):
+        'Pace the transfer of amount bytes within the shared bandwidth.'
+        waited = self.bandwidth.consume(amount, priority)
+
+        if waited:
+            metrics.observe('network_bandwidth_wait_%s' % _PRIORITY_NAMES[priority], waited)
+
+    def iter_content(self, response, chunk_size, priority=MEDIA):
+        'Iterate the body of a streamed response, pacing every chunk.'
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            self.throttle(len(chunk), priority)
+            yield chunk
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    'Get the network scheduler of the process, configured by the NETWORK section of the config.'
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            bandwidth, host_connections, host_limits = get_network_limits()
+            _scheduler = NetworkScheduler(bandwidth, host_connections, host_limits)
+
+    return _scheduler
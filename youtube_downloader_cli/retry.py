@@ -0,0 +1,256 @@
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from .metrics import metrics
+import sys
+import random
+import time
+import threading
+import requests
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    'The host is considered down, the call failed fast without touching the network.'
+
+def _status_code(error):
+    'The HTTP status of a requests or urllib error, None if there is none.'
+    response = getattr(error, 'response', None)
+
+    if response is not None:
+        return response.status_code
+
+    if isinstance(error, HTTPError):
+        return error.code
+
+    return None
+
+def is_retryable(error):
+    '''Whether error is worth another attempt.
+
+    The connection problems, timeouts, 429 and 5xx are, the other HTTP errors and the
+    expected extractor errors, e.g. a private or removed video, are fatal.
+    '''
+    # Nothing raised a youtube-dl error unless it's loaded, don't pay for importing it.
+    ydl_utils = sys.modules.get('youtube_dl.utils')
+
+    if ydl_utils and isinstance(error, ydl_utils.DownloadError):
+        if not error.exc_info:
+            return True
+
+        error = error.exc_info[1]
+
+    if ydl_utils and isinstance(error, ydl_utils.ExtractorError):
+        if getattr(error, 'expected', False):
+            return False
+
+        # youtube-dl keeps no expected flag, only the error it wrapped, e.g. the URLError
+        # of a network problem. Without one it's a private, removed or unsupported video.
+        cause = error.cause or (error.exc_info[1] if error.exc_info else None)
+        return cause is not None and is_retryable(cause)
+
+    status = _status_code(error)
+
+    if status is not None:
+        return status == 429 or status >= 500
+
+    if isinstance(error, CircuitOpenError):
+        return False
+
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                              URLError, ConnectionError, TimeoutError))
+
+def _answered(error):
+    'Whether the fatal error is an answer of the host, an HTTP error or an extractor error.'
+    ydl_utils = sys.modules.get('youtube_dl.utils')
+
+    if ydl_utils and isinstance(error, ydl_utils.DownloadError) and error.exc_info:
+        error = error.exc_info[1]
+
+    if ydl_utils and isinstance(error, ydl_utils.ExtractorError):
+        return True
+
+    return _status_code(error) is not None
+
+def _retry_after(error):
+    'The seconds asked by the Retry-After header of a 429 or 503 response, if any.'
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    return float(value) if value and value.isdigit() else 0
+
+class CircuitBreaker(object):
+    '''Trip after threshold retryable failures in a row, failing fast until reset_timeout passes.
+
+    Then a single call is let through to probe the host, its success closes the breaker
+    and its failure opens it again. A probe ending otherwise is released, so the next
+    call probes instead. A zero threshold never trips.
+    '''
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        'Raise CircuitOpenError unless the call may go ahead, returning whether the call is the probe.'
+        with self._lock:
+            if self._opened_at is None:
+                return False
+
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError('The circuit is open.')
+
+            self._probing = True
+            return True
+
+    def release(self):
+        'End a probe recorded neither as a success nor as a failure.'
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        'Record a retryable failure, returning whether the breaker is open now.'
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+
+            if self.threshold and (self._opened_at is not None or self.failures >= self.threshold):
+                self._opened_at = time.monotonic()
+
+            return self._opened_at is not None
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(url):
+    'The circuit breaker of the host of url, shared by every policy of the process.'
+    host = urlparse(url).hostname or ''
+
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(RetryPolicy.breaker_threshold, RetryPolicy.breaker_reset_timeout)
+
+        return breaker
+
+class RetryPolicy(object):
+    '''Run a call again on the retryable errors, with exponential backoff and full jitter.
+
+    The n-th retry waits a random time up to min(max_delay, base_delay * 2 ** n), or
+    longer if the server asks so with Retry-After. The calls with a url go through the
+    circuit breaker of its host, so once a host is down the new calls fail fast instead
+    of burning every retry of every url. The retries of a call already under way skip
+    the breaker, they still get all of their retries. The retries and the time waited
+    are counted per policy and reported by summary().
+    '''
+
+    breaker_threshold = 5
+    breaker_reset_timeout = 30
+
+    def __init__(self, name, retries=10, base_delay=1.0, max_delay=60.0, classify=is_retryable):
+        self.name = name
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+        self.calls = 0
+        self.retried = 0
+        self.waited = 0.0
+        self.failed = 0
+        self.failed_fast = 0
+        self._lock = threading.Lock()
+
+        with _policies_lock:
+            _policies.append(self)
+
+    def delay(self, retry):
+        'The backoff before the retry-th retry, counted from 0.'
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def call(self, func, url=None, retries=None):
+        '''Return func(), calling it again on the retryable errors up to retries times.
+
+        The last error is raised once the retries are exhausted, a fatal error right away
+        and CircuitOpenError if the host of url is down when the call starts.
+        '''
+        retries = self.retries if retries is None else retries
+        breaker = get_breaker(url) if url else None
+        self._count('calls')
+        retry = 0
+        probing = False
+
+        try:
+            while True:
+                try:
+                    if breaker and not retry:
+                        probing = breaker.before()
+
+                    result = func()
+                except CircuitOpenError:
+                    self._count('failed_fast')
+                    metrics.incr('%s_circuit_open' % self.name)
+                    raise
+                except Exception as e:
+                    if not self.classify(e):
+                        # The host answered, e.g. with a 404 or a private video, so it's up.
+                        if breaker and _answered(e):
+                            breaker.success()
+
+                        self._count('failed')
+                        raise
+
+                    # Counted for the next calls, this one keeps its own retries.
+                    if breaker and breaker.failure() and not retry:
+                        logger.warning(f'The host of {url} keeps failing, failing the other calls fast for now: {e}')
+
+                    probing = False
+
+                    if retry >= retries:
+                        self._count('failed')
+                        raise
+
+                    delay = max(self.delay(retry), min(_retry_after(e), self.max_delay))
+                    retry += 1
+                    self._count('retried')
+                    self._count('waited', delay)
+                    metrics.incr('%s_retries' % self.name)
+                    metrics.incr('%s_retry_wait_seconds' % self.name, delay)
+                    logger.warning(f'Retry {retry}/{retries} of {self.name} {url or ""} in {delay:.1f}s: {e}')
+                    time.sleep(delay)
+                    continue
+
+                if breaker:
+                    breaker.success()
+
+                probing = False
+                return result
+        finally:
+            # Neither a success nor a failure, e.g. an unexpected error or an interrupt.
+            if probing:
+                breaker.release()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def summary(self):
+        return '%s: %d call(s), %d retried, waited %.1fs, %d failed, %d failed fast.' % (
+            self.name, self.calls, self.retried, self.waited, self.failed, self.failed_fast)
+
+_policies = []
+_policies_lock = threading.Lock()
+
+def retry_summary():
+    'The summary lines of the policies that have been called.'
+    with _policies_lock:
+        return '\n'.join(policy.summary() for policy in _policies if policy.calls)
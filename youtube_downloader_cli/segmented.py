@@ -0,0 +1,300 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from requests.adapters import HTTPAdapter
+from .config import get_proxy
+from .metrics import metrics
+from .network import get_scheduler, MEDIA
+from .retry import RetryPolicy
+import os
+import json
+import time
+import threading
+import requests
+import logging
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+SEGMENTS_SUFFIX = '.segments'
+
+_segment_retry = RetryPolicy('media_segment')
+
+class SegmentError(IOError):
+    'The media file is not served as expected, e.g. the size changed in between.'
+
+class RangeNotSupported(SegmentError):
+    'The server ignores the Range requests, the file has to be downloaded as a single stream.'
+
+class SegmentedDownloader(object):
+    '''Download a media url as HTTP Range segments fetched in parallel over a pooled session.
+
+    The segments are written in place into a preallocated "<filepath>.part" file, and the
+    finished ones are recorded in the "<filepath>.segments" map next to it, so an
+    interrupted download resumes with the missing segments only. The map is bound to the
+    size and validators of the remote file, a changed file is downloaded from scratch.
+
+    Every segment takes a connection slot of the media host from the network scheduler,
+    so the segments of all the downloads together stay within its per-host cap.
+    '''
+
+    # (connect, read) timeouts in seconds.
+    timeout = (10, 60)
+    chunk_size = 256 * 1024
+    segment_size = 8 * 1024 ** 2
+    # Seconds between the progress reports.
+    progress_interval = 1
+
+    def __init__(self, segments=4, pool_size=None):
+        self.segments = max(1, segments)
+        self.session = requests.Session()
+        self.session.proxies = {
+            'http': get_proxy(),
+            'https': get_proxy(),
+        }
+
+        pool_size = pool_size or self.segments
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @staticmethod
+    def is_resumable(path):
+        'Whether path is the partial file or the segment map of a resumable download.'
+        if path.endswith(SEGMENTS_SUFFIX):
+            return os.path.exists(path[:-len(SEGMENTS_SUFFIX)] + PART_SUFFIX)
+
+        if path.endswith(PART_SUFFIX):
+            return os.path.exists(path[:-len(PART_SUFFIX)] + SEGMENTS_SUFFIX)
+
+        return False
+
+    def download(self, url, filepath, total_bytes=None, headers=None, progress_hook=None, retry=10):
+        '''Download url to filepath, returning the size of the file.
+
+        The progress hook receives youtube-dl like progress dicts from the calling thread.
+        A RangeNotSupported is raised before anything is written if the server ignores
+        Range, and a SegmentError if the remote size is different from total_bytes.
+        '''
+        headers = dict(headers or {})
+        size, validators = self._probe(url, headers)
+
+        if size is None:
+            raise RangeNotSupported(f'Unable to download {url} in segments, the server ignores Range.')
+
+        if total_bytes and size != total_bytes:
+            raise SegmentError(f'Mismatched size of {url}: {size} bytes served, {total_bytes} expected.')
+
+        part_path = filepath + PART_SUFFIX
+        map_path = filepath + SEGMENTS_SUFFIX
+        state = self._load_map(map_path, part_path, url, size, validators)
+        count = (size + self.segment_size - 1) // self.segment_size
+        pending = [i for i in range(count) if i not in state['done']]
+
+        if state['done']:
+            logger.info(f'Resuming {filepath} with {len(pending)} of {count} segment(s) left.')
+            metrics.incr('media_segments_resumed', count - len(pending))
+
+        left = sum(end - start + 1 for start, end in (self._span(i, size) for i in pending))
+        progress = _Progress(filepath, size, size - left, progress_hook)
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            self._preallocate(fd, size)
+
+            if validators.get('ETag'):
+                headers['If-Range'] = validators['ETag']
+            elif validators.get('Last-Modified'):
+                headers['If-Range'] = validators['Last-Modified']
+
+            lock = threading.Lock()
+            stopping = threading.Event()
+
+            def fetch(index):
+                self._fetch_segment(url, headers, fd, self._span(index, size), progress, stopping, retry)
+
+                with lock:
+                    state['done'].add(index)
+                    self._save_map(map_path, state)
+
+            with ThreadPoolExecutor(max_workers=self.segments, thread_name_prefix='segment') as executor:
+                futures = [executor.submit(fetch, index) for index in pending]
+
+                try:
+                    # The progress is reported from the calling thread, the hooks may touch its state.
+                    while futures:
+                        done, futures = wait(futures, timeout=self.progress_interval, return_when=FIRST_EXCEPTION)
+                        progress.report()
+
+                        for future in done:
+                            future.result()
+                except BaseException:
+                    # Give up the other segments, the finished ones stay in the map.
+                    stopping.set()
+
+                    for future in futures:
+                        future.cancel()
+
+                    raise
+
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if os.path.getsize(part_path) != size:
+            raise SegmentError(f'Mismatched size of {part_path}: {os.path.getsize(part_path)} bytes, {size} expected.')
+
+        os.replace(part_path, filepath)
+        os.remove(map_path)
+        progress.finish()
+        return size
+
+    def _probe(self, url, headers):
+        '''Request the first byte of url, returning (size, validators).
+
+        The size is None unless the server honours Range.
+        '''
+        probe_headers = dict(headers, Range='bytes=0-0')
+
+        with get_scheduler().request(url, MEDIA), \
+                self.session.get(url, headers=probe_headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # An empty file has no first byte.
+                return None, {}
+
+            response.raise_for_status()
+            content_range = response.headers.get('Content-Range', '')
+            validators = dict((key, response.headers[key]) for key in ('ETag', 'Last-Modified') if key in response.headers)
+
+            if response.status_code != 206 or '/' not in content_range:
+                return None, validators
+
+            total = content_range.rsplit('/', 1)[1]
+            return (int(total) if total.isdigit() else None), validators
+
+    def _span(self, index, size):
+        'The inclusive byte range of the segment index.'
+        start = index * self.segment_size
+        return start, min(start + self.segment_size, size) - 1
+
+    def _fetch_segment(self, url, headers, fd, span, progress, stopping, retry):
+        start, end = span
+        segment_headers = dict(headers, Range='bytes=%d-%d' % (start, end))
+
+        def fetch():
+            offset = start
+
+            try:
+                with get_scheduler().request(url, MEDIA), \
+                        self.session.get(url, headers=segment_headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+
+                    if response.status_code != 206:
+                        # The If-Range validator failed, the whole file changed under us.
+                        raise SegmentError(f'The remote file of {url} changed while downloading.')
+
+                    for chunk in get_scheduler().iter_content(response, self.chunk_size, MEDIA):
+                        if stopping.is_set():
+                            raise SegmentError(f'Gave up segment {start}-{end} of {url}.')
+
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        progress.add(len(chunk))
+
+                if offset != end + 1:
+                    raise requests.ConnectionError(f'Short segment {start}-{end} of {url}: {offset - start} bytes.')
+            except BaseException:
+                # Rewind the progress of the partial segment, it's downloaded again.
+                progress.add(start - offset)
+                raise
+
+        _segment_retry.call(fetch, url, retries=retry)
+        metrics.incr('media_segments')
+
+    @staticmethod
+    def _preallocate(fd, size):
+        if os.fstat(fd).st_size == size:
+            return
+
+        os.ftruncate(fd, size)
+
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                # Not supported by every file system, the sparse file works as well.
+                pass
+
+    @staticmethod
+    def _load_map(map_path, part_path, url, size, validators):
+        'The segment map of a resumable download of the same remote file, or a fresh one.'
+        state = {'url': url, 'size': size, 'validators': validators,
+                 'segment_size': SegmentedDownloader.segment_size, 'done': set()}
+
+        if not (os.path.exists(map_path) and os.path.exists(part_path)):
+            return state
+
+        try:
+            with open(map_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f'Ignoring the broken segment map {map_path}.')
+            return state
+
+        if (stored.get('size') == size and stored.get('validators') == validators and
+                stored.get('segment_size') == state['segment_size']):
+            state['done'] = set(stored.get('done', []))
+        else:
+            logger.info(f'The remote file of {url} changed, downloading it from scratch.')
+
+        return state
+
+    @staticmethod
+    def _save_map(map_path, state):
+        'Write the segment map atomically, a crash leaves either the old or the new one.'
+        temp_path = map_path + '.tmp'
+
+        with open(temp_path, 'w') as f:
+            json.dump(dict(state, done=sorted(state['done'])), f)
+
+        os.replace(temp_path, map_path)
+
+    def close(self):
+        self.session.close()
+
+class _Progress(object):
+    'Count the bytes of the segment threads, reporting them to a youtube-dl like progress hook.'
+
+    def __init__(self, filename, total_bytes, downloaded, hook):
+        self.filename = filename
+        self.total_bytes = total_bytes
+        self.downloaded = downloaded
+        self.hook = hook
+        self._initial = downloaded
+        self._begin = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.downloaded += count
+
+    def report(self):
+        elapsed = time.monotonic() - self._begin
+
+        if self.hook:
+            self.hook({
+                'status': 'downloading',
+                'filename': self.filename,
+                'downloaded_bytes': self.downloaded,
+                'total_bytes': self.total_bytes,
+                'elapsed': elapsed,
+                'speed': (self.downloaded - self._initial) / elapsed if elapsed else None,
+            })
+
+    def finish(self):
+        if self.hook:
+            self.hook({
+                'status': 'finished',
+                'filename': self.filename,
+                'downloaded_bytes': self.total_bytes,
+                'total_bytes': self.total_bytes,
+                'elapsed': time.monotonic() - self._begin,
+            })
@@ -0,0 +1,229 @@
+from os.path import exists, join
+from datetime import datetime
+from .config import get_storage_path, get_shard, ensure_parent_directory
+from .models import Video, File, chunked
+from .segmented import PART_SUFFIX, SEGMENTS_SUFFIX
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The suffixes of the temporary files of a download, youtube-dl's and the segmented ones.
+PARTIAL_SUFFIXES = (PART_SUFFIX, '.ytdl', SEGMENTS_SUFFIX)
+
+# The names the downloads produce, "<title>-<video id>.<ext>" for the media files and
+# "<video id>-<name>" for the covers, see the output template and CoverFetcher.
+_MEDIA_NAME = re.compile(r'-[\w-]{11}\.\w+$')
+_COVER_NAME = re.compile(r'^[\w-]{11}-[^/]+\.\w+$')
+# youtube-dl downloads the formats to merge apart, e.g. "<title>-<video id>.f137.mp4.part".
+_FORMAT_NAME = re.compile(r'-[\w-]{11}\.f\w+\.\w+$')
+
+def migrate_layout(batch_size=500, dry_run=False):
+    '''Move the files of the flat storage layout into the shards of their videos, returning the moved count.
+
+    A file is moved before its row is updated, and a rerun after a crash picks up the
+    moved file of a stale row, so the migration can be interrupted at any point. The
+    files table is filled by reconcile afterwards.
+    '''
+    storage_path = get_storage_path()
+    database = Video._meta.database
+    moved = 0
+    # The rows are updated while iterating, collect the flat ones upfront.
+    rows = list(Video
+                .select(Video.id, Video.filename, Video.thumbnail)
+                .where((Video.filename.is_null(False) & ~Video.filename.contains('/')) |
+                       (Video.thumbnail.is_null(False) & ~Video.thumbnail.contains('/')))
+                .tuples())
+
+    for batch in chunked(rows, batch_size):
+        filenames = []
+        thumbnails = []
+
+        for video_id, filename, thumbnail in batch:
+            shard = get_shard(video_id)
+
+            if filename and '/' not in filename and _move(storage_path, filename, shard, dry_run):
+                filenames.append((join(shard, filename), video_id))
+
+            if thumbnail and '/' not in thumbnail and _move(storage_path, thumbnail, shard, dry_run):
+                thumbnails.append((join(shard, thumbnail), video_id, thumbnail))
+
+        moved += len(filenames) + len(thumbnails)
+
+        if dry_run:
+            continue
+
+        now = datetime.now()
+
+        # Plain executemany, building a peewee query per row costs more than the moves.
+        with database.atomic():
+            cursor = database.cursor()
+            cursor.executemany('UPDATE video SET filename = ?, updated_at = ? WHERE id = ?',
+                               [(target, now, video_id) for target, video_id in filenames])
+            cursor.executemany('UPDATE video SET thumbnail = ?, updated_at = ? WHERE id = ?',
+                               [(target, now, video_id) for target, video_id, _ in thumbnails])
+            # The validators of a cover fetched again into the shard win over the old ones.
+            cursor.executemany('UPDATE OR IGNORE cover SET filename = ? WHERE filename = ?',
+                               [(target, thumbnail) for target, _, thumbnail in thumbnails])
+            cursor.executemany('DELETE FROM cover WHERE filename = ?', [(thumbnail,) for _, _, thumbnail in thumbnails])
+
+        logger.info(f'Migrated {moved} file(s) of {len(rows)} video(s) so far.')
+
+    return moved
+
+def _move(storage_path, filename, shard, dry_run):
+    'Move the flat file into shard with its partial files, returning whether it is in the shard now.'
+    source = join(storage_path, filename)
+    target = join(storage_path, shard, filename)
+
+    if exists(target):
+        # Moved by an interrupted run.
+        return True
+
+    if not exists(source):
+        logger.warning(f'Missing file {source}, leaving its row as is.')
+        return False
+
+    if dry_run:
+        logger.info(f'Would move {source} to {target}')
+        return True
+
+    os.replace(source, ensure_parent_directory(target))
+
+    for suffix in PARTIAL_SUFFIXES:
+        if exists(source + suffix):
+            os.replace(source + suffix, target + suffix)
+
+    return True
+
+def _walk(storage_path):
+    'Yield (relative path, stat) of every file under the storage root, with one scandir per directory.'
+    pending = ['']
+
+    while pending:
+        relative = pending.pop()
+
+        with os.scandir(join(storage_path, relative)) as entries:
+            for entry in entries:
+                path = join(relative, entry.name) if relative else entry.name
+
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path, entry.stat(follow_symlinks=False)
+
+def reconcile(batch_size=500):
+    '''Bring the files table in line with the storage, returning (added, updated, removed) counts.
+
+    This is the only full scan of the storage, everything else queries the table. The
+    files are linked to the videos by their filename and thumbnail columns, and the
+    temporary files of a download are indexed as one partial row, the final path with
+    PART_SUFFIX, as the downloads record it. Only the files the downloads could have
+    produced are indexed, the hidden and temporary ones and anything else are skipped.
+    '''
+    storage_path = get_storage_path()
+    owners = _owners()
+    found = {}
+    skipped = 0
+
+    for path, st in _walk(storage_path):
+        kind = _classify(path, owners)
+
+        if kind == File.PARTIAL:
+            found.setdefault(_partial_base(path) + PART_SUFFIX, (File.PARTIAL, None, None))
+        elif kind:
+            found[path] = (kind, st.st_size, st.st_mtime)
+        else:
+            logger.debug(f'Skip indexing the unknown file {path}')
+            skipped += 1
+
+    if skipped:
+        logger.info(f'Skipped {skipped} hidden, temporary or unknown file(s) of the storage.')
+
+    added = updated = removed = 0
+    indexed = {}
+
+    for path, size, mtime, kind in File.select(File.path, File.size, File.mtime, File.kind).tuples().iterator():
+        indexed[path] = (kind, size, mtime)
+
+    database = File._meta.database
+    indexed_at = str(datetime.now())
+
+    with database.atomic():
+        stale = [path for path in indexed if path not in found]
+
+        for batch in chunked(stale, batch_size):
+            removed += File.delete().where(File.path.in_(batch)).execute()
+
+        rows = []
+
+        for path, (kind, size, mtime) in found.items():
+            video_id, _ = owners.get(path, (None, None))
+
+            if path in indexed:
+                if indexed[path] == (kind, size, mtime):
+                    continue
+
+                updated += 1
+            else:
+                added += 1
+
+            rows.append((path, video_id, kind, size, mtime, indexed_at))
+
+        # Plain executemany, peewee takes seconds building the inserts of a large storage.
+        database.cursor().executemany('INSERT OR REPLACE INTO files (path, video_id, kind, size, mtime, indexed_at) '
+                                      'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    return added, updated, removed
+
+def _partial_base(path):
+    'The final path of a temporary download file, None for the other files.'
+    for suffix in PARTIAL_SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+
+    return None
+
+def _classify(path, owners):
+    'The kind of the file at path relative to the storage root, None unless the downloads could have produced it.'
+    if any(part.startswith('.') for part in path.split(os.sep)):
+        # Hidden, e.g. the temporary files of the covers being fetched.
+        return None
+
+    if path in owners:
+        return owners[path][1]
+
+    base = _partial_base(path)
+    name = os.path.basename(base or path)
+
+    if base is not None:
+        return File.PARTIAL if base in owners or _MEDIA_NAME.search(name) or _FORMAT_NAME.search(name) else None
+
+    if _MEDIA_NAME.search(name):
+        return File.MEDIA
+
+    if _COVER_NAME.match(name):
+        return File.COVER
+
+    return None
+
+def _owners():
+    '''The (video id, kind) of the files referenced by the videos, keyed by path.
+
+    A single pass over the videos, the filename and thumbnail columns aren't indexed.
+    '''
+    owners = {}
+
+    for video_id, filename, thumbnail in (Video
+                                          .select(Video.id, Video.filename, Video.thumbnail)
+                                          .tuples()
+                                          .iterator()):
+        if filename:
+            owners[filename] = (video_id, File.MEDIA)
+            owners[filename + PART_SUFFIX] = (video_id, File.PARTIAL)
+
+        if thumbnail:
+            owners[thumbnail] = (video_id, File.COVER)
+
+    return owners
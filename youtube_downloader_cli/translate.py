@@ -1,52 +1,302 @@
 import logging
 import translate
-import time
 import os
 import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from requests.exceptions import ProxyError, ConnectTimeout, ConnectionError
-from .config import get_proxy, TRANSLATION_FILE
+from .config import get_proxy, get_translation_endpoint, ensure_parent_directory, TRANSLATION_FILE, TRANSLATION_DATABASE_FILE
+from .metrics import metrics
+from .network import get_scheduler, METADATA
+from .retry import RetryPolicy, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
+# The longest query accepted by the MyMemory API.
+_GROUP_MAX_LENGTH = 500
+_GROUP_SEPARATOR = '\n'
+
+_translate_retry = RetryPolicy('translate')
+
+class TranslationCache(object):
+    '''Persistent translation cache stored in a sqlite table, fronted by a bounded in-process LRU.
+
+    Every thread opens its own WAL connection and writes single rows, so concurrent
+    processes share the cache safely without rewriting each other's entries.
+    '''
+
+    def __init__(self, path, capacity=10000):
+        self.path = path
+        self.capacity = capacity
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, text, lang='zh'):
+        'Look up the cached translation of text, None if missing.'
+        key = (lang, text)
+
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+
+        row = self._connection().execute(
+            'SELECT result FROM translation WHERE lang = ? AND source = ?', key).fetchone()
+
+        if row:
+            self._remember(key, row[0])
+            return row[0]
+
+        return None
+
+    def get_many(self, texts, lang='zh'):
+        'Look up the cached translations of texts, keyed by the text, the missing ones are left out.'
+        results = {}
+        missing = []
+
+        with self._lock:
+            for text in set(texts):
+                key = (lang, text)
+
+                if key in self._lru:
+                    results[text] = self._lru[key]
+                else:
+                    missing.append(text)
+
+        connection = self._connection()
+
+        # Stay below the host parameter limit of the old sqlite versions.
+        for i in range(0, len(missing), 500):
+            batch = missing[i:i + 500]
+            rows = connection.execute(
+                'SELECT source, result FROM translation WHERE lang = ? AND source IN (%s)' % ', '.join('?' * len(batch)),
+                [lang] + batch).fetchall()
+            results.update(rows)
+
+        return results
+
+    def set(self, text, result, lang='zh'):
+        'Store the translation of text.'
+        connection = self._connection()
+
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO translation (lang, source, result) VALUES (?, ?, ?)', (lang, text, result))
+
+        self._remember((lang, text), result)
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._lru[key] = result
+            self._lru.move_to_end(key)
+
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(ensure_parent_directory(self.path), timeout=30)
+            connection.execute('PRAGMA journal_mode=wal')
+
+            with connection:
+                connection.execute('''CREATE TABLE IF NOT EXISTS translation (
+                    lang TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    PRIMARY KEY (lang, source))''')
+
+            self._import_legacy_file(connection)
+            self._local.connection = connection
+
+        return connection
+
+    def _import_legacy_file(self, connection):
+        'Move the entries of the legacy JSON translation file into the table.'
+        if not os.path.exists(TRANSLATION_FILE):
+            return
+
+        try:
+            with open(TRANSLATION_FILE, 'r') as f:
+                cached_dict = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Failed to read the legacy translation file: {e}')
+            return
+
+        with connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO translation (lang, source, result) VALUES (?, ?, ?)',
+                (('zh', text, result) for text, result in cached_dict.items() if result))
+
+        try:
+            os.replace(TRANSLATION_FILE, TRANSLATION_FILE + '.imported')
+        except OSError:
+            pass  # Imported by another process at the same time.
+
+        logger.info(f'Imported {len(cached_dict)} translation(s) from {TRANSLATION_FILE}')
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_translation_cache():
+    '''Get the shared translation cache.'''
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = TranslationCache(TRANSLATION_DATABASE_FILE)
+
+    return _cache
+
 def translate2chinese(text, retry=10, cache=True):
     '''Translate the text to simplified chinese text.'''
 
     if not (text and len(text) > 0):
         return None
 
-    result = None
-    cached_dict = {}
-
-    if os.path.exists(TRANSLATION_FILE):
-        with open(TRANSLATION_FILE, 'r') as f:
-            cached_dict = json.load(f)
-
-    result = cached_dict.get(text)
+    result = get_translation_cache().get(text)
 
     if result:
+        metrics.incr('translation_cache_hits')
         return result
 
+    metrics.incr('translation_cache_misses')
+    translator = _create_translator(get_translation_endpoint())
+    result = _translate_text(translator, text, retry)
+
+    if cache and result:
+        get_translation_cache().set(text, result)
+
+    logger.debug(f'translate [{text}] to [{result}]')
+    return result or text
+
+def translate_many(texts, jobs=4, retry=10, endpoint=None):
+    '''Translate the texts to simplified chinese text in batch, returning a dict of the results.
+
+    The texts are deduplicated and looked up in the cache first, the missing ones are
+    joined into grouped requests under the API length limit and sent by a small worker
+    pool, every translated text is stored in the cache.
+    '''
+    cache = get_translation_cache()
+    results = {}
+    missing = []
+
+    for text in OrderedDict.fromkeys(text for text in texts if text):
+        result = cache.get(text)
+
+        if result:
+            results[text] = result
+        else:
+            missing.append(text)
+
+    metrics.incr('translation_cache_hits', len(results))
+    metrics.incr('translation_cache_misses', len(missing))
+
+    if not missing:
+        return results
+
+    groups = _group_texts(missing)
+    logger.info(f'Translating {len(missing)} text(s) in {len(groups)} request(s).')
+
+    local = threading.local()
+    endpoint = endpoint if endpoint is not None else get_translation_endpoint()
+
+    def translate_group(group):
+        if not hasattr(local, 'translator'):
+            local.translator = _create_translator(endpoint)
+
+        translated = _translate_group(local.translator, group, retry)
+
+        for text, result in translated.items():
+            cache.set(text, result)
+
+        return translated
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix='translator') as executor:
+        for translated in executor.map(translate_group, groups):
+            results.update(translated)
+
+    return results
+
+def _create_translator(endpoint):
     translator = translate.Translator(to_lang="zh")
 
+    if endpoint:
+        translator.provider.base_url = endpoint
+
+    return translator
+
+def _group_texts(texts):
+    'Pack the texts into groups whose joined length stays under the API limit.'
+    groups = []
+    group, length = [], 0
+
+    for text in texts:
+        # The multiple-line texts can't be split back reliably, send them alone.
+        if _GROUP_SEPARATOR in text or len(text) >= _GROUP_MAX_LENGTH:
+            groups.append([text])
+            continue
+
+        if group and length + len(_GROUP_SEPARATOR) + len(text) > _GROUP_MAX_LENGTH:
+            groups.append(group)
+            group, length = [], 0
+
+        length += len(text) + (len(_GROUP_SEPARATOR) if group else 0)
+        group.append(text)
+
+    if group:
+        groups.append(group)
+
+    return groups
+
+def _translate_group(translator, group, retry):
+    'Translate a group with one request, falling back to one request per text if it fails to split.'
+    joined = _translate_text(translator, _GROUP_SEPARATOR.join(group), retry)
+
+    if not joined:
+        return {}
+
+    parts = joined.split(_GROUP_SEPARATOR)
+
+    if len(parts) == len(group):
+        return dict((text, part.strip()) for text, part in zip(group, parts) if part.strip())
+
+    if len(group) == 1:
+        return {group[0]: joined}
+
+    logger.debug(f'Failed to split the grouped translation, translating {len(group)} text(s) one by one.')
+    results = {}
+
+    for text in group:
+        result = _translate_text(translator, text, retry)
+
+        if result:
+            results[text] = result
+
+    return results
+
+def _translate_text(translator, text, retry):
+    'Translate text with retries on the connection errors, None if failed.'
+    url = translator.provider.base_url
+
+    def translate():
+        with get_scheduler().request(url, METADATA), metrics.timer('translate'):
+            return translator.translate(text)
+
     try:
-        result = translator.translate(text)
+        return _translate_retry.call(translate, url, retries=retry)
+    except CircuitOpenError:
+        logger.warning('Skip translating while the translation endpoint is down.')
     except (ProxyError, ConnectTimeout, ConnectionError) as e:
         logger.error('Connection error!')
-
-        if retry >= 0:
-            time.sleep(5)
-            result = translate2chinese(text, retry=retry-1)
     except AttributeError as e:
         pass
     except Exception as e:
         logger.exception(e)
 
-    if cache and result and len(text) <= 100:
-        cached_dict[text] = result
-
-        with open(TRANSLATION_FILE, 'w') as f:
-            json.dump(cached_dict, f, sort_keys=True, indent=4)
-
-    logger.debug(f'translate [{text}] to [{result}]')
-    return result or text
+    return None
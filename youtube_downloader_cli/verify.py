@@ -0,0 +1,235 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from os.path import join
+from .config import get_storage_path
+from .models import Video, File, fn, chunked
+import os
+import mmap
+import struct
+import hashlib
+import multiprocessing
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The extensions of the ISO base media files, whose box structure tells a truncated file.
+ISO_MEDIA_EXTENSIONS = ('.mp4', '.m4a', '.m4v', '.mov', '.3gp')
+
+MISSING = 'missing file'
+# The problem of a file whose content changed while its size and mtime did not.
+CORRUPTED = 'corrupted, the content changed without its size and mtime'
+
+def hash_file(path, chunk_size=8 * 1024 * 1024):
+    '''Return (path, size, mtime, blake2b hex digest, problem) of the file at path.
+
+    The file is memory mapped and hashed chunk by chunk, the pages go straight from the
+    page cache into the hash without being copied into Python objects. problem is None
+    unless the file is missing, unreadable, empty or truncated. The digest is None only
+    for a missing or unreadable file, the empty and truncated ones are hashed anyway.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            digest = hashlib.blake2b(digest_size=32)
+            problem = None
+
+            if st.st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, 'madvise'):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+                    with memoryview(mapped) as view:
+                        for offset in range(0, st.st_size, chunk_size):
+                            digest.update(view[offset:offset + chunk_size])
+
+                        if path.lower().endswith(ISO_MEDIA_EXTENSIONS):
+                            problem = _check_boxes(view)
+            else:
+                problem = 'empty file'
+
+            return path, st.st_size, st.st_mtime, digest.hexdigest(), problem
+    except FileNotFoundError:
+        return path, None, None, None, MISSING
+    except (OSError, ValueError) as e:
+        return path, None, None, None, 'unreadable file: %s' % e
+
+def _check_boxes(view):
+    'Walk the top level boxes of an ISO base media file, returning the problem if they overrun the file.'
+    size = len(view)
+    offset = 0
+
+    while offset < size:
+        if size - offset < 8:
+            return 'truncated box header at %d' % offset
+
+        length, = struct.unpack_from('>I', view, offset)
+
+        if length == 1:
+            if size - offset < 16:
+                return 'truncated box header at %d' % offset
+
+            length, = struct.unpack_from('>Q', view, offset + 8)
+        elif length == 0:
+            # The last box, up to the end of the file.
+            return None
+
+        if length < 8:
+            return 'invalid box size %d at %d' % (length, offset)
+
+        if offset + length > size:
+            return 'truncated, a box ends at %d of %d bytes' % (offset + length, size)
+
+        offset += length
+
+    return None
+
+class VerifyReport(object):
+    'The outcome of a verify run, the problems found by the earlier runs included.'
+
+    def __init__(self):
+        self.hashed = 0
+        self.hashed_bytes = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+        # (path, problem) of the missing, unreadable, truncated and corrupted files.
+        self.damaged = []
+        # (path, size, expected size) of the media files unlike their Video.total_bytes.
+        self.mismatched = []
+        # The paths of the byte-identical files, per checksum.
+        self.duplicates = {}
+
+    @property
+    def problems(self):
+        return len(self.damaged) + len(self.mismatched)
+
+    def summary(self):
+        rate = self.hashed_bytes / 1024 ** 2 / self.elapsed if self.elapsed else 0
+        return (f'Hashed {self.hashed} file(s), {self.hashed_bytes / 1024 ** 2:.1f} MiB at {rate:.1f} MiB/s, '
+                f'skipped {self.skipped} unchanged. Found {len(self.damaged)} damaged, '
+                f'{len(self.mismatched)} size mismatched file(s) and {len(self.duplicates)} group(s) of duplicates.')
+
+def verify(kinds=(File.MEDIA,), jobs=None, full=False, batch_size=500):
+    '''Hash the indexed files of kinds into the files table, returning a VerifyReport.
+
+    Only the files whose size or mtime changed since they were hashed, or which had a
+    problem, are read again, unless full, which reads everything and tells the silent corruption apart, i.e. a
+    new checksum with the same size and mtime. The problems are kept in the table with
+    the checksum, the checksum of a corrupted file isn't replaced, so the problem is
+    reported until the file is downloaded again. The files are hashed by a pool of jobs
+    processes, all the CPUs by default.
+    '''
+    storage_path = get_storage_path()
+    report = VerifyReport()
+    rows = {}
+    pending = []
+    updates = []
+
+    for path, size, mtime, checksum, problem in (File
+                                                 .select(File.path, File.size, File.mtime, File.checksum,
+                                                         File.problem)
+                                                 .where(File.kind.in_(kinds))
+                                                 .tuples()
+                                                 .iterator()):
+        rows[path] = (size, mtime, checksum)
+
+        try:
+            st = os.stat(join(storage_path, path))
+        except FileNotFoundError:
+            updates.append((checksum, size, mtime, MISSING, path))
+            continue
+
+        # A file with a problem is checked again, e.g. a missing one restored from a backup.
+        if not full and checksum and not problem and (st.st_size, st.st_mtime) == (size, mtime):
+            report.skipped += 1
+        else:
+            pending.append(join(storage_path, path))
+
+    logger.info(f'Hashing {len(pending)} file(s), {report.skipped} unchanged one(s) skipped.')
+    begin = time.perf_counter()
+    _update(updates)
+
+    for batch in chunked(_hash_all(pending, jobs), batch_size):
+        updates = []
+
+        for filepath, size, mtime, checksum, problem in batch:
+            path = os.path.relpath(filepath, storage_path)
+            old_size, old_mtime, old_checksum = rows[path]
+
+            if checksum is None:
+                updates.append((old_checksum, old_size, old_mtime, problem, path))
+                continue
+
+            report.hashed += 1
+            report.hashed_bytes += size
+
+            if old_checksum and old_checksum != checksum and (old_size, old_mtime) == (size, mtime):
+                logger.error(f'The content of {path} changed without touching its size and mtime.')
+                updates.append((old_checksum, size, mtime, CORRUPTED, path))
+            else:
+                updates.append((checksum, size, mtime, problem, path))
+
+        _update(updates)
+
+    report.elapsed = time.perf_counter() - begin
+    report.damaged = list(File
+                          .select(File.path, File.problem)
+                          .where(File.kind.in_(kinds) & File.problem.is_null(False))
+                          .order_by(File.path)
+                          .tuples())
+
+    if File.MEDIA in kinds:
+        report.mismatched = size_mismatches()
+
+    report.duplicates = duplicates(kinds)
+    return report
+
+def _update(updates):
+    'Write the (checksum, size, mtime, problem, path) of the verified files.'
+    database = File._meta.database
+    verified_at = str(datetime.now())
+
+    # Plain executemany like reconcile, a large storage has too many rows for peewee queries.
+    with database.atomic():
+        database.cursor().executemany('UPDATE files SET checksum = ?, size = ?, mtime = ?, problem = ?, '
+                                      'verified_at = ? WHERE path = ?',
+                                      [row[:4] + (verified_at, row[4]) for row in updates])
+
+def _hash_all(filepaths, jobs=None):
+    'Yield the hash_file results of filepaths, in their order, from a process pool.'
+    jobs = jobs or os.cpu_count() or 1
+
+    if jobs <= 1 or len(filepaths) <= 1:
+        yield from map(hash_file, filepaths)
+        return
+
+    # Spawned like the parse workers, so the children never inherit the database connection.
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+        yield from executor.map(hash_file, filepaths, chunksize=4)
+
+def size_mismatches():
+    'The (path, size, expected size) of the media files whose size differs from the downloaded total_bytes.'
+    return list(File
+                .select(File.path, File.size, Video.total_bytes)
+                .join(Video, on=(File.video == Video.id))
+                .where((File.kind == File.MEDIA) & (Video.filename == File.path) & (Video.total_bytes > 0) &
+                       (File.size != Video.total_bytes))
+                .tuples())
+
+def duplicates(kinds=(File.MEDIA,)):
+    'The paths of the byte-identical files of kinds, keyed by their checksum.'
+    groups = (File
+              .select(File.checksum)
+              .where(File.kind.in_(kinds) & File.checksum.is_null(False))
+              .group_by(File.checksum)
+              .having(fn.COUNT(File.path) > 1))
+    results = {}
+
+    for path, checksum in (File
+                           .select(File.path, File.checksum)
+                           .where(File.kind.in_(kinds) & File.checksum.in_(groups))
+                           .order_by(File.checksum, File.path)
+                           .tuples()):
+        results.setdefault(checksum, []).append(path)
+
+    return results
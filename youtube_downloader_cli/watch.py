@@ -0,0 +1,233 @@
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .downloader import YTDownloader
+from .jobs import JobQueue, DOWNLOAD_JOB
+from .metrics import metrics
+from .models import PlaylistEntry, iter_translated
+import heapq
+import json
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Channel(object):
+    'The refresh schedule of a watched url.'
+
+    def __init__(self, url, due):
+        self.url = url
+        self.due = due
+        self.interval = None
+        self.playlist = None
+        self.refreshed_at = None
+        self.videos = 0
+        self.failures = 0
+
+    def __lt__(self, other):
+        return self.due < other.due
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'playlist': self.playlist,
+            'due': datetime.fromtimestamp(self.due).isoformat(timespec='seconds'),
+            'interval': self.interval.total_seconds() if self.interval else None,
+            'refreshed_at': self.refreshed_at.isoformat(timespec='seconds') if self.refreshed_at else None,
+            'videos': self.videos,
+            'failures': self.failures,
+        }
+
+class Watcher(object):
+    '''Refresh the urls in one long-lived process, each as often as its channel uploads.
+
+    The urls wait in a heap ordered by their next refresh. After a refresh, the interval
+    of a url is derived from the upload dates of the latest videos of its playlist, see
+    interval(), so a daily channel is polled a few times a day and a dormant one about
+    once a day. The YTDownloader with its extractors and the database connection are
+    kept for the whole run, and in incremental mode the refresh of an unchanged channel
+    stops at its sync watermark.
+    '''
+
+    # The number of the latest uploads the interval is derived from.
+    history = 10
+    # The polls per the average gap between the uploads.
+    polls_per_upload = 4
+    # The interval of a url without enough dated uploads.
+    default_interval = timedelta(hours=6)
+    # The random spread of the intervals, so the urls added together drift apart.
+    jitter = 0.1
+
+    def __init__(self, urls, min_interval=timedelta(minutes=30), max_interval=timedelta(days=1), translate=False,
+                 **options):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.translate = translate
+        self.options = options
+        self.refreshes = 0
+        self.started_at = datetime.now()
+        self._refreshing = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = None
+
+        now = time.time()
+        self._heap = [Channel(url, now) for url in dict.fromkeys(urls)]
+        heapq.heapify(self._heap)
+
+    def interval(self, playlist_id, today=None):
+        '''The time until the next refresh of the playlist, from the upload dates of its latest videos.
+
+        The average gap between the latest uploads is polled polls_per_upload times, a
+        channel quiet for longer than twice its gap is polled as if that silence was its
+        gap. The result is clamped within min_interval and max_interval.
+        '''
+        if not playlist_id:
+            return self.max_interval
+
+        # Every video listed by the playlist counts, not only the ones last parsed with it.
+        dates = [uploaded_at for uploaded_at, in (PlaylistEntry
+                                                  .select(PlaylistEntry.uploaded_at)
+                                                  .where((PlaylistEntry.playlist == playlist_id) &
+                                                         PlaylistEntry.uploaded_at.is_null(False))
+                                                  .order_by(PlaylistEntry.uploaded_at.desc())
+                                                  .limit(self.history)
+                                                  .tuples())]
+
+        if len(dates) < 2:
+            interval = self.default_interval
+        else:
+            gap = (dates[0] - dates[-1]) / (len(dates) - 1)
+            idle = (today or date.today()) - dates[0]
+            interval = max(gap, idle / 2) / self.polls_per_upload
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def run(self):
+        'Refresh the urls when they are due until stop() is called.'
+        if not self._heap:
+            logger.warning('Nothing to watch.')
+            return
+
+        logger.info(f'Watching {len(self._heap)} url(s).')
+
+        with YTDownloader(**self.options) as downloader:
+            while not self._stopping.is_set():
+                with self._lock:
+                    delay = self._heap[0].due - time.time()
+
+                if delay > 0 and self._stopping.wait(delay):
+                    break
+
+                with self._lock:
+                    channel = heapq.heappop(self._heap)
+                    self._refreshing = channel
+
+                try:
+                    self._refresh(downloader, channel)
+                finally:
+                    with self._lock:
+                        self._refreshing = None
+                        heapq.heappush(self._heap, channel)
+
+                logger.info(f'Next refresh of {channel.url} in {channel.interval}, '
+                            f'at {datetime.fromtimestamp(channel.due):%Y-%m-%d %H:%M:%S}.')
+
+    def _refresh(self, downloader, channel):
+        failures = downloader.failures
+        channel.videos = 0
+        # Only the repeats within a refresh are skipped, a later refresh must see the changes.
+        downloader.memo.clear()
+
+        try:
+            with metrics.timer('watch_refresh'):
+                videos = downloader.iter_parse(channel.url)
+
+                if self.translate:
+                    videos = iter_translated(videos, jobs=downloader.jobs)
+
+                for video in videos:
+                    logger.debug('Result: %s' % video)
+                    channel.videos += 1
+        except Exception as e:
+            logger.exception(f'Encounter an exception [{e}] when refreshing url [{channel.url}]')
+            downloader.failures += 1
+
+        playlist = downloader.result_playlist
+        channel.playlist = playlist.id if playlist else None
+        channel.refreshed_at = datetime.now()
+        self.refreshes += 1
+        metrics.incr('watch_refreshes')
+
+        if downloader.failures > failures:
+            # Try again soon, the upload history says nothing about an outage.
+            channel.failures += 1
+            channel.interval = self.min_interval
+            metrics.incr('watch_failures')
+        else:
+            channel.failures = 0
+            channel.interval = self.interval(channel.playlist)
+
+        spread = random.uniform(1 - self.jitter, 1 + self.jitter)
+        channel.due = time.time() + channel.interval.total_seconds() * spread
+
+    def stop(self):
+        'Stop once the running refresh is done.'
+        self._stopping.set()
+
+    def status(self):
+        'The schedule and backlog as a JSON serializable dict.'
+        now = time.time()
+
+        with self._lock:
+            schedule = [channel.to_dict() for channel in sorted(self._heap)]
+            overdue = sum(1 for channel in self._heap if channel.due <= now)
+            refreshing = self._refreshing.url if self._refreshing else None
+
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'refreshes': self.refreshes,
+            'refreshing': refreshing,
+            'overdue': overdue,
+            'downloads': JobQueue(DOWNLOAD_JOB).counts(),
+            'schedule': schedule,
+        }
+
+    def serve_status(self, port, host='127.0.0.1'):
+        'Serve status() at /status and the metrics at /metrics in background.'
+        self._server = ThreadingHTTPServer((host, port), _StatusHandler)
+        self._server.daemon_threads = True
+        self._server.watcher = self
+        thread = threading.Thread(target=self._server.serve_forever, name='watch-status', daemon=True)
+        thread.start()
+        logger.info(f'Serving the watch status at http://{host}:{self._server.server_port}/status')
+        return self._server.server_port
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class _StatusHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path in ('/', '/status'):
+            body = json.dumps(self.server.watcher.status(), indent=4).encode('utf-8')
+            content_type = 'application/json'
+        elif self.path == '/metrics':
+            body = metrics.to_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Status request: ' + format % args)
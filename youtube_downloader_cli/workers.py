@@ -0,0 +1,146 @@
+from .downloader import YTDownloader
+from .filters import VideoFilter
+from .jobs import JobQueue, PARSE_JOB, worker_id
+from .models import Playlist, setup_database, iter_translated
+from .retry import retry_summary, is_retryable
+import multiprocessing
+import threading
+import time
+import logging
+import logging.config
+
+logger = logging.getLogger(__name__)
+
+class ParseWorker(object):
+    '''Claim and parse the urls queued in the Job table until the backlog is drained.
+
+    A playlist url queues its entries as jobs of their own, so the entries spread over
+    every worker sharing the database, in this process or the others on the machine. The
+    database must be on a local disk, the WAL mode of SQLite doesn't work over a network
+    filesystem. The lease of the running job is renewed in background, the job of a
+    dead worker is handed out again once its lease expires.
+    '''
+
+    poll_interval = 5
+    renew_interval = 30
+
+    def __init__(self, queue=None, translate=False, filter_options=None, **options):
+        self.queue = queue or JobQueue(PARSE_JOB)
+        self.translate = translate
+        self.video_filter = VideoFilter(**(filter_options or {}))
+        self.options = options
+        self._job = None
+        self._stopping = threading.Event()
+
+    def run(self):
+        'Parse the queued urls, returning once no job is pending or running anywhere.'
+        owner = worker_id()
+        renewer = threading.Thread(target=self._renew, name='lease-renewer', daemon=True)
+        renewer.start()
+
+        try:
+            with YTDownloader(video_filter=self.video_filter, parse_queue=self.queue, **self.options) as downloader:
+                while True:
+                    job = self.queue.claim(owner)
+
+                    if job:
+                        self._parse(downloader, job)
+                    elif self._busy():
+                        # Another worker may still queue the entries of its playlist.
+                        time.sleep(self.poll_interval)
+                    else:
+                        break
+
+                logger.info(downloader.memo.summary())
+        finally:
+            self._stopping.set()
+            renewer.join()
+
+        logger.info(self.video_filter.summary())
+        summary = retry_summary()
+
+        if summary:
+            logger.info('Retries of this worker:\n' + summary)
+
+    def _busy(self):
+        return self.queue.active()
+
+    def _parse(self, downloader, job):
+        url = job.payload['url']
+        playlist_id = job.payload.get('playlist')
+        playlist = Playlist.get_or_none(Playlist.id == playlist_id) if playlist_id else None
+        failures = downloader.failures
+        fatal_failures = downloader.fatal_failures
+        self._job = job
+
+        try:
+            logger.info(f'Parsing {job}')
+            videos = downloader.iter_parse(url, playlist=playlist)
+
+            if self.translate:
+                videos = iter_translated(videos, jobs=downloader.jobs)
+
+            for video in videos:
+                logger.debug('Result: %s' % video)
+        except Exception as e:
+            logger.exception(f'Encounter an exception [{e}] when parsing url [{url}]')
+            self.queue.fail(job, e, retry=is_retryable(e))
+            return
+        finally:
+            self._job = None
+
+        failed = downloader.failures - failures
+        fatal = downloader.fatal_failures - fatal_failures
+
+        if failed:
+            # Only worth another attempt if some url may extract later.
+            self.queue.fail(job, f'Failed to extract {failed} url(s).', retry=failed > fatal)
+        else:
+            self.queue.complete(job)
+
+    def _renew(self):
+        while not self._stopping.wait(self.renew_interval):
+            job = self._job
+
+            if job:
+                self.queue.renew(job)
+
+def run_parse_worker(database_file, logging_config=None, **kwargs):
+    'The entry of the parse worker processes.'
+    if logging_config:
+        logging.config.dictConfig(logging_config)
+
+    setup_database(database_file)
+    ParseWorker(**kwargs).run()
+
+class ParsePool(object):
+    '''Run ParseWorker in worker processes over the backlog of the database file.
+
+    The processes are spawned rather than forked, so they inherit neither the database
+    connection nor the threads of the parent.
+    '''
+
+    def __init__(self, workers, database_file, logging_config=None, **kwargs):
+        self.workers = max(1, workers)
+        self.database_file = database_file
+        self.logging_config = logging_config
+        self.kwargs = kwargs
+        self._processes = []
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+
+        for i in range(self.workers):
+            process = context.Process(target=run_parse_worker, name='parser-%d' % i,
+                                      args=(self.database_file, self.logging_config), kwargs=self.kwargs)
+            process.start()
+            self._processes.append(process)
+
+    def join(self):
+        'Wait for the workers to drain the backlog, returning the number of the ones failed.'
+        for process in self._processes:
+            process.join()
+
+        failed = sum(1 for process in self._processes if process.exitcode)
+        self._processes = []
+        return failed